@@ -4,46 +4,62 @@
 """
 Este es el script principal que ejecuta el bot de Discord. Sus responsabilidades clave son:
 - Cargar configuraciones y claves de API desde variables de entorno.
-- Inicializar las conexiones con las APIs externas (Discord, Google Gemini, ElevenLabs).
+- Inicializar las conexiones con las APIs externas (Discord y, al primer uso, Google Gemini y ElevenLabs).
 - Configurar la instancia del bot de Discord, incluyendo intenciones y prefijo de comando.
 - Manejar eventos globales del bot como 'on_ready', 'on_message', y 'on_command_error'.
 - Cargar dinámicamente todos los módulos de comandos (Cogs) desde la carpeta /cogs.
 - Implementar un sistema de comandos dinámicos que se cargan desde la base de datos.
-- Ejecutar un servidor web simple (Flask) para mantener el bot activo en plataformas de hosting como Render.
+- Ejecutar un servidor web (aiohttp, en el mismo bucle de eventos) con /healthz, /readyz y /metrics para Render y la monitorización.
 - Gestionar el ciclo de vida del bot, incluyendo el inicio y el apagado seguro.
+- Registrar la actividad con `logging` (cola sin bloqueo, JSON con guild/usuario/comando, ficheros rotados).
 """
 
-print("--- [FASE 0] INICIANDO SCRIPT BOT.PY ---")
+import time
+_INICIO = time.perf_counter()
 import os
 import sys
+import signal
+import logging
 import asyncio
+import threading
 import discord
 from discord.ext import commands
-import google.generativeai as genai
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-from flask import Flask
-from threading import Thread
-
-from utils.db_manager import setup_database, db_execute
 
 # --- Carga y Configuración ---
 # Carga las variables de entorno desde el archivo .env para mantener las claves seguras.
+# Va antes de importar `utils.*`: sus módulos leen su configuración (LOG_*, DB_POOL_*, ...) al importarse.
 load_dotenv()
+
+from utils.db_manager import setup_database, init_db_pool, close_db_pool
+from utils.ia_cache import IAContextCache
+from utils.gemini_scheduler import GeminiScheduler
+from utils.command_registry import CommandRegistry
+from utils.change_listener import PostgresChangeListener
+from utils.sharding import shard_config_from_env
+from utils.web_server import WebServer
+from utils.metrics import metrics, instrument_discord_http, StartupTimer, TIPO_COMANDO
+from utils.logging_setup import setup_logging, bind_command_context
+
+# El registro se escribe desde un hilo propio: ningún `log.*` bloquea el bucle de eventos.
+setup_logging()
+log = logging.getLogger('bot')
+log.info("Iniciando bot.py")
+
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
 DATABASE_URL = os.getenv('DATABASE_URL')
+# Los comandos que tardan más de esto (en segundos) se registran como WARNING con su latencia.
+SLOW_COMMAND_SECONDS = float(os.getenv('SLOW_COMMAND_SECONDS', '10'))
 
 # Verificación de variables de entorno críticas
 if not all([DISCORD_TOKEN, GEMINI_API_KEY, DATABASE_URL]):
-    print("--- [ERROR CRÍTICO] DISCORD_TOKEN, GEMINI_API_KEY, y DATABASE_URL deben estar definidos. ---")
+    log.critical("DISCORD_TOKEN, GEMINI_API_KEY, y DATABASE_URL deben estar definidos.")
     sys.exit(1)
 
 # --- Configuración de APIs y Bot ---
-# Configura la API de Gemini con la clave y ajustes de seguridad para permitir todo tipo de contenido.
-genai.configure(api_key=GEMINI_API_KEY)
-
+# Ajustes de seguridad de Gemini para permitir todo tipo de contenido.
 safety_settings = [
     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
@@ -56,69 +72,192 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-# Crea la instancia principal del bot, definiendo el prefijo '!' para los comandos.
-bot = commands.Bot(command_prefix='!', intents=intents, case_insensitive=True, help_command=None)
-
-# --- Inicialización de Clientes y Modelos ---
-try:
-    # Inicializa el modelo de IA generativa de Gemini que se usará en los cogs.
-    bot.gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest', safety_settings=safety_settings)
-    print("--- [CONFIG] Cliente de Gemini AI inicializado. ---")
-except Exception as e:
-    print(f"--- [ERROR CRÍTICO] No se pudo inicializar el modelo de Gemini: {e}. El bot no puede iniciar. ---")
-    sys.exit(1)
+class MiBotMixin:
+    """
+    Comportamiento común del bot, con o sin shards:
+    - Los clientes de Gemini y ElevenLabs se crean la primera vez que se usan: sus SDK tardan en
+      importarse y no hacen falta para conectar con Discord.
+    - `setup_hook` prepara el esquema y carga las cachés una sola vez, antes de conectar al gateway
+      (`on_ready` se repite en cada reconexión).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._gemini_model = None
+        self._elevenlabs_client = None
+        self._elevenlabs_async_client = None
+        self._clients_lock = threading.Lock()
+
+    @property
+    def gemini_model(self):
+        """Modelo de Gemini; `google.generativeai` se importa y configura en el primer uso."""
+        if self._gemini_model is None:
+            with self._clients_lock:
+                if self._gemini_model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=GEMINI_API_KEY)
+                    self._gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest', safety_settings=safety_settings)
+                    log.info("Cliente de Gemini AI inicializado.")
+        return self._gemini_model
 
-if ELEVENLABS_API_KEY:
-    # Si se proporciona una clave de ElevenLabs, inicializa el cliente para funciones de texto a voz.
-    bot.elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    print("--- [CONFIG] Cliente de ElevenLabs inicializado. ---")
+    async def get_gemini_model(self):
+        """Como `gemini_model`, pero la primera vez crea el cliente en un hilo para no importar el SDK en el bucle de eventos."""
+        if self._gemini_model is not None:
+            return self._gemini_model
+        return await asyncio.to_thread(lambda: self.gemini_model)
+
+    @property
+    def elevenlabs_client(self):
+        """Cliente de ElevenLabs creado en el primer uso, o None si no hay ELEVENLABS_API_KEY (audio deshabilitado)."""
+        if self._elevenlabs_client is None and ELEVENLABS_API_KEY:
+            with self._clients_lock:
+                if self._elevenlabs_client is None:
+                    from elevenlabs.client import ElevenLabs
+                    self._elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+                    log.info("Cliente de ElevenLabs inicializado.")
+        return self._elevenlabs_client
+
+    @property
+    def elevenlabs_async_client(self):
+        """Cliente asíncrono de ElevenLabs (para leer el audio por fragmentos sin hilos), o None si no hay clave."""
+        if self._elevenlabs_async_client is None and ELEVENLABS_API_KEY:
+            with self._clients_lock:
+                if self._elevenlabs_async_client is None:
+                    from elevenlabs.client import AsyncElevenLabs
+                    self._elevenlabs_async_client = AsyncElevenLabs(api_key=ELEVENLABS_API_KEY)
+        return self._elevenlabs_async_client
+
+    async def setup_hook(self):
+        """
+        Se ejecuta una vez, tras iniciar sesión y antes de conectar al gateway:
+        - Aplica las migraciones pendientes de la base de datos.
+        - Carga a la vez el registro de comandos y la caché de perfiles y reglas de la IA.
+        - Empieza a escuchar los cambios de configuración hechos por otros procesos.
+        """
+        self.startup.lap('inicio de sesión')
+        await asyncio.to_thread(setup_database)
+        self.startup.lap('esquema de BD')
+
+        dinamicos, perfiles = await asyncio.gather(self.command_registry.load(), self.ia_cache.load(), return_exceptions=True)
+        if isinstance(dinamicos, Exception):
+            log.error("Error al cargar el registro de comandos: %s", dinamicos, exc_info=dinamicos)
+        else:
+            log.info("Registro de comandos cargado: %s comandos dinámicos", dinamicos)
+        if isinstance(perfiles, Exception):
+            log.error("Error al precargar la caché de IA: %s", perfiles, exc_info=perfiles)
+        else:
+            log.info("Caché de IA cargada: %s perfiles", perfiles)
+        self.caches_warm = not isinstance(dinamicos, Exception) and not isinstance(perfiles, Exception)
+
+        # Con las cachés ya cargadas, se escuchan los cambios del resto de procesos.
+        try:
+            await self.change_listener.start()
+        except Exception as e:
+            log.exception("Error al iniciar la escucha de cambios: %s", e)
+        self.startup.lap('cachés')
+
+class MiBot(MiBotMixin, commands.Bot):
+    pass
+
+class MiBotConShards(MiBotMixin, commands.AutoShardedBot):
+    pass
+
+# Crea la instancia principal del bot, definiendo el prefijo '!' para los comandos.
+# Con SHARD_COUNT/SHARD_IDS (o AUTO_SHARD=1) se usa AutoShardedBot y este proceso solo gestiona sus shards.
+shard_config = shard_config_from_env()
+if shard_config is None:
+    bot = MiBot(command_prefix='!', intents=intents, case_insensitive=True, help_command=None)
 else:
-    # Si no hay clave, se deshabilita la funcionalidad de audio.
-    bot.elevenlabs_client = None
-    print("--- [ADVERTENCIA] No se encontró ELEVENLABS_API_KEY. Los comandos de audio estarán deshabilitados. ---")
+    bot = MiBotConShards(command_prefix='!', intents=intents, case_insensitive=True, help_command=None, **shard_config)
+    log.info("Modo con shards: %s de %s", shard_config['shard_ids'] or 'automáticos', shard_config['shard_count'] or 'auto')
+
+# Todas las llamadas a Gemini pasan por el planificador (límite de tasa, concurrencia, reintentos y prioridades).
+bot.gemini = GeminiScheduler(bot)
+if not ELEVENLABS_API_KEY:
+    log.warning("No se encontró ELEVENLABS_API_KEY. Los comandos de audio estarán deshabilitados.")
 
 # --- Estado Global del Bot ---
 # Diccionarios para almacenar estados que necesitan ser accesibles globalmente.
 bot.elevenlabs_voices = {}
-bot.dynamic_commands = {}
+bot.command_registry = CommandRegistry(bot) # Estados, permisos y comandos dinámicos en memoria.
+bot.ia_cache = IAContextCache() # Caché del contexto de la IA (perfiles y reglas).
 bot.failed_cogs = [] # Lista para rastrear cogs que no se cargaron.
+bot.change_listener = PostgresChangeListener(bot) # Aplica los cambios hechos por otros procesos del bot.
+bot.web_server = WebServer(bot) # /healthz, /readyz y /metrics en el mismo bucle de eventos.
+bot.caches_warm = False # Pasa a True cuando las cachés se cargaron en setup_hook (lo usa /readyz).
+instrument_discord_http(bot) # Mide cada llamada REST a Discord (envíos, reacciones...) en `metrics`.
+bot.startup = StartupTimer(_INICIO) # Duración de cada fase del arranque.
+bot.startup.lap('importaciones y configuración')
 
 # --- Eventos Principales del Bot ---
 @bot.event
 async def on_ready():
     """
-    Se ejecuta una vez que el bot se ha conectado exitosamente a Discord.
-    - Configura la base de datos.
-    - Carga los comandos dinámicos desde la base de datos a la memoria.
-    - Imprime un mensaje de confirmación.
+    Se ejecuta cada vez que el bot se conecta (o reconecta) a Discord. La preparación de la base de
+    datos y las cachés ya se hizo en `setup_hook`; aquí solo se registra el informe de arranque la
+    primera vez y se precarga el SDK de Gemini en un hilo para que el primer `!reply` no lo espere.
     """
-    await asyncio.to_thread(setup_database)
-    # Cargar comandos dinámicos al iniciar
+    if not bot.startup.done:
+        bot.startup.lap('conexión al gateway')
+        bot.startup.done = True
+        log.info("Arranque completado: %s", bot.startup.report())
+        asyncio.create_task(precargar_gemini())
+    log.info("Bot conectado y listo: %s", bot.user)
+
+async def precargar_gemini():
+    """Importa y configura el SDK de Gemini en un hilo, ya conectado a Discord."""
     try:
-        records = await db_execute("SELECT nombre_comando, respuesta_comando FROM comandos_dinamicos", fetch='all')
-        bot.dynamic_commands = {row[0]: row[1] for row in records}
-        print(f"--- [FASE 1.1] {len(bot.dynamic_commands)} COMANDOS DINÁMICOS CARGADOS ---")
+        await bot.get_gemini_model()
     except Exception as e:
-        print(f"Error al cargar comandos dinámicos: {e}")
-    print(f'--- [FASE 1] BOT CONECTADO Y LISTO: {bot.user} ---')
+        log.warning("No se pudo precargar el cliente de Gemini: %s", e)
 
 @bot.event
 async def on_message(message):
     """
     Se ejecuta cada vez que se envía un mensaje en cualquier canal que el bot pueda ver.
-    - Ignora los mensajes de otros bots.
-    - Comprueba si el mensaje es un comando dinámico personalizado. Si lo es, envía la respuesta y termina.
-    - Si no es un comando dinámico, lo pasa al procesador de comandos estándar de discord.ext.
+    - Ignora los mensajes de otros bots y los que no empiezan por el prefijo.
+    - Analiza el mensaje una sola vez con `get_context` y resuelve el comando:
+      primero los comandos fijos, después los dinámicos (o sus alias) del registro en memoria.
+    - Si no es ninguno, `invoke` lanza CommandNotFound y el manejador de errores sugiere nombres parecidos.
     """
     if message.author.bot or not message.content.startswith(bot.command_prefix):
         return
-    
-    command_name = message.content.split()[0][len(bot.command_prefix):].lower()
-    if command_name in bot.dynamic_commands:
-        await message.channel.send(bot.dynamic_commands[command_name])
-        return
-        
-    await bot.process_commands(message)
+
+    ctx = await bot.get_context(message)
+    if ctx.command is None and ctx.invoked_with:
+        dinamico = bot.command_registry.get_dinamico(ctx.invoked_with.lower())
+        if dinamico:
+            await message.channel.send(dinamico['respuesta'])
+            return
+
+    await bot.invoke(ctx)
+
+@bot.check
+async def comprobar_permisos_comando(ctx):
+    """
+    Check global que aplica los comandos privados (`!privatizar`) y las llaves (`!permitir`).
+    Solo consulta el registro en memoria; si está caducado, se recarga en segundo plano.
+    """
+    bot.command_registry.refresh_if_stale()
+    return bot.command_registry.puede_usar(ctx)
+
+@bot.before_invoke
+async def iniciar_medicion(ctx):
+    """Marca el inicio del comando (tras pasar los checks y convertir los argumentos) y su contexto de registro."""
+    bind_command_context(ctx)
+    ctx.perf_start = time.perf_counter()
+
+@bot.after_invoke
+async def registrar_medicion(ctx):
+    """
+    Registra la duración del comando en `metrics` (los que terminaron con error se cuentan aparte)
+    y deja un registro con la latencia; los que pasan de SLOW_COMMAND_SECONDS se avisan como WARNING.
+    """
+    start = getattr(ctx, 'perf_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        metrics.observe(TIPO_COMANDO, ctx.command.qualified_name, elapsed, error=ctx.command_failed)
+        nivel = logging.WARNING if elapsed > SLOW_COMMAND_SECONDS else logging.DEBUG
+        log.log(nivel, "Comando completado%s", " con error" if ctx.command_failed else "", extra={'latency_ms': round(elapsed * 1000, 1)})
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -126,9 +265,20 @@ async def on_command_error(ctx, error):
     Manejador de errores global para todos los comandos.
     Proporciona respuestas amigables al usuario para errores comunes como comandos no encontrados,
     cooldowns, permisos faltantes, etc., evitando que el bot se bloquee.
+    Los errores previos a la ejecución (checks, argumentos, cooldowns) se cuentan en `metrics` sin duración;
+    los de la ejecución ya los registra `registrar_medicion`.
     """
+    bind_command_context(ctx)
+    if ctx.command and not isinstance(error, commands.CommandInvokeError):
+        metrics.record_error(TIPO_COMANDO, ctx.command.qualified_name)
     if isinstance(error, commands.CommandNotFound):
-        await ctx.send("🤔 Comando no reconocido.", delete_after=10)
+        permisos = getattr(ctx.author, 'guild_permissions', None)
+        sugerencias = bot.command_registry.sugerir(ctx.invoked_with or "", ctx.author.id, bool(permisos and permisos.administrator))
+        if sugerencias:
+            opciones = ", ".join(f"`!{nombre}`" for nombre in sugerencias)
+            await ctx.send(f"🤔 Comando no reconocido. ¿Quisiste decir {opciones}?", delete_after=10)
+        else:
+            await ctx.send("🤔 Comando no reconocido.", delete_after=10)
     elif isinstance(error, commands.CommandOnCooldown):
         await ctx.send(f"⏳ Enfriamiento. Intenta en **{round(error.retry_after, 1)}s**.", delete_after=10)
     elif isinstance(error, commands.MissingRequiredArgument):
@@ -140,61 +290,62 @@ async def on_command_error(ctx, error):
     elif isinstance(error, commands.NotOwner):
         await ctx.send("🚫 Este comando solo puede ser usado por el dueño del bot.", delete_after=10)
     else:
-        print(f"[ERROR NO MANEJADO] en comando '{ctx.command.name if ctx.command else 'desconocido'}': {type(error).__name__}: {error}")
+        causa = getattr(error, 'original', error)
+        log.error("Error no manejado en comando '%s': %s: %s", ctx.command.name if ctx.command else 'desconocido', type(causa).__name__, causa,
+                  exc_info=(type(causa), causa, causa.__traceback__))
         await ctx.send("Ocurrió un error inesperado. 😔")
 
-# --- Servidor Web para Mantener Activo en Render ---
-# Esta sección crea un servidor web simple usando Flask.
-# El propósito es responder a las comprobaciones de estado de plataformas como Render,
-# asegurando que el servicio no se suspenda por inactividad.
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "El bot está vivo."
-
-def run_web_server():
-  port = int(os.environ.get('PORT', 8080))
-  print(f"--- [WEB] Iniciando servidor web en el puerto {port} ---")
-  app.run(host='0.0.0.0', port=port)
-
-def keep_alive():
-    """Inicia el servidor web en un hilo separado para no bloquear el bot."""
-    t = Thread(target=run_web_server)
-    t.start()
-
 # --- Función Principal de Ejecución ---
 async def main():
     """
     Función principal asíncrona que prepara y ejecuta el bot.
-    - Carga todas las extensiones (cogs) de la carpeta /cogs.
-    - Inicia la conexión del bot a Discord usando el token.
+    - Carga todas las extensiones (cogs) de la carpeta /cogs a la vez.
+    - Inicia la conexión del bot a Discord usando el token (el esquema y las cachés se preparan en `setup_hook`).
     - Maneja errores críticos de conexión.
+    - Inicia el servidor web (/healthz, /readyz, /metrics) en el mismo bucle de eventos.
+    - Cierra el pool de conexiones a la base de datos al apagar.
     """
+    await asyncio.to_thread(init_db_pool)
+    await bot.web_server.start()
+    bot.startup.lap('pool de BD y servidor web')
+    # SIGTERM (p. ej. un reinicio escalonado del lanzador) cierra la sesión de Discord limpiamente.
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except (NotImplementedError, RuntimeError):
+        pass
+    try:
+        await run_bot()
+    finally:
+        await bot.change_listener.stop()
+        await bot.web_server.stop()
+        await asyncio.to_thread(close_db_pool)
+
+async def run_bot():
+    """Carga los cogs y mantiene la sesión del bot con Discord."""
     async with bot:
-        # Cargar todos los cogs
-        for filename in os.listdir('./cogs'):
-            if filename.endswith('.py'):
-                try:
-                    await bot.load_extension(f'cogs.{filename[:-3]}')
-                    print(f'--- [COG] Cargado: {filename}')
-                except Exception as e:
-                    print(f"--- [ERROR COG] No se pudo cargar {filename}: {e}")
-                    bot.failed_cogs.append((filename, str(e)))
-        
-        print("--- [FASE 0.6] Conectando a Discord... ---")
+        # Cargar todos los cogs a la vez: los `cog_load` que esperan (p. ej. arrancar el pool de imágenes)
+        # se solapan en lugar de sumarse.
+        filenames = sorted(f for f in os.listdir('./cogs') if f.endswith('.py'))
+        results = await asyncio.gather(*(bot.load_extension(f'cogs.{f[:-3]}') for f in filenames), return_exceptions=True)
+        for filename, result in zip(filenames, results):
+            if isinstance(result, Exception):
+                log.error("No se pudo cargar el cog %s: %s", filename, result, exc_info=result)
+                bot.failed_cogs.append((filename, str(result)))
+            else:
+                log.info("Cog cargado: %s", filename)
+        bot.startup.lap('cogs')
+
+        log.info("Conectando a Discord...")
         try:
             await bot.start(DISCORD_TOKEN)
         except discord.errors.LoginFailure:
-            print("--- [ERROR CRÍTICO] El token de Discord no es válido. Revisa tu archivo .env ---")
+            log.critical("El token de Discord no es válido. Revisa tu archivo .env")
             sys.exit(1)
 
 if __name__ == "__main__":
-    # Inicia el servidor web para mantener el bot activo.
-    keep_alive()
     try:
         # Ejecuta el bucle de eventos principal del bot.
         asyncio.run(main())
     except KeyboardInterrupt:
         # Permite apagar el bot de forma limpia con Ctrl+C.
-        print("\n--- [INFO] Apagando el bot. ---")
\ No newline at end of file
+        log.info("Apagando el bot.")
\ No newline at end of file
@@ -1,3 +1,4 @@
+import logging
 import discord
 from discord.ext import commands
 from datetime import datetime, date
@@ -5,13 +6,20 @@ import json
 import io
 import psycopg2
 import asyncio
-from unidecode import unidecode
-from utils.db_manager import db_execute, get_db_connection
+import os
+from utils.db_manager import db_execute, pooled_connection, get_pool_stats
+from utils.metrics import metrics, TIPOS
+
+log = logging.getLogger(__name__)
+
+# Segundos máximos del chequeo de Gemini de `!status` (espera en el planificador incluida).
+STATUS_GEMINI_TIMEOUT = float(os.getenv('STATUS_GEMINI_TIMEOUT', '10'))
 
 TABLES_TO_MIGRATE = [
     'personas', 'datos_persona', 'reglas_ia', 
     'permisos_comandos', 'comandos_config', 
-    'operador_perfil', 'apodos_operador', 'comandos_dinamicos'
+    'operador_perfil', 'apodos_operador', 'comandos_dinamicos',
+    'alias_comandos_dinamicos'
 ]
 
 class AdminCog(commands.Cog, name="Administración"):
@@ -27,18 +35,43 @@ class AdminCog(commands.Cog, name="Administración"):
         
         # 1. Chequeo de la Base de Datos
         try:
-            conn = get_db_connection()
-            conn.close()
+            await db_execute("SELECT 1", fetch='one')
             embed.add_field(name="Base de Datos (Supabase)", value="✅ Conectada", inline=False)
         except Exception as e:
             embed.add_field(name="Base de Datos (Supabase)", value=f"❌ Falló: {e}", inline=False)
+        pool = get_pool_stats()
+        embed.add_field(
+            name="Pool de Conexiones",
+            value=f"En uso: {pool['in_use']}/{pool['max_size']} | Checkouts: {pool['checkouts']} | "
+                  f"Espera media: {pool['wait_time_avg'] * 1000:.1f} ms (máx {pool['wait_time_max'] * 1000:.1f} ms) | "
+                  f"Timeouts: {pool['timeouts']} | Descartadas: {pool['discarded']}",
+            inline=False
+        )
+
+        if isinstance(self.bot, commands.AutoShardedBot):
+            latencias = " | ".join(f"#{shard_id}: {latencia * 1000:.0f} ms" for shard_id, latencia in self.bot.latencies)
+            embed.add_field(name=f"Shards ({os.getenv('INSTANCE_ID', 'proceso único')})", value=f"{len(self.bot.latencies)} de {self.bot.shard_count} | {latencias}"[:1024], inline=False)
+
+        cambios = self.bot.change_listener.stats()
+        embed.add_field(
+            name="Sincronización entre procesos",
+            value=f"{'✅ Escuchando' if cambios['connected'] else '❌ Desconectada'} | Avisos recibidos: {cambios['received']} | Aplicados: {cambios['applied']}",
+            inline=False
+        )
 
         # 2. Chequeo de IA (Gemini)
         try:
-            self.bot.gemini_model.count_tokens("test")
+            await self.bot.gemini.count_tokens("test", timeout=STATUS_GEMINI_TIMEOUT)
             embed.add_field(name="IA (Gemini)", value="✅ Operacional", inline=False)
         except Exception as e:
             embed.add_field(name="IA (Gemini)", value=f"❌ Falló: {e}", inline=False)
+        gemini = self.bot.gemini.stats()
+        embed.add_field(
+            name="Planificador de Gemini",
+            value=f"En curso: {gemini['in_flight']} | En cola: {gemini['waiting']} | Peticiones: {gemini['requests']} | "
+                  f"Reintentos: {gemini['retries']} | Fallos: {gemini['failures']} | Timeouts: {gemini['timeouts']}",
+            inline=False
+        )
 
         # 3. Chequeo de Audio (ElevenLabs)
         if self.bot.elevenlabs_client:
@@ -50,6 +83,9 @@ class AdminCog(commands.Cog, name="Administración"):
         else:
             embed.add_field(name="Audio (ElevenLabs)", value="⚪ No configurado", inline=False)
             
+        if self.bot.startup.done:
+            embed.add_field(name="Arranque", value=self.bot.startup.report()[:1024], inline=False)
+
         # 4. Chequeo de Cogs
         if not self.bot.failed_cogs:
             embed.add_field(name="Módulos (Cogs)", value="✅ Todos cargados", inline=False)
@@ -59,6 +95,33 @@ class AdminCog(commands.Cog, name="Administración"):
 
         await ctx.send(embed=embed)
 
+    @commands.command(name='perf', help='Latencias p50/p95/p99 de este proceso. Uso: !perf [comando|sql|api|reset] [cantidad]')
+    @commands.has_permissions(administrator=True)
+    async def perf(self, ctx, tipo: str = None, cantidad: int = 8):
+        """Muestra, por tiempo total consumido, las series más costosas de comandos, SQL y APIs externas."""
+        tipo = tipo.lower() if tipo else None
+        if tipo == 'reset':
+            metrics.reset()
+            await ctx.send("🧹 Métricas de rendimiento reiniciadas."); return
+        if tipo and tipo not in TIPOS:
+            await ctx.send(f"❌ Tipo no válido. Usa uno de: {', '.join(TIPOS)} o `reset`."); return
+
+        desde = datetime.fromtimestamp(metrics.since).strftime('%d/%m %H:%M')
+        embed = discord.Embed(title=f"⏱️ Rendimiento ({os.getenv('INSTANCE_ID', 'proceso único')})", description=f"Datos desde el {desde}. Tiempos en ms.", color=discord.Color.blue())
+        for t in ([tipo] if tipo else TIPOS):
+            filas = metrics.summary(t, max(1, min(cantidad, 20)))
+            if not filas:
+                embed.add_field(name=t.upper(), value="Sin datos todavía.", inline=False); continue
+            lineas = [f"{'nombre':<30} {'n':>6} {'err':>4} {'p50':>7} {'p95':>7} {'p99':>7}"]
+            for fila in filas:
+                nombre = fila['nombre'] if len(fila['nombre']) <= 30 else fila['nombre'][:29] + "…"
+                lineas.append(f"{nombre:<30} {fila['count']:>6} {fila['errors']:>4} {fila['p50'] * 1000:>7.1f} {fila['p95'] * 1000:>7.1f} {fila['p99'] * 1000:>7.1f}")
+            # Se recortan filas para no pasar el límite de 1024 caracteres del campo.
+            while len("\n".join(lineas)) > 1010:
+                lineas.pop()
+            embed.add_field(name=t.upper(), value="```\n" + "\n".join(lineas) + "\n```", inline=False)
+        await ctx.send(embed=embed)
+
     @commands.command(name='backup', help='Crea una copia de seguridad de la base de datos.')
     @commands.is_owner()
     async def backup(self, ctx):
@@ -71,6 +134,7 @@ class AdminCog(commands.Cog, name="Administración"):
         if not cmd or cmd.name in ['privatizar', 'publicar', 'permitir', 'denegar', 'estado_comandos', 'backup']:
             await ctx.send(f"❌ No se puede privatizar `!{nombre_comando}`."); return
         await db_execute("INSERT INTO comandos_config (nombre_comando, estado) VALUES (%s, %s) ON CONFLICT (nombre_comando) DO UPDATE SET estado = EXCLUDED.estado", (cmd.name, 'privado'))
+        self.bot.command_registry.set_estado(cmd.name, 'privado')
         await ctx.send(f"🔒 El comando `!{cmd.name}` ahora es privado.")
 
     @commands.command(name='publicar', help='Hace que un comando sea de uso público.')
@@ -79,6 +143,7 @@ class AdminCog(commands.Cog, name="Administración"):
         cmd = self.bot.get_command(nombre_comando.lower())
         if not cmd: await ctx.send(f"❌ No existe el comando `!{nombre_comando}`."); return
         await db_execute("INSERT INTO comandos_config (nombre_comando, estado) VALUES (%s, %s) ON CONFLICT (nombre_comando) DO UPDATE SET estado = EXCLUDED.estado", (cmd.name, 'publico'))
+        self.bot.command_registry.set_estado(cmd.name, 'publico')
         await ctx.send(f"🌍 El comando `!{cmd.name}` ahora es público.")
 
     @commands.command(name='permitir', help='Concede a un usuario permiso para usar un comando privado.')
@@ -87,25 +152,25 @@ class AdminCog(commands.Cog, name="Administración"):
         cmd_name = nombre_comando.lower()
         if not self.bot.get_command(cmd_name): await ctx.send(f"❌ No existe el comando `!{cmd_name}`."); return
         await db_execute("INSERT INTO permisos_comandos (user_id, nombre_comando) VALUES (%s, %s) ON CONFLICT (user_id, nombre_comando) DO NOTHING", (miembro.id, cmd_name))
+        self.bot.command_registry.permiso_concedido(miembro.id, cmd_name)
         await ctx.send(f"🔑 ¡Llave entregada! {miembro.mention} ahora puede usar `!{cmd_name}`.")
 
     @commands.command(name='denegar', help='Quita el permiso a un usuario para un comando.')
     @commands.has_permissions(administrator=True)
     async def denegar(self, ctx, miembro: discord.Member, nombre_comando: str):
         rows = await db_execute("DELETE FROM permisos_comandos WHERE user_id = %s AND nombre_comando = %s", (miembro.id, nombre_comando.lower()))
+        self.bot.command_registry.permiso_revocado(miembro.id, nombre_comando.lower())
         if rows == 0: await ctx.send(f"🤔 {miembro.mention} no tenía permiso para `!{nombre_comando}`.")
         else: await ctx.send(f"✅ Acceso a `!{nombre_comando}` revocado para {miembro.mention}.")
 
     @commands.command(name='estado_comandos', help='Muestra el estado de los comandos.')
     @commands.has_permissions(administrator=True)
     async def estado_comandos(self, ctx):
-        configs = await db_execute("SELECT nombre_comando, estado FROM comandos_config", fetch='all')
-        configuraciones = {row['nombre_comando']: row['estado'] for row in configs}
         embed = discord.Embed(title="Estado de Permisos de Comandos", color=discord.Color.dark_grey())
         description = ""
         for cmd in sorted(self.bot.commands, key=lambda c: c.name):
             if cmd.hidden: continue
-            estado_texto = configuraciones.get(cmd.name, 'publico')
+            estado_texto = self.bot.command_registry.estado(cmd.name)
             estado_emoji = 'Privado 🔒' if estado_texto == 'privado' else 'Público 🌍'
             description += f"**`!{cmd.name}`**: {estado_emoji}\n"
         embed.description = description
@@ -135,10 +200,12 @@ class AdminCog(commands.Cog, name="Administración"):
             else:
                 categoria_encontrada = None
                 mensaje_encontrado = ""
+                # unidecode solo se importa cuando hace falta (no retrasa el arranque del bot).
+                from unidecode import unidecode
+                args_normalized = unidecode(args).lower()
                 sorted_categories = sorted(ctx.guild.categories, key=lambda c: len(c.name), reverse=True)
                 for categoria in sorted_categories:
                     cat_name_normalized = unidecode(categoria.name).lower()
-                    args_normalized = unidecode(args).lower()
                     if args_normalized.startswith(cat_name_normalized):
                         categoria_encontrada = categoria
                         mensaje_encontrado = args[len(categoria.name):].strip()
@@ -160,7 +227,7 @@ class AdminCog(commands.Cog, name="Administración"):
                 await canal.send(mensaje_str)
                 sent_count += 1
             except Exception as e:
-                print(f"No se pudo enviar a {canal.name}: {e}")
+                log.warning("No se pudo enviar el anuncio a %s: %s", canal.name, e)
         
         await ctx.message.add_reaction('✅')
         if sent_count > 0:
@@ -169,15 +236,13 @@ class AdminCog(commands.Cog, name="Administración"):
     def _do_export(self):
         """Helper síncrono para exportar datos sin bloquear el bot."""
         data_to_export = {}
-        conn = get_db_connection()
-        try:
+        with pooled_connection() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
                 for table_name in TABLES_TO_MIGRATE:
                     cur.execute(f"SELECT * FROM {table_name}")
                     rows = cur.fetchall()
                     data_to_export[table_name] = [dict(row) for row in rows]
-        finally:
-            conn.close()
+            conn.rollback()
         return json.dumps(data_to_export, default=str)
 
     @commands.command(name='exportar-config', help='(Dueño) Exporta la configuración crítica a un archivo JSON.')
@@ -195,8 +260,7 @@ class AdminCog(commands.Cog, name="Administración"):
     def _do_import(self, data_to_import):
         """Helper síncrono para importar datos sin bloquear el bot."""
         report = ""
-        conn = get_db_connection()
-        try:
+        with pooled_connection() as conn:
             with conn.cursor() as cur:
                 for table_name in TABLES_TO_MIGRATE:
                     if table_name in data_to_import:
@@ -212,8 +276,6 @@ class AdminCog(commands.Cog, name="Administración"):
                         cur.executemany(query, data_tuples)
                         report += f"✅ Tabla `{table_name}`: Se importaron {len(rows)} registros.\n"
                 conn.commit()
-        finally:
-            conn.close()
         return report
 
     @commands.command(name='importar-config', help='(Dueño) Importa la configuración desde un archivo JSON.')
@@ -230,6 +292,9 @@ class AdminCog(commands.Cog, name="Administración"):
             data_to_import = json.loads(json_bytes.decode('utf-8'))
             
             report = await asyncio.to_thread(self._do_import, data_to_import)
+            # Los perfiles, reglas y permisos cambiaron por completo: se recargan las cachés.
+            await self.bot.ia_cache.load()
+            await self.bot.command_registry.load()
             
             embed = discord.Embed(title="✅ Reporte de Importación", description=report, color=discord.Color.green())
             await ctx.send(embed=embed)
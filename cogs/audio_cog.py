@@ -1,8 +1,12 @@
+import logging
 import discord
 from discord.ext import commands
 import asyncio
 import re
-import io
+from utils.gemini_scheduler import PRIORIDAD_INTERACTIVA
+from utils.tts import synthesize, parse_calidad, upload_limit, AudioTooLarge, TTS_CALIDADES
+
+log = logging.getLogger(__name__)
 
 async def get_refined_script(ctx, original_text):
     base_prompt = f"""**Primary Task:** You are a dialogue processing AI. Your input is a text. Your output must be two processed versions of that text, separated by '---'.
@@ -37,12 +41,12 @@ async def get_refined_script(ctx, original_text):
             else:
                 prompt = f'{base_prompt}\n**IMPORTANT INSTRUCTION:** Please generate a new, different and creative alternative to the previous suggestion.\n**ORIGINAL TEXT:** "{original_text}"'
 
-            response = await ctx.bot.gemini_model.generate_content_async(prompt)
+            response = await ctx.bot.gemini.generate(prompt, priority=PRIORIDAD_INTERACTIVA)
             
             try:
                 text_content = response.text
             except ValueError:
-                print(f"Respuesta de IA bloqueada en get_refined_script. Razón: {response.prompt_feedback}")
+                log.warning("Respuesta de IA bloqueada en get_refined_script. Razón: %s", response.prompt_feedback)
                 await ctx.send("❌ La respuesta de la IA fue bloqueada por seguridad. No se puede generar el guion.")
                 if msg_to_edit:
                     await msg_to_edit.delete()
@@ -110,18 +114,21 @@ class AudioCog(commands.Cog, name="Audio"):
                 embed = discord.Embed(title="🎙️ Librería de Voces Personalizadas Actualizada 🎙️", description=description, color=discord.Color.brand_green())
                 await ctx.send(embed=embed)
             except Exception as e:
-                await ctx.send("❌ Error al sincronizar voces."); print(f"Error en !sync_elevenlabs: {e}")
+                await ctx.send("❌ Error al sincronizar voces."); log.exception("Error en !sync_elevenlabs: %s", e)
 
     @commands.command(name='audio', help='Corrige y refina un texto para un guion.')
     async def audio(self, ctx, *, texto: str):
         async with ctx.typing():
             await get_refined_script(ctx, texto)
 
-    @commands.command(name='audiolab', help='(Privado) Genera un audio completo desde un texto.')
+    @commands.command(name='audiolab', help=f'(Privado) Genera un audio completo desde un texto. Uso: !audiolab [calidad={"|".join(TTS_CALIDADES)}] <texto>')
     @commands.has_permissions(administrator=True)
     async def audiolab(self, ctx, *, texto: str):
         if not self.bot.elevenlabs_client: await ctx.send("❌ Cliente de ElevenLabs no configurado."); return
         if not self.bot.elevenlabs_voices: await ctx.send("❌ No hay voces sincronizadas. Usa `!sync_elevenlabs`."); return
+        output_format, texto = parse_calidad(texto)
+        if output_format is None: await ctx.send(f"❌ {texto}"); return
+        if not texto: await ctx.send("❌ Falta el texto del audio."); return
 
         final_script = await get_refined_script(ctx, texto)
         if not final_script: return
@@ -141,18 +148,22 @@ class AudioCog(commands.Cog, name="Audio"):
             while True:
                 generating_msg = await ctx.send(f"🎙️ Generando audio con la voz de **{voice_name}**...")
                 try:
-                    def generate_audio_bytes():
-                        audio_stream = self.bot.elevenlabs_client.text_to_speech.convert(voice_id=voice_id, text=final_script)
-                        return b"".join(chunk for chunk in audio_stream)
-                    audio_bytes = await asyncio.to_thread(generate_audio_bytes)
+                    # El audio se recibe por fragmentos en un archivo temporal acotado en memoria y se corta
+                    # en cuanto supera el límite de subida del servidor.
+                    audio_file, _ = await synthesize(self.bot.elevenlabs_async_client, voice_id, final_script, output_format, upload_limit(ctx.guild))
+                except AudioTooLarge as e:
+                    await generating_msg.delete()
+                    await ctx.send(f"❌ {e} Prueba con una calidad más baja (`calidad=baja`) o un texto más corto.")
+                    return
                 except Exception as e:
                     await generating_msg.delete()
-                    print(f"Error generando audio en ElevenLabs: {e}")
+                    log.exception("Error generando audio en ElevenLabs: %s", e)
                     await ctx.send("❌ Hubo un error al generar el audio con ElevenLabs.")
                     return
 
                 await generating_msg.delete()
-                audio_message = await ctx.send(content=f"**Texto utilizado:**\n```\n{final_script}\n```", file=discord.File(io.BytesIO(audio_bytes), filename="audio.mp3"))
+                with audio_file:
+                    audio_message = await ctx.send(content=f"**Texto utilizado:**\n```\n{final_script}\n```", file=discord.File(audio_file, filename="audio.mp3"))
 
                 await audio_message.add_reaction("🔁"); await audio_message.add_reaction("✅")
                 def check_audio_regen(r, u): return u == ctx.author and str(r.emoji) in ["🔁", "✅"] and r.message.id == audio_message.id
@@ -171,7 +182,7 @@ class AudioCog(commands.Cog, name="Audio"):
         except asyncio.TimeoutError:
             await voice_msg.delete(); await ctx.send("Tiempo de espera agotado.", delete_after=10)
         except Exception as e:
-            await ctx.send("❌ Error durante el proceso de audiolab."); print(f"Error en !audiolab: {e}")
+            await ctx.send("❌ Error durante el proceso de audiolab."); log.exception("Error en !audiolab: %s", e)
 
 async def setup(bot):
     await bot.add_cog(AudioCog(bot))
@@ -1,6 +1,6 @@
 import discord
 from discord.ext import commands
-from utils.db_manager import db_execute
+from utils.command_registry import CATEGORIA_PERSONALIZADOS
 
 class HelpView(discord.ui.View):
     def __init__(self, context, mapping, visible_categories):
@@ -35,7 +35,7 @@ class CategorySelect(discord.ui.Select):
         embed.set_footer(text="Usa !help <comando> para más detalles sobre un comando específico.")
         
         description = ""
-        if selected_category == "Comandos Personalizados":
+        if selected_category == CATEGORIA_PERSONALIZADOS:
             description = ", ".join([f"`{cmd_name}`" for cmd_name in commands_in_category])
         else:
             for command in commands_in_category:
@@ -46,50 +46,10 @@ class CategorySelect(discord.ui.Select):
         await interaction.response.edit_message(embed=embed)
 
 class MyHelpCommand(commands.HelpCommand):
-    async def _get_visible_categories(self):
-        """Obtiene las categorías y comandos visibles para el usuario de forma asíncrona."""
-        configs_rows = await db_execute("SELECT nombre_comando, estado FROM comandos_config", fetch='all')
-        configs = {row['nombre_comando']: row['estado'] for row in configs_rows} if configs_rows else {}
-        
-        perms_rows = await db_execute("SELECT nombre_comando FROM permisos_comandos WHERE user_id = %s", (self.context.author.id,), fetch='all')
-        perms = [row['nombre_comando'] for row in perms_rows] if perms_rows else []
-
-        custom_cmds_rows = await db_execute("SELECT nombre_comando FROM comandos_dinamicos ORDER BY nombre_comando ASC", fetch='all')
-        custom_cmds = [row['nombre_comando'] for row in custom_cmds_rows] if custom_cmds_rows else []
-
+    def _get_visible_categories(self):
+        """Obtiene las categorías y comandos visibles para el usuario desde el registro en memoria."""
         es_admin = self.context.author.guild_permissions.administrator
-        
-        all_categories = {
-            "Gestión de Operadores": ['apodo', 'verapodo', 'quitarapodo', 'listaapodos', 'asignar', 'desasignar', 'misperfiles', 'sincronizar-perfiles', 'desincronizar-perfiles'],
-            "Registro de Actividad": ['lm', 'exito'],
-            "Estadísticas": ['estadisticas', 'registrolm', 'verexitos'],
-            "Gestión de Perfiles (IA)": ['crearperfil', 'borrarperfil', 'listaperfiles', 'agghistorial', 'verinfo'],
-            "Análisis con IA": ['reply', 'consejo', 'preguntar'],
-            "Audio (ElevenLabs)": ['sync_elevenlabs', 'audio', 'audiolab'],
-            "Memoria del Bot": ['guardar', 'buscar', 'resumir'],
-            "Tareas Programadas": ['programar', 'programar-ia', 'programar-serie', 'tareas', 'borrartarea'],
-            "Administración General": ['backup', 'privatizar', 'publicar', 'permitir', 'denegar', 'estado_comandos', 'anuncio', 'aggregla', 'listareglas', 'borrarregla', 'exportar-config', 'importar-config', 'status'],
-            "Comandos Personalizados": custom_cmds
-        }
-
-        visible_categories = {}
-        for cat_name, cmd_list in all_categories.items():
-            visible_cmds = []
-            if not cmd_list: continue
-
-            for cmd_name in cmd_list:
-                command = self.context.bot.get_command(cmd_name)
-                if command and not command.hidden:
-                    estado_cmd = configs.get(command.name, 'publico')
-                    if es_admin or estado_cmd == 'publico' or command.name in perms:
-                        visible_cmds.append(command)
-                elif cat_name == "Comandos Personalizados" and cmd_name in custom_cmds:
-                    visible_cmds.append(cmd_name)
-
-            if visible_cmds:
-                visible_categories[cat_name] = visible_cmds
-        
-        return visible_categories
+        return self.context.bot.command_registry.visible_categories(self.context.author.id, es_admin)
 
     def get_command_signature(self, command):
         return f'{self.context.prefix}{command.name} {command.signature}'
@@ -97,7 +57,7 @@ class MyHelpCommand(commands.HelpCommand):
     async def send_bot_help(self, mapping):
         embed = discord.Embed(title="🤖 Menú de Ayuda de MiBotGemini 🤖", color=discord.Color.dark_purple())
         embed.description = "Selecciona una categoría del menú desplegable para ver sus comandos.\nUsa `!help <comando>` para obtener información detallada sobre un comando específico."
-        visible_categories = await self._get_visible_categories()
+        visible_categories = self._get_visible_categories()
         view = HelpView(self.context, mapping, visible_categories)
         view.message = await self.get_destination().send(embed=embed, view=view)
 
@@ -124,16 +84,19 @@ class MyHelpCommand(commands.HelpCommand):
         await self.get_destination().send(embed=embed)
 
     async def command_not_found(self, string):
-        result = await db_execute("SELECT respuesta_comando, creador_nombre FROM comandos_dinamicos WHERE nombre_comando = %s", (string,), fetch='one')
-        
+        result = self.context.bot.command_registry.get_dinamico(string.lower())
+
         if result:
-            respuesta, creador = result['respuesta_comando'], result['creador_nombre']
+            respuesta, creador = result['respuesta'], result['creador_nombre']
             embed = discord.Embed(title=f"Ayuda para Comando Personalizado: `!{string}`", color=discord.Color.dark_blue())
             embed.add_field(name="Respuesta", value=f"```{respuesta}```", inline=False)
             embed.add_field(name="Creador", value=creador, inline=False)
             await self.get_destination().send(embed=embed)
         else:
-            await self.send_error_message(f'No se encontró ningún comando llamado "{string}".')
+            es_admin = self.context.author.guild_permissions.administrator
+            sugerencias = self.context.bot.command_registry.sugerir(string, self.context.author.id, es_admin)
+            pista = f" ¿Quisiste decir {', '.join(f'`!{nombre}`' for nombre in sugerencias)}?" if sugerencias else ""
+            await self.send_error_message(f'No se encontró ningún comando llamado "{string}".{pista}')
 
 class HelpCog(commands.Cog):
     def __init__(self, bot):
@@ -1,59 +1,18 @@
+import logging
 import discord
 from discord.ext import commands
-import psycopg2
-import psycopg2.extras
-import io
 import asyncio
-from PIL import Image
-from utils.db_manager import db_execute, get_db_connection
+from utils.db_manager import db_execute
+from utils.prompts import PromptBuilder, PROMPT_VERSION
+from utils.gemini_scheduler import PRIORIDAD_INTERACTIVA
+from utils.streaming import stream_to_discord, send_chunked
+from utils.content_cache import ContentCache, content_hash, IMAGE_CACHE_MAX_BYTES, REPLY_CACHE_MAX_BYTES, REPLY_CACHE_DIR
+from utils.image_pipeline import ImagePipeline, ImagePipelineBusy, ImageTooLarge, IMAGE_MAX_BYTES
 
-async def get_ia_context(nombre_perfil):
-    """
-    Recupera el historial del perfil (hoja_personaje) y las reglas globales de la IA desde la base de datos.
-    Devuelve una tupla (hoja_personaje, reglas_ia_rows).
-    """
-    hoja_personaje = ""
-    reglas_ia = []
-    # Obtener reglas de IA
-    reglas_ia = await db_execute("SELECT regla_texto FROM reglas_ia ORDER BY id ASC", fetch='all')
-    # Obtener hoja de personaje si hay perfil
-    if nombre_perfil:
-        persona = await db_execute("SELECT id FROM personas WHERE nombre = %s", (nombre_perfil.lower(),), fetch='one')
-        if not persona:
-            raise ValueError(f"No encontré el perfil `{nombre_perfil.lower()}`.")
-        datos_persona = await db_execute("SELECT dato_texto FROM datos_persona WHERE persona_id = %s", (persona['id'],), fetch='all')
-        hoja_personaje = f"**TU PERSONAJE:**\nTú eres '{nombre_perfil}'.\n" + "\n".join(f"- {dato['dato_texto']}" for dato in datos_persona)
-    return hoja_personaje, reglas_ia
+log = logging.getLogger(__name__)
 
-def process_image_and_db_for_reply(nombre_perfil, attachment_bytes):
-    """
-    Obtiene el contexto de IA y procesa la imagen.
-    Esta es una función síncrona diseñada para ser ejecutada en un hilo separado.
-    """
-    hoja_personaje = ""
-    reglas_ia = []
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT regla_texto FROM reglas_ia ORDER BY id ASC")
-            reglas_ia = cur.fetchall()
-            if nombre_perfil:
-                cur.execute("SELECT id FROM personas WHERE nombre = %s", (nombre_perfil.lower(),))
-                persona_result = cur.fetchone()
-                if not persona_result:
-                    raise ValueError(f"No encontré el perfil `{nombre_perfil.lower()}`.")
-                cur.execute("SELECT dato_texto FROM datos_persona WHERE persona_id = %s", (persona_result['id'],))
-                datos_persona = cur.fetchall()
-                hoja_personaje = f"**TU PERSONAJE:**\nTú eres '{nombre_perfil}'.\n" + "\n".join(f"- {dato['dato_texto']}" for dato in datos_persona)
-    finally:
-        conn.close()
-    
-    with Image.open(io.BytesIO(attachment_bytes)) as img:
-        rgb_img = img.convert('RGB')
-        rgb_img.thumbnail((1024, 1024))
-        buffer = io.BytesIO()
-        rgb_img.save(buffer, format="JPEG")
-        return hoja_personaje, reglas_ia, buffer.getvalue()
+# Palabras que fuerzan a `!reply` a ignorar la caché de respuestas.
+REGENERAR_OPCIONES = ('regenerar', 'nuevo', '-r')
 
 class IACog(commands.Cog, name="IA"):
     """
@@ -66,6 +25,17 @@ class IACog(commands.Cog, name="IA"):
     """
     def __init__(self, bot):
         self.bot = bot
+        self.prompts = PromptBuilder(bot)
+        self.images = ImagePipeline()
+        # Cachés por hash de contenido: imagen ya procesada y respuesta de Gemini.
+        self.image_cache = ContentCache(IMAGE_CACHE_MAX_BYTES)
+        self.reply_cache = ContentCache(REPLY_CACHE_MAX_BYTES, spill_dir=REPLY_CACHE_DIR)
+
+    async def cog_load(self):
+        await self.images.start()
+
+    def cog_unload(self):
+        self.images.shutdown()
 
     # --- Comandos de Gestión de Perfiles y Reglas ---
     @commands.command(name='crearperfil', help='Crea uno o más perfiles. Uso: !crearperfil <nombre1> [nombre2] ...')
@@ -79,17 +49,19 @@ class IACog(commands.Cog, name="IA"):
         """
         if not nombres:
             await ctx.send("❌ Debes especificar al menos un nombre de perfil."); return
-        nombres_lista = [n.lower() for n in nombres.split()]
+        # Se eliminan duplicados conservando el orden y se insertan todos en una sola sentencia.
+        nombres_lista = list(dict.fromkeys(n.lower() for n in nombres.split()))
         creados, existentes = [], []
-        for nombre in nombres_lista:
-            try:
-                rows_affected = await db_execute("INSERT INTO personas (nombre) VALUES (%s) ON CONFLICT (nombre) DO NOTHING", (nombre,))
-                if rows_affected > 0:
-                    creados.append(nombre)
-                else:
-                    existentes.append(nombre)
-            except Exception as e:
-                print(f"Error al crear perfil {nombre}: {e}")
+        try:
+            rows = await db_execute("INSERT INTO personas (nombre) VALUES %s ON CONFLICT (nombre) DO NOTHING RETURNING id, nombre", [(nombre,) for nombre in nombres_lista], fetch='values')
+            nombres_creados = {row['nombre'] for row in rows}
+            for row in rows:
+                self.bot.ia_cache.perfil_creado(row['nombre'], row['id'])
+            creados = [n for n in nombres_lista if n in nombres_creados]
+            existentes = [n for n in nombres_lista if n not in nombres_creados]
+        except Exception as e:
+            log.exception("Error al crear perfiles %s: %s", nombres_lista, e)
+            await ctx.send("❌ Error al crear los perfiles."); return
         
         respuesta = ""
         if creados: respuesta += f"✅ Perfiles creados: `{', '.join(creados)}`\n"
@@ -104,9 +76,10 @@ class IACog(commands.Cog, name="IA"):
         Este historial se usará como contexto para la IA en el comando `reply`.
         Solo los administradores pueden usar este comando.
         """
-        persona = await db_execute("SELECT id FROM personas WHERE nombre = %s", (nombre_perfil.lower(),), fetch='one')
-        if persona:
-            await db_execute("INSERT INTO datos_persona (persona_id, dato_texto) VALUES (%s, %s)", (persona['id'], dato))
+        # Búsqueda e inserción en una sola sentencia: si el perfil no existe no se inserta nada.
+        rows = await db_execute("INSERT INTO datos_persona (persona_id, dato_texto) SELECT id, %s FROM personas WHERE nombre = %s", (dato, nombre_perfil.lower()))
+        if rows > 0:
+            self.bot.ia_cache.dato_agregado(nombre_perfil, dato)
             await ctx.send(f"✅ Dato añadido al perfil `{nombre_perfil.lower()}`.")
         else:
             await ctx.send(f"❌ No encontré el perfil `{nombre_perfil.lower()}`.")
@@ -137,6 +110,7 @@ class IACog(commands.Cog, name="IA"):
         """
         rows = await db_execute("DELETE FROM personas WHERE nombre = %s", (nombre_perfil.lower(),))
         if rows > 0:
+            self.bot.ia_cache.perfil_borrado(nombre_perfil)
             await ctx.send(f"✅ Perfil `{nombre_perfil.lower()}` y su historial eliminados.")
         else:
             await ctx.send(f"❌ No encontré el perfil `{nombre_perfil.lower()}`.")
@@ -184,7 +158,8 @@ class IACog(commands.Cog, name="IA"):
         Estas reglas se añaden al final del prompt del sistema.
         Solo los administradores pueden usar este comando.
         """
-        await db_execute("INSERT INTO reglas_ia (regla_texto) VALUES (%s)", (regla,))
+        nueva = await db_execute("INSERT INTO reglas_ia (regla_texto) VALUES (%s) RETURNING id", (regla,), fetch='one')
+        self.bot.ia_cache.regla_agregada(nueva['id'], regla)
         await ctx.send("✅ Nueva regla añadida a la IA.")
 
     @commands.command(name='listareglas', help='Muestra las reglas de la IA.')
@@ -209,107 +184,102 @@ class IACog(commands.Cog, name="IA"):
         """
         rows = await db_execute("DELETE FROM reglas_ia WHERE id = %s", (regla_id,))
         if rows == 0: await ctx.send(f"🤔 No encontré una regla con el ID `{regla_id}`.")
-        else: await ctx.send(f"✅ Regla `{regla_id}` borrada.")
+        else:
+            self.bot.ia_cache.regla_borrada(regla_id)
+            await ctx.send(f"✅ Regla `{regla_id}` borrada.")
 
     # --- Comandos de IA ---
-    @commands.command(name='reply', help='Usa un perfil para analizar una foto/bio.')
+    @commands.command(name='reply', help='Usa un perfil para analizar una foto/bio. Uso: !reply [perfil] [regenerar]')
     @commands.cooldown(1, 120, commands.BucketType.user) 
-    async def reply(self, ctx, nombre_perfil: str = None):
+    async def reply(self, ctx, nombre_perfil: str = None, opcion: str = None):
         """
         Comando principal de IA. Analiza una imagen adjunta y genera una respuesta de texto.
         Tiene un cooldown de 120 segundos por usuario para evitar el abuso.
+        Si la misma imagen ya se analizó con el mismo perfil, reglas y prompt, se responde desde la caché
+        sin gastar cuota de la API; `regenerar` fuerza una respuesta nueva.
 
         Pasos que sigue:
         1. Valida que se haya adjuntado una imagen.
         2. Muestra el indicador de "escribiendo..." para feedback al usuario.
-        3. Procesa la imagen: la lee, la convierte a RGB, la redimensiona y la prepara para la IA.
-        4. Obtiene el contexto de la IA: el historial del perfil (si se especifica) y las reglas globales.
-        5. Construye un prompt muy detallado y estructurado para guiar a la IA (Gemini).
-        6. Envía el prompt y la imagen a la IA.
-        7. Recibe la respuesta de la IA y la envía al canal de Discord.
+        3. Obtiene el contexto de la IA: el historial del perfil (si se especifica) y las reglas globales.
+        4. Ensambla el prompt desde la plantilla precompilada (memorizado por perfil y versión de reglas).
+        5. Busca una respuesta previa en la caché usando el hash de la imagen y del prompt.
+        6. Procesa la imagen en un pool de procesos (o la toma de la caché): la convierte a RGB y la redimensiona.
+        7. Envía el prompt y la imagen a la IA y muestra la respuesta en Discord a medida que llega.
         8. Maneja posibles errores en cada paso.
         """
+        regenerar = False
+        if nombre_perfil and nombre_perfil.lower() in REGENERAR_OPCIONES:
+            nombre_perfil, regenerar = None, True
+        elif opcion:
+            if opcion.lower() not in REGENERAR_OPCIONES:
+                await ctx.send(f"❌ Opción desconocida `{opcion}`. Usa `regenerar` para forzar una respuesta nueva.", delete_after=10); self.reply.reset_cooldown(ctx); return
+            regenerar = True
+
         if not ctx.message.attachments:
             await ctx.send("❌ Debes adjuntar una imagen.", delete_after=10); self.reply.reset_cooldown(ctx); return
         attachment = ctx.message.attachments[0]
         if not attachment.content_type.startswith('image/'):
             await ctx.send("❌ El archivo no es una imagen.", delete_after=10); self.reply.reset_cooldown(ctx); return
+        if attachment.size > IMAGE_MAX_BYTES:
+            await ctx.send(f"❌ La imagen pesa demasiado (máximo {IMAGE_MAX_BYTES // (1024 * 1024)} MB).", delete_after=10); self.reply.reset_cooldown(ctx); return
         
         async with ctx.typing():
             try:
-                # --- 1. Procesamiento de la Imagen ---
                 image_bytes = await attachment.read()
-                
-                # Convertir, redimensionar y comprimir la imagen para optimizarla para la IA
-                with Image.open(io.BytesIO(image_bytes)) as img:
-                    rgb_img = img.convert('RGB')
-                    rgb_img.thumbnail((1024, 1024))
-                    buffer = io.BytesIO()
-                    rgb_img.save(buffer, format="JPEG")
-                    image_bytes_procesados = buffer.getvalue()
+                image_hash = content_hash(image_bytes)
 
-                # --- 2. Obtención de Contexto desde la BD ---
-                # Se recupera el historial del perfil y las reglas globales de la IA.
-                hoja_personaje, reglas_ia_rows = await get_ia_context(nombre_perfil)
-                
-                image_for_gemini = {'mime_type': 'image/jpeg', 'data': image_bytes_procesados}
+                # --- 1. Obtención de Contexto desde la caché ---
+                # El historial del perfil y las reglas globales ya vienen renderizados desde memoria.
+                perfil = await self.bot.ia_cache.get_perfil(nombre_perfil) if nombre_perfil else None
+                reglas_block = await self.bot.ia_cache.get_reglas()
                 
-                # --- 3. Construcción del Prompt Dinámico ---
-                # Este es el cerebro del comando. Define el rol, las reglas y el formato de salida de la IA.
-                prompt_dinamico = """**ROL Y OBJETIVO (Wingman Digital):** Tu rol es ser un 'Wingman Digital'. Debes ser ingenioso, observador y seguro, pero nunca arrogante. Tu objetivo es mezclar humor sutil con curiosidad genuina para crear openers de conversación únicos y listos para copiar y pegar.
+                # --- 2. Construcción del Prompt Dinámico ---
+                # La plantilla fija se combina con el perfil y las reglas; el resultado y su conteo de tokens se memorizan.
+                prompt_dinamico, _ = await self.prompts.reply_prompt(nombre_perfil, perfil, reglas_block, self.bot.ia_cache.reglas_version)
 
-**REGLAS CRÍTICAS DE COMPORTAMIENTO:**
-- **Humor Inteligente:** Prohibido usar expresiones genéricas como 'jajaja' o 'jejeje'. En su lugar, genera humor a través de auto-humor ligero, observaciones ingeniosas o preguntas con un toque de humor.
-- **Uso Estratégico de Emojis:** Incluye emojis en un máximo de 2 de las 5 frases de cada opción. Pueden ir al principio, en medio o al final para reforzar el tono. Usa 🤔/👀 para curiosidad, 😉/😏/😂 para complicidad/humor, y 🔥/🙌/🤯 para admiración.
-- **Banco de Expresiones Variadas:** Evita repetir "Wow". Usa alternativas como: 'Me quito el sombrero', 'Ojo con eso...', 'Ok, eso es impresionante', 'Uff, qué interesante', 'Vaya, eso sí que no me lo esperaba'.
-- **Basado en Evidencia:** Cada opener debe originarse en un detalle VISUAL de la foto o una frase EXACTA de la biografía.
-- **Sin Saludos ni Placeholders:** No uses "Hola" ni texto genérico como `[tu hobby]`.
+                # --- 3. Respuesta en caché ---
+                # La clave depende del contenido de la imagen y del prompt (que incluye perfil y reglas),
+                # así que cualquier cambio de historial o reglas produce una clave distinta.
+                reply_key = content_hash(f"{image_hash}:{nombre_perfil.lower() if nombre_perfil else '-'}:{PROMPT_VERSION}:{content_hash(prompt_dinamico)}")
+                if not regenerar:
+                    respuesta_cacheada = await self.reply_cache.get(reply_key)
+                    if respuesta_cacheada is not None:
+                        await send_chunked(ctx, respuesta_cacheada.decode('utf-8'))
+                        # No se gastó cuota de la API, así que no se aplica el cooldown.
+                        self.reply.reset_cooldown(ctx)
+                        return
 
-**ESTRUCTURA DE RESPUESTA OBLIGATORIA:**
-- Genera dos opciones separadas por `---`.
-- La primera debe titularse `**Opción 1:**` y la segunda `**Opción 2:**`.
-- Cada opción debe ser una secuencia de 5 frases enumeradas (1., 2., etc.).
-- **SALIDA LIMPIA:** No incluyas los nombres de los pasos (como 'El Gancho') en tu respuesta. Solo el texto de la conversación. No uses comillas (`""`).
+                # --- 4. Procesamiento de la Imagen ---
+                # Convertir, redimensionar y comprimir la imagen en el pool de procesos para no bloquear el bot.
+                image_bytes_procesados = await self.image_cache.get(image_hash)
+                if image_bytes_procesados is None:
+                    try:
+                        image_bytes_procesados = await self.images.process(image_bytes)
+                    except (ImagePipelineBusy, ImageTooLarge) as e:
+                        await ctx.send(f"⚠️ {e}", delete_after=15); self.reply.reset_cooldown(ctx); return
+                    await self.image_cache.put(image_hash, image_bytes_procesados)
 
----
-**GUÍA DE ESTILO PARA CADA PASO (Debes seguir esta estructura)**
-
-**Formato A (Secuencia 5 Pasos):**
-1.  Empieza con una observación única y detallada. Usa expresiones como "Me quito el sombrero con..." o "Vaya, no esperaba ver...". Ideal para un emoji de admiración (🔥, 👀, 🤯).
-2.  Continúa relacionando lo que viste con una experiencia propia de forma graciosa. Ejemplo: "Yo intenté escalar una vez y creo que la pared se rio de mí 😂".
-3.  Sigue con una pregunta cerrada, casual y juguetona. Ejemplo: "Así que eres del equipo 'aventura' y no del equipo 'sofá y peli', ¿no? 😉".
-4.  Añade una frase que sirva de transición o una suposición juguetona sobre el tema.
-5.  Termina con una pregunta abierta y genuina. Puede ser sobre experiencias, gustos, o de forma más directa, sobre lo que buscas en una app de citas. Ejemplos: "Fuera de eso, ¿cuál es tu placer culposo más simple y divertido?" o "Hablando de aventuras, ¿cuál es la cualidad más importante que buscas en un compañero de viaje... o de vida? 😉".
-
-**Formato B (Secuencia Alternativa):**
-1.  Empieza con una observación original.
-2.  Sigue con una pregunta cerrada y directa sobre la observación.
-3.  Añade un comentario ingenioso que aporte valor o contexto.
-4.  Continúa relacionando el tema con una experiencia propia de forma graciosa.
-5.  Termina con una pregunta abierta que invite a compartir una anécdota o una reflexión ligera sobre citas. Ejemplo: "¿Cuál es la aventura más loca que te gustaría tener con alguien que conozcas aquí?"
----"""
-
-                # Se añade el contexto del perfil y las reglas al final del prompt base.
-                if hoja_personaje: prompt_dinamico += f"\n\n**CONTEXTO ADICIONAL (TU PERSONAJE):**\n{hoja_personaje}"
-                if reglas_ia_rows: prompt_dinamico += "\n\n**REGLAS ADICIONALES OBLIGATORIAS:**\n" + "\n".join(f"- {regla['regla_texto']}" for regla in reglas_ia_rows)
+                image_for_gemini = {'mime_type': 'image/jpeg', 'data': image_bytes_procesados}
             
-                # --- 4. Llamada a la API de Gemini ---
-                response = await self.bot.gemini_model.generate_content_async([prompt_dinamico, image_for_gemini])
-                
-                # --- 5. Envío de la Respuesta ---
-                # Accedemos al texto de la respuesta de forma segura y lo enviamos al canal.
+                # --- 5. Llamada a la API de Gemini y envío de la Respuesta ---
+                # La respuesta se muestra a medida que llega, editando el mensaje de forma progresiva.
                 try:
-                    respuesta_texto = response.text
-                    await ctx.send(respuesta_texto)
-                except Exception as e:
+                    stream = self.bot.gemini.stream([prompt_dinamico, image_for_gemini], priority=PRIORIDAD_INTERACTIVA)
+                    respuesta_texto = await stream_to_discord(ctx, stream)
+                except ValueError as e:
+                    # `chunk.text` lanza ValueError cuando Gemini bloquea la respuesta por seguridad.
                     await ctx.send(f"Error al procesar la respuesta de la IA: {str(e)}")
-                    print(f"Error en el contenido de la respuesta de Gemini: {response.prompt_feedback}")
+                    log.warning("Error en el contenido de la respuesta de Gemini: %s", e)
+                    return
+                if respuesta_texto.strip():
+                    await self.reply_cache.put(reply_key, respuesta_texto.encode('utf-8'))
 
 
             except Exception as e:
-                # --- 6. Manejo de Errores General ---
+                # --- 7. Manejo de Errores General ---
                 await ctx.send(f"Error general en el comando reply: {str(e)}")
-                print(f"Error general en el comando reply: {str(e)}")
+                log.exception("Error general en el comando reply: %s", e)
 
 
 async def setup(bot):
@@ -1,9 +1,33 @@
 import discord
 from discord.ext import commands
 from datetime import datetime
-from utils.db_manager import db_execute
-from utils.helpers import parse_periodo
+from utils.db_manager import db_execute, db_transaction, rebuild_lm_stats_daily
+from utils.helpers import parse_periodo, periodo_bounds, get_user_timezone, inicio_del_dia
 from utils.views import PaginationView
+from utils.pagination import KeysetPageSource
+
+def consulta_conteo_lms(start, end, filtros, filtro_params):
+    """
+    Construye la consulta de `!stats` para el intervalo [start, end). Los días completos anteriores
+    a hoy se leen del resumen `lm_stats_daily`; solo el día en curso (y posteriores) se cuenta sobre
+    las filas de `lm_logs`. Devuelve (query, params).
+    """
+    user_timezone = get_user_timezone()
+    hoy = inicio_del_dia(datetime.now(user_timezone).date(), user_timezone)
+    primer_dia = start.astimezone(user_timezone).date()
+    fin_resumen = min(end, hoy).astimezone(user_timezone).date()
+    inicio_crudo = max(start, hoy)
+
+    extra = "".join(f" AND {clausula}" for clausula in filtros)
+    query = (
+        "SELECT user_id, turno, SUM(count) AS count FROM ("
+        f"SELECT user_id, turno, count FROM lm_stats_daily WHERE day >= %s AND day < %s{extra} "
+        "UNION ALL "
+        f"SELECT user_id, turno, COUNT(*) AS count FROM lm_logs WHERE timestamp >= %s AND timestamp < %s{extra} GROUP BY user_id, turno"
+        ") AS conteos GROUP BY user_id, turno HAVING SUM(count) > 0 ORDER BY SUM(count) DESC"
+    )
+    params = [primer_dia, fin_resumen, *filtro_params, inicio_crudo, end, *filtro_params]
+    return query, tuple(params)
 
 class StatsCog(commands.Cog, name="Estadísticas"):
     """Comandos para visualizar estadísticas y registros."""
@@ -13,10 +37,11 @@ class StatsCog(commands.Cog, name="Estadísticas"):
     @commands.command(name='estadisticas', aliases=['stats'], help='Muestra estadísticas de LM. Uso: !stats [periodo] [filtro]')
     @commands.has_permissions(administrator=True)
     async def estadisticas(self, ctx, periodo: str = 'hoy', *, filtro: str = None):
-        where_clauses, params, title_periodo = parse_periodo(periodo)
-        if not where_clauses:
+        start, end, title_periodo = periodo_bounds(periodo)
+        if start is None:
             await ctx.send(f"❌ {title_periodo}"); return
-        
+
+        where_clauses, params = [], []
         title = f"Estadísticas {title_periodo}"
 
         if filtro:
@@ -42,8 +67,8 @@ class StatsCog(commands.Cog, name="Estadísticas"):
                     else:
                         await ctx.send(f"🤔 No encontré ningún operador con la mención o apodo `{filtro}`."); return
 
-        query = f"SELECT user_id, turno, COUNT(*) as count FROM lm_logs WHERE {' AND '.join(where_clauses)} GROUP BY user_id, turno ORDER BY COUNT(*) DESC"
-        results = await db_execute(query, tuple(params), fetch='all')
+        query, query_params = consulta_conteo_lms(start, end, where_clauses, params)
+        results = await db_execute(query, query_params, fetch='all')
         
         embed = discord.Embed(title=f"📊 {title}", color=discord.Color.green())
         if not results:
@@ -85,27 +110,19 @@ class StatsCog(commands.Cog, name="Estadísticas"):
             params.append(f"%%{filtro}%%")
             title += f" (Filtro: {filtro})"
 
-        query = f"SELECT author_id, log_message, timestamp FROM exitos_logs WHERE {' AND '.join(where_clauses)} ORDER BY timestamp DESC"
-        results = await db_execute(query, tuple(params), fetch='all')
-
-        if not results:
-            embed = discord.Embed(title=f"🏆 {title}", color=discord.Color.gold(), description="No se encontraron registros de éxitos para los criterios seleccionados.")
-            await ctx.send(embed=embed); return
-
-        log_entries = []
-        for row in results:
+        def format_row(row):
             author = ctx.guild.get_member(row['author_id'])
             author_name = author.mention if author else f"ID: {row['author_id']}"
             ts = row['timestamp']
-            log_entries.append(f"**[{ts.strftime('%d/%m %H:%M')}] - Registrado por: {author_name}**\n> {row['log_message']}\n\n")
+            return f"**[{ts.strftime('%d/%m %H:%M')}] - Registrado por: {author_name}**\n> {row['log_message']}\n\n"
 
-        items_per_page = 5
-        pages = ["".join(log_entries[i:i + items_per_page]) for i in range(0, len(log_entries), items_per_page)]
-        
-        if not pages:
-            await ctx.send("No hay registros para mostrar."); return
+        # Solo se leen de la base de datos las páginas que se muestran.
+        source = KeysetPageSource("exitos_logs", "author_id, log_message, timestamp", where_clauses, params, format_row)
+        if not await source.prepare():
+            embed = discord.Embed(title=f"🏆 {title}", color=discord.Color.gold(), description="No se encontraron registros de éxitos para los criterios seleccionados.")
+            await ctx.send(embed=embed); return
 
-        view = PaginationView(ctx, pages, f"🏆 {title}", color=discord.Color.gold())
+        view = PaginationView(ctx, source, f"🏆 {title} · {source.total_rows} registros", color=discord.Color.gold())
         await view.start()
 
     @commands.command(name='registrolm', aliases=['verlms'], help='Muestra los LMs enviados. Uso: !registrolm [periodo] [filtro]')
@@ -140,21 +157,13 @@ class StatsCog(commands.Cog, name="Estadísticas"):
                     else:
                         await ctx.send(f"🤔 No encontré ningún operador con la mención o apodo `{filtro}`."); return
 
-        query = f"SELECT user_id, perfil_usado, message_content, timestamp, turno FROM lm_logs WHERE {' AND '.join(where_clauses)} ORDER BY timestamp DESC"
-        results = await db_execute(query, tuple(params), fetch='all')
-
-        if not results:
-            embed = discord.Embed(title=f"📜 {title}", color=discord.Color.orange(), description="No se encontraron LMs para los criterios seleccionados.")
-            await ctx.send(embed=embed); return
-
         all_apodos_rows = await db_execute("SELECT user_id, apodo_dia, apodo_tarde, apodo_noche FROM apodos_operador", fetch='all')
         apodos_map = {row['user_id']: row for row in all_apodos_rows}
 
-        log_entries = []
-        for row in results:
+        def format_row(row):
             ts = row['timestamp']
             miembro = ctx.guild.get_member(row['user_id'])
-            
+
             operador_name = miembro.mention if miembro else f"ID: {row['user_id']}"
             turno_log = row['turno']
             user_apodos = apodos_map.get(row['user_id'])
@@ -162,22 +171,26 @@ class StatsCog(commands.Cog, name="Estadísticas"):
                 operador_name = user_apodos[f'apodo_{turno_log}']
 
             perfil_str = f"Perfil: `{row['perfil_usado']}` | " if row['perfil_usado'] != 'N/A' else ""
-            
-            log_entries.append(f"**[{ts.strftime('%H:%M')}] - {perfil_str}Op: {operador_name}**\n> {row['message_content']}\n\n")
-            
-        items_per_page = 5
-        pages = ["".join(log_entries[i:i + items_per_page]) for i in range(0, len(log_entries), items_per_page)]
+            return f"**[{ts.strftime('%H:%M')}] - {perfil_str}Op: {operador_name}**\n> {row['message_content']}\n\n"
 
-        if not pages:
-            await ctx.send("No hay registros para mostrar."); return
+        # Solo se leen de la base de datos las páginas que se muestran.
+        source = KeysetPageSource("lm_logs", "user_id, perfil_usado, message_content, timestamp, turno", where_clauses, params, format_row)
+        if not await source.prepare():
+            embed = discord.Embed(title=f"📜 {title}", color=discord.Color.orange(), description="No se encontraron LMs para los criterios seleccionados.")
+            await ctx.send(embed=embed); return
 
-        view = PaginationView(ctx, pages, f"📜 {title}", color=discord.Color.orange())
+        view = PaginationView(ctx, source, f"📜 {title} · {source.total_rows} LMs", color=discord.Color.orange())
         await view.start()
 
-async def setup(bot):
-    await bot.add_cog(StatsCog(bot))
-        embed.description = description
-        await ctx.send(embed=embed)
+    @commands.command(name='recalcular-stats', help='(Dueño) Reconstruye el resumen diario de LMs desde el registro completo.')
+    @commands.is_owner()
+    async def recalcular_stats(self, ctx):
+        await ctx.send("⏳ Recalculando el resumen diario de LMs... por favor espera.")
+        try:
+            filas = await db_transaction(rebuild_lm_stats_daily)
+            await ctx.send(f"✅ Resumen diario recalculado ({filas} filas).")
+        except Exception as e:
+            await ctx.send(f"❌ Ocurrió un error al recalcular el resumen: {e}")
 
 async def setup(bot):
     await bot.add_cog(StatsCog(bot))
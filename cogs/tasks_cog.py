@@ -1,50 +1,174 @@
+import logging
 import discord
-from discord.ext import commands, tasks
-from datetime import datetime, timedelta
+from discord.ext import commands
+import os
+import heapq
+import asyncio
+from datetime import datetime, timedelta, timezone
 from utils.db_manager import db_execute
+from utils.helpers import get_user_timezone
+from utils.gemini_scheduler import PRIORIDAD_NORMAL, PRIORIDAD_FONDO
+from utils.streaming import stream_to_discord
+
+log = logging.getLogger(__name__)
+
+# Estados de `tareas_programadas.sent`.
+TAREA_PENDIENTE = 0
+TAREA_ENVIADA = 1
+TAREA_FALLIDA = 2
+TAREA_EN_ENVIO = 3
+# Cada cuánto se vuelve a leer la lista de pendientes como red de seguridad (tareas creadas por otro proceso).
+TAREAS_RESYNC_SECONDS = float(os.getenv('TAREAS_RESYNC_SECONDS', '300'))
+# Segundos tras su `send_at` a partir de los que una tarea que sigue "en envío" se da por perdida
+# (el proceso murió entre reclamarla y marcar el resultado) y se marca como fallida.
+TAREAS_EN_ENVIO_TIMEOUT = float(os.getenv('TAREAS_EN_ENVIO_TIMEOUT', '600'))
+
+def parse_fecha_hora(fecha_hora_str):
+    """Convierte 'AAAA-MM-DD HH:MM' en un datetime con la zona horaria configurada (ValueError si no es válido)."""
+    return get_user_timezone().localize(datetime.strptime(fecha_hora_str, '%Y-%m-%d %H:%M'))
 
 class TasksCog(commands.Cog, name="Tareas Programadas"):
-    """Comandos para programar mensajes y tareas."""
+    """
+    Comandos para programar mensajes y tareas.
+    Las tareas pendientes se mantienen en un min-heap en memoria ordenado por `send_at`;
+    el planificador duerme exactamente hasta la siguiente y se despierta antes si se programa otra.
+    """
     def __init__(self, bot):
         self.bot = bot
-        self.check_scheduled_tasks.start()
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._scheduler_task = None
+
+    async def cog_load(self):
+        self._scheduler_task = asyncio.create_task(self.run_scheduler())
 
     def cog_unload(self):
-        self.check_scheduled_tasks.cancel()
+        if self._scheduler_task:
+            self._scheduler_task.cancel()
 
-    @tasks.loop(seconds=60)
-    async def check_scheduled_tasks(self):
-        now = datetime.now()
-        tasks_to_run = await db_execute("SELECT id, channel_id, message_content FROM tareas_programadas WHERE send_at <= ? AND sent = 0", (now,), fetch='all')
-        for task_id, channel_id, message_content in tasks_to_run:
-            channel = self.bot.get_channel(channel_id)
-            if channel:
-                try:
-                    await channel.send(message_content)
-                    await db_execute("UPDATE tareas_programadas SET sent = 1 WHERE id = ?", (task_id,))
-                except Exception as e:
-                    print(f"Error al enviar tarea programada {task_id}: {e}")
-                    await db_execute("UPDATE tareas_programadas SET sent = 2 WHERE id = ?", (task_id,))
-            else:
-                print(f"No se pudo encontrar el canal {channel_id} para la tarea {task_id}. Marcada como fallida.")
-                await db_execute("UPDATE tareas_programadas SET sent = 2 WHERE id = ?", (task_id,))
-
-    @check_scheduled_tasks.before_loop
-    async def before_check_scheduled_tasks(self):
+    # --- Planificador de Tareas ---
+    def schedule(self, task_id, send_at):
+        """Añade una tarea al heap y despierta al planificador por si es la más próxima."""
+        heapq.heappush(self._heap, (send_at, task_id))
+        self._wakeup.set()
+
+    def unschedule(self, task_id):
+        self._heap = [entry for entry in self._heap if entry[1] != task_id]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    async def load_pending(self):
+        """
+        Reconstruye el heap con las tareas pendientes de la base de datos.
+        Con shards repartidos entre procesos, cada uno carga solo las de los servidores de sus shards.
+        """
+        shard_filter, shard_params = "", []
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        if shard_ids and self.bot.shard_count:
+            # Fórmula de Discord para el shard de un servidor: (guild_id >> 22) % shard_count.
+            shard_filter = " AND ((guild_id >> 22) %% %s) = ANY(%s)"
+            shard_params = [self.bot.shard_count, list(shard_ids)]
+        await self.recover_stale(shard_filter, shard_params)
+        query = "SELECT id, send_at FROM tareas_programadas WHERE sent = %s" + shard_filter
+        rows = await db_execute(query, tuple([TAREA_PENDIENTE] + shard_params), fetch='all')
+        self._heap = [(row['send_at'], row['id']) for row in rows]
+        heapq.heapify(self._heap)
+
+    async def recover_stale(self, shard_filter="", shard_params=()):
+        """
+        Marca como fallidas las tareas que siguen "en envío" mucho después de su hora: el proceso que
+        las reclamó murió (o falló el UPDATE final) y no se sabe si llegaron a enviarse. No se reintentan
+        para no arriesgar un envío doble.
+        """
+        limite = datetime.now(timezone.utc) - timedelta(seconds=TAREAS_EN_ENVIO_TIMEOUT)
+        stale = await db_execute(
+            "UPDATE tareas_programadas SET sent = %s WHERE sent = %s AND send_at < %s" + shard_filter + " RETURNING id",
+            tuple([TAREA_FALLIDA, TAREA_EN_ENVIO, limite] + list(shard_params)), fetch='all'
+        )
+        if stale:
+            log.warning("Tareas programadas atascadas en envío marcadas como fallidas: %s", [row['id'] for row in stale])
+
+    async def run_scheduler(self):
+        """Bucle principal: duerme hasta el próximo `send_at` y despacha en bloque las tareas vencidas."""
         await self.bot.wait_until_ready()
+        last_sync = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if loop.time() - last_sync >= TAREAS_RESYNC_SECONDS:
+                    await self.load_pending()
+                    last_sync = loop.time()
+                self._wakeup.clear()
+                now = datetime.now(timezone.utc)
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+                if due:
+                    await self.dispatch(due)
+                    continue
+                timeout = TAREAS_RESYNC_SECONDS
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("Error en el planificador de tareas: %s", e)
+                await asyncio.sleep(5)
+
+    async def dispatch(self, task_ids):
+        """
+        Reclama las tareas (pendiente -> en envío) en una sola sentencia, las envía en paralelo
+        y marca los resultados con un único UPDATE. Solo se envían las filas reclamadas, así que
+        tras un reinicio (o con varios procesos) ninguna tarea se envía dos veces; las que se quedan
+        reclamadas sin resultado las recoge `recover_stale`.
+        """
+        claimed = await db_execute(
+            "UPDATE tareas_programadas SET sent = %s WHERE id = ANY(%s) AND sent = %s RETURNING id, channel_id, message_content",
+            (TAREA_EN_ENVIO, list(task_ids), TAREA_PENDIENTE), fetch='all'
+        )
+        if not claimed:
+            return
+
+        async def send_task(row):
+            channel = self.bot.get_channel(row['channel_id'])
+            if not channel:
+                log.warning("No se pudo encontrar el canal %s para la tarea %s. Marcada como fallida.", row['channel_id'], row['id'])
+                return False
+            try:
+                await channel.send(row['message_content'])
+                return True
+            except Exception as e:
+                log.warning("Error al enviar tarea programada %s: %s", row['id'], e)
+                return False
+
+        results = await asyncio.gather(*(send_task(row) for row in claimed))
+        sent_ids = [row['id'] for row, ok in zip(claimed, results) if ok]
+        claimed_ids = [row['id'] for row in claimed]
+        try:
+            await db_execute(
+                "UPDATE tareas_programadas SET sent = CASE WHEN id = ANY(%s) THEN %s ELSE %s END WHERE id = ANY(%s)",
+                (sent_ids, TAREA_ENVIADA, TAREA_FALLIDA, claimed_ids)
+            )
+        except Exception as e:
+            # Quedan "en envío"; `recover_stale` las marcará como fallidas en la próxima resincronización.
+            log.error("No se pudo guardar el resultado de las tareas %s (enviadas: %s): %s", claimed_ids, sent_ids, e)
 
     @commands.command(name='programar', help='Programa un mensaje. Uso: !programar <#canal> "AAAA-MM-DD HH:MM" <mensaje>')
     @commands.has_permissions(administrator=True)
     async def programar(self, ctx, canal: discord.TextChannel, fecha_hora_str: str, *, mensaje: str):
         try:
-            send_time = datetime.strptime(fecha_hora_str, '%Y-%m-%d %H:%M')
+            send_time = parse_fecha_hora(fecha_hora_str)
         except ValueError:
             await ctx.send("❌ Formato de fecha y hora incorrecto. Usa `AAAA-MM-DD HH:MM`."); return
-        if send_time <= datetime.now():
+        if send_time <= datetime.now(timezone.utc):
             await ctx.send("❌ La fecha y hora deben ser en el futuro."); return
-        await db_execute("INSERT INTO tareas_programadas (guild_id, channel_id, author_id, message_content, send_at) VALUES (?, ?, ?, ?, ?)", (ctx.guild.id, canal.id, ctx.author.id, mensaje, send_time))
-        last_task = await db_execute("SELECT id FROM tareas_programadas ORDER BY id DESC LIMIT 1", fetch='one')
-        task_id = last_task[0] if last_task else 'desconocido'
+        new_task = await db_execute("INSERT INTO tareas_programadas (guild_id, channel_id, author_id, message_content, send_at) VALUES (%s, %s, %s, %s, %s) RETURNING id", (ctx.guild.id, canal.id, ctx.author.id, mensaje, send_time), fetch='one')
+        task_id = new_task['id'] if new_task else 'desconocido'
+        if new_task: self.schedule(new_task['id'], send_time)
         await ctx.send(f"✅ ¡Mensaje programado! Se enviará en {canal.mention} el `{send_time.strftime('%Y-%m-%d a las %H:%M')}`. **ID de tarea: {task_id}**")
 
     @commands.command(name='programar-serie', help='Genera y programa una serie de posts. Uso: !programar-serie <#canal> <cantidad> "AAAA-MM-DD HH:MM" <tema>')
@@ -53,64 +177,71 @@ class TasksCog(commands.Cog, name="Tareas Programadas"):
         if not (1 < cantidad <= 10):
             await ctx.send("❌ La cantidad de posts debe estar entre 2 y 10."); return
         try:
-            start_time = datetime.strptime(fecha_hora_inicio_str, '%Y-%m-%d %H:%M')
+            start_time = parse_fecha_hora(fecha_hora_inicio_str)
         except ValueError:
             await ctx.send("❌ Formato de fecha y hora incorrecto. Usa `AAAA-MM-DD HH:MM`."); return
-        if start_time <= datetime.now():
+        if start_time <= datetime.now(timezone.utc):
             await ctx.send("❌ La fecha y hora de inicio deben ser en el futuro."); return
         await ctx.send(f"🧠 Entendido. Generando una serie de **{cantidad} posts** sobre '{tema}'. Esto puede tardar un momento...")
         async with ctx.typing():
             try:
                 prompt_serie = f'**TAREA:** Eres un creador de contenido experto. Genera una serie de {cantidad} publicaciones cortas y atractivas sobre el tema "{tema}".\n**REGLAS CRÍTICAS DE FORMATO:**\n1. Cada publicación debe ser un texto completo y coherente por sí mismo.\n2. Separa CADA publicación con el delimitador exacto y único: `|||---|||`\n3. No añadas números de lista (como 1., 2.) ni ningún otro texto introductorio o de cierre. Solo las publicaciones y el delimitador.'
-                response = await self.bot.gemini_model.generate_content_async(prompt_serie)
+                response = await self.bot.gemini.generate(prompt_serie, priority=PRIORIDAD_FONDO)
                 posts = response.text.split('|||---|||')
                 if len(posts) < cantidad:
                     await ctx.send(f"⚠️ La IA generó menos posts de los solicitados ({len(posts)} de {cantidad}). Inténtalo de nuevo."); return
-                created_tasks_ids = []
-                for i, post_content in enumerate(posts[:cantidad]):
-                    send_time = start_time + timedelta(days=i)
-                    await db_execute("INSERT INTO tareas_programadas (guild_id, channel_id, author_id, message_content, send_at) VALUES (?, ?, ?, ?, ?)", (ctx.guild.id, canal.id, ctx.author.id, post_content.strip(), send_time))
-                    last_task = await db_execute("SELECT id FROM tareas_programadas ORDER BY id DESC LIMIT 1", fetch='one')
-                    if last_task: created_tasks_ids.append(str(last_task[0]))
+                # Todas las publicaciones se insertan en una sola sentencia y se recuperan sus IDs con RETURNING.
+                # La hora local se mantiene día a día aunque haya un cambio de horario (DST) en medio de la serie.
+                tz = get_user_timezone()
+                send_times = [tz.localize(start_time.replace(tzinfo=None) + timedelta(days=i)) for i in range(cantidad)]
+                filas = [(ctx.guild.id, canal.id, ctx.author.id, post_content.strip(), send_times[i]) for i, post_content in enumerate(posts[:cantidad])]
+                new_tasks = await db_execute("INSERT INTO tareas_programadas (guild_id, channel_id, author_id, message_content, send_at) VALUES %s RETURNING id", filas, fetch='values')
+                for row, send_time in zip(new_tasks, send_times):
+                    self.schedule(row['id'], send_time)
+                created_tasks_ids = [str(row['id']) for row in new_tasks]
                 await ctx.send(f"✅ ¡Serie de {len(created_tasks_ids)} posts generada y programada en {canal.mention}! IDs de tarea: `{', '.join(created_tasks_ids)}`")
             except Exception as e:
-                await ctx.send("❌ Error al generar la serie de contenido con la IA."); print(f"Error en !programar-serie: {e}")
+                await ctx.send("❌ Error al generar la serie de contenido con la IA."); log.exception("Error en !programar-serie: %s", e)
 
     @commands.command(name='programar-ia', aliases=['programaria'], help='Genera y programa contenido con IA. Uso: !programar-ia <#canal> "AAAA-MM-DD HH:MM" <prompt>')
     @commands.has_permissions(administrator=True)
     async def programar_ia(self, ctx, canal: discord.TextChannel, fecha_hora_str: str, *, prompt: str):
         try:
-            send_time = datetime.strptime(fecha_hora_str, '%Y-%m-%d %H:%M')
+            send_time = parse_fecha_hora(fecha_hora_str)
         except ValueError:
             await ctx.send("❌ Formato de fecha y hora incorrecto. Usa `AAAA-MM-DD HH:MM`."); return
-        if send_time <= datetime.now():
+        if send_time <= datetime.now(timezone.utc):
             await ctx.send("❌ La fecha y hora deben ser en el futuro."); return
         await ctx.send(f"🧠 Entendido. Generando y programando contenido con IA...")
         async with ctx.typing():
             try:
-                response = await self.bot.gemini_model.generate_content_async(prompt)
-                mensaje_generado = response.text
-                await db_execute("INSERT INTO tareas_programadas (guild_id, channel_id, author_id, message_content, send_at) VALUES (?, ?, ?, ?, ?)", (ctx.guild.id, canal.id, ctx.author.id, mensaje_generado, send_time))
-                last_task = await db_execute("SELECT id FROM tareas_programadas ORDER BY id DESC LIMIT 1", fetch='one')
-                task_id = last_task[0] if last_task else 'desconocido'
+                # Se muestra una vista previa del contenido a medida que se genera y luego se programa completo.
+                stream = self.bot.gemini.stream(prompt, priority=PRIORIDAD_NORMAL)
+                mensaje_generado = (await stream_to_discord(ctx, stream, embed_title="📝 Vista previa del contenido", color=discord.Color.gold())).strip()
+                if not mensaje_generado:
+                    await ctx.send("❌ La IA no generó contenido. Inténtalo de nuevo."); return
+                new_task = await db_execute("INSERT INTO tareas_programadas (guild_id, channel_id, author_id, message_content, send_at) VALUES (%s, %s, %s, %s, %s) RETURNING id", (ctx.guild.id, canal.id, ctx.author.id, mensaje_generado, send_time), fetch='one')
+                task_id = new_task['id'] if new_task else 'desconocido'
+                if new_task: self.schedule(new_task['id'], send_time)
                 await ctx.send(f"✅ ¡Contenido generado y programado! Se enviará en {canal.mention} el `{send_time.strftime('%Y-%m-%d a las %H:%M')}`. **ID de tarea: {task_id}**")
             except Exception as e:
-                await ctx.send("❌ Error al generar o programar el contenido con la IA."); print(f"Error en !programar-ia: {e}")
+                await ctx.send("❌ Error al generar o programar el contenido con la IA."); log.exception("Error en !programar-ia: %s", e)
 
     @commands.command(name='tareas', help='Muestra los mensajes programados pendientes.')
     @commands.has_permissions(administrator=True)
     async def tareas(self, ctx):
-        pending_tasks = await db_execute("SELECT id, channel_id, author_id, send_at, message_content FROM tareas_programadas WHERE sent = 0 AND guild_id = ? ORDER BY send_at ASC", (ctx.guild.id,), fetch='all')
+        pending_tasks = await db_execute("SELECT id, channel_id, author_id, send_at, message_content FROM tareas_programadas WHERE sent = %s AND guild_id = %s ORDER BY send_at ASC", (TAREA_PENDIENTE, ctx.guild.id), fetch='all')
         if not pending_tasks:
             await ctx.send("No hay tareas programadas pendientes."); return
         embed = discord.Embed(title="🗓️ Tareas Programadas Pendientes", color=discord.Color.gold())
         description = ""
-        for task_id, channel_id, author_id, send_at_str, message in pending_tasks:
+        tz = get_user_timezone()
+        for task_id, channel_id, author_id, send_at, message in pending_tasks:
             channel = self.bot.get_channel(channel_id)
             author = self.bot.get_user(author_id)
             channel_mention = channel.mention if channel else f"ID: {channel_id}"
             author_name = author.name if author else f"ID: {author_id}"
-            send_at = datetime.fromisoformat(send_at_str)
+            send_at = send_at.astimezone(tz)
             description += f"**ID: {task_id}** | {channel_mention} | Por: `{author_name}` | `{send_at.strftime('%Y-%m-%d %H:%M')}`\n```{message[:100]}{'...' if len(message) > 100 else ''}```\n"
         if len(description) > 4000:
             description = description[:4000] + "\n\n*[Resultados truncados]*"
@@ -120,8 +251,9 @@ class TasksCog(commands.Cog, name="Tareas Programadas"):
     @commands.command(name='borrartarea', help='Borra una tarea programada por su ID.')
     @commands.has_permissions(administrator=True)
     async def borrartarea(self, ctx, task_id: int):
-        rows = await db_execute("DELETE FROM tareas_programadas WHERE id = ? AND guild_id = ?", (task_id, ctx.guild.id))
+        rows = await db_execute("DELETE FROM tareas_programadas WHERE id = %s AND guild_id = %s", (task_id, ctx.guild.id))
         if rows > 0:
+            self.unschedule(task_id)
             await ctx.send(f"✅ Tarea con ID `{task_id}` eliminada.")
         else:
             await ctx.send(f"🤔 No encontré una tarea pendiente con el ID `{task_id}` en este servidor.")
@@ -1,15 +1,55 @@
+import logging
 import discord
 from discord.ext import commands
 from datetime import datetime, date, timedelta
 import os
 import pytz
 from utils.db_manager import db_execute
-from utils.helpers import get_turno_key, TURNOS_DISPLAY
+from utils.helpers import get_turno_key, get_user_timezone, rango_dias, TURNOS_DISPLAY
+from utils.gemini_scheduler import PRIORIDAD_NORMAL
+from utils.streaming import stream_to_discord
+from utils.search import build_tsquery, TS_CONFIG
+from utils.summarizer import Summarizer
+from utils.views import PaginationView
+
+log = logging.getLogger(__name__)
+
+# Búsqueda de texto completo sobre `message_tsv` (índice GIN), ordenada por relevancia.
+SEARCH_QUERY = (
+    f"SELECT user_name, message, timestamp FROM chats_guardados, to_tsquery('{TS_CONFIG}', %s) AS q "
+    "WHERE message_tsv @@ q ORDER BY ts_rank(message_tsv, q) DESC, timestamp DESC LIMIT %s"
+)
+# Mensajes guardados de un día [inicio, fin) en orden cronológico (índice por fecha), hasta un límite.
+DAY_QUERY = "SELECT user_name, message, timestamp FROM chats_guardados WHERE timestamp >= %s AND timestamp < %s ORDER BY timestamp ASC LIMIT %s"
+DAY_SUMMARY_QUERY = "SELECT user_name, message FROM chats_guardados WHERE timestamp >= %s AND timestamp < %s ORDER BY timestamp ASC LIMIT %s"
+SEARCH_LIMIT = 50
+SEARCH_PAGE_SIZE = 10
+SUMMARY_SEARCH_LIMIT = 300
+
+def fecha_de_consulta(query, tz):
+    """
+    Interpreta `AAAA-MM-DD`, `hoy` o `ayer` (en la zona `tz`) y devuelve (fecha, texto para el título),
+    o None si `query` es una búsqueda de texto.
+    """
+    try:
+        fecha = datetime.strptime(query, '%Y-%m-%d').date()
+        return fecha, f"del {fecha.strftime('%d-%m-%Y')}"
+    except ValueError:
+        pass
+    clean_query = query.lower().strip()
+    if clean_query == 'hoy':
+        fecha = datetime.now(tz).date()
+        return fecha, f"de hoy ({fecha.strftime('%d-%m-%Y')})"
+    if clean_query == 'ayer':
+        fecha = (datetime.now(tz) - timedelta(days=1)).date()
+        return fecha, f"de ayer ({fecha.strftime('%d-%m-%Y')})"
+    return None
 
 class UtilityCog(commands.Cog, name="Utilidad"):
     """Comandos de utilidad general, memoria y comandos dinámicos."""
     def __init__(self, bot):
         self.bot = bot
+        self.summarizer = Summarizer(bot)
 
     @commands.command(name='guardar', help='Guarda un mensaje en la memoria.')
     async def guardar_chat(self, ctx, *, mensaje: str):
@@ -26,92 +66,89 @@ class UtilityCog(commands.Cog, name="Utilidad"):
         await db_execute("INSERT INTO chats_guardados (user_id, user_name, message, timestamp, turno) VALUES (%s, %s, %s, %s, %s)", (ctx.author.id, ctx.author.name, mensaje, now, turno_display))
         await ctx.send(f"✅ ¡Mensaje guardado! (Turno: {turno_display})")
 
-    @commands.command(name='buscar', help='Busca en la memoria. Uso: !buscar <término/fecha>')
+    @commands.command(name='buscar', help='Busca en la memoria. Uso: !buscar <fecha/hoy/ayer> o !buscar palabras "frase exacta" prefijo* -excluir OR otra')
     async def buscar(self, ctx, *, query: str):
-        sql_query, params, title = "", (), ""
-        
-        # Obtener la zona horaria para la consulta
-        tz_str = os.getenv('TIMEZONE', 'UTC')
-        
-        try:
-            search_date = datetime.strptime(query, '%Y-%m-%d').date()
-            # Usamos AT TIME ZONE para asegurar que la comparación de fechas respete la zona horaria
-            sql_query = f"SELECT * FROM chats_guardados WHERE DATE(timestamp AT TIME ZONE '{tz_str}') = %s ORDER BY timestamp ASC"
-            params, title = (search_date,), f"Memoria del {search_date.strftime('%d-%m-%Y')}"
-        except ValueError:
-            clean_query = query.lower().strip()
-            if clean_query == 'hoy':
-                search_date = datetime.now(pytz.timezone(tz_str)).date()
-                sql_query = f"SELECT * FROM chats_guardados WHERE DATE(timestamp AT TIME ZONE '{tz_str}') = %s ORDER BY timestamp ASC"
-                params, title = (search_date,), f"Memoria de hoy ({search_date.strftime('%d-%m-%Y')})"
-            elif clean_query == 'ayer':
-                search_date = (datetime.now(pytz.timezone(tz_str)) - timedelta(days=1)).date()
-                sql_query = f"SELECT * FROM chats_guardados WHERE DATE(timestamp AT TIME ZONE '{tz_str}') = %s ORDER BY timestamp ASC"
-                params, title = (search_date,), f"Memoria de ayer ({search_date.strftime('%d-%m-%Y')})"
-            else:
-                sql_query, params, title = "SELECT * FROM chats_guardados WHERE LOWER(message) LIKE %s ORDER BY timestamp DESC", (f"%{query.lower()}%",), f"Resultados para: '{query}'"
-        
+        time_format = '%H:%M'
+
+        # Las fechas se traducen a un rango [inicio, fin) en la zona horaria del bot para poder usar el índice por fecha.
+        user_timezone = get_user_timezone()
+        fecha = fecha_de_consulta(query, user_timezone)
+        if fecha:
+            search_date, etiqueta = fecha
+            inicio, fin = rango_dias(search_date, search_date, user_timezone)
+            sql_query, params, title = DAY_QUERY, (inicio, fin, SEARCH_LIMIT), f"Memoria {etiqueta}"
+        else:
+            tsquery = build_tsquery(query)
+            if not tsquery:
+                await ctx.send("❌ La búsqueda no contiene palabras. Usa palabras, `\"frases exactas\"`, `prefijo*`, `-excluir` u `OR`."); return
+            sql_query, params, title = SEARCH_QUERY, (tsquery, SEARCH_LIMIT), f"Resultados para: '{query}'"
+            time_format = '%d/%m %H:%M'
+
         rows = await db_execute(sql_query, params, fetch='all')
         if not rows:
             await ctx.send(f"🤔 No encontré resultados para: **{query}**."); return
-        
-        description = ""
+        if len(rows) == SEARCH_LIMIT:
+            title += f" (primeros {SEARCH_LIMIT})"
+
+        entries = []
         for r in rows:
             # Convertir a la zona horaria local para mostrar
-            local_ts = r['timestamp'].astimezone(pytz.timezone(tz_str))
-            description += f"**- {local_ts.strftime('%H:%M')} por {r['user_name']}**: `{r['message']}`\n"
-        embed = discord.Embed(title=title, color=discord.Color.green())
-        if len(description) > 4000:
-            description = description[:4000] + "\n\n*[Resultados truncados por su longitud]*"
-        embed.description = description
-        await ctx.send(embed=embed)
+            local_ts = r['timestamp'].astimezone(user_timezone)
+            entries.append(f"**- {local_ts.strftime(time_format)} por {r['user_name']}**: `{r['message']}`\n")
+        # Cada página lleva hasta SEARCH_PAGE_SIZE resultados sin pasar del límite de un embed.
+        pages = [""]
+        for count, entry in enumerate(entries):
+            entry = entry[:4000]
+            if pages[-1] and (count % SEARCH_PAGE_SIZE == 0 or len(pages[-1]) + len(entry) > 4000):
+                pages.append("")
+            pages[-1] += entry
+        view = PaginationView(ctx, pages, title, color=discord.Color.green())
+        await view.start()
 
     @commands.command(name='resumir', help='Crea un resumen con IA de la memoria. Uso: !resumir <hoy/ayer/término>')
     async def resumir(self, ctx, *, query: str):
-        sql_query, params, title_prefix = "", (), ""
-        
-        tz_str = os.getenv('TIMEZONE', 'UTC')
-
-        try:
-            search_date = datetime.strptime(query, '%Y-%m-%d').date()
-            sql_query = f"SELECT user_name, message FROM chats_guardados WHERE DATE(timestamp AT TIME ZONE '{tz_str}') = %s ORDER BY timestamp ASC"
-            params, title_prefix = (search_date,), f"Resumen del {search_date.strftime('%d-%m-%Y')}"
-        except ValueError:
-            clean_query = query.lower().strip()
-            if clean_query == 'hoy':
-                search_date = datetime.now(pytz.timezone(tz_str)).date()
-                sql_query = f"SELECT user_name, message FROM chats_guardados WHERE DATE(timestamp AT TIME ZONE '{tz_str}') = %s ORDER BY timestamp ASC"
-                params, title_prefix = (search_date,), f"Resumen de hoy ({search_date.strftime('%d-%m-%Y')})"
-            elif clean_query == 'ayer':
-                search_date = (datetime.now(pytz.timezone(tz_str)) - timedelta(days=1)).date()
-                sql_query = f"SELECT user_name, message FROM chats_guardados WHERE DATE(timestamp AT TIME ZONE '{tz_str}') = %s ORDER BY timestamp ASC"
-                params, title_prefix = (search_date,), f"Resumen de ayer ({search_date.strftime('%d-%m-%Y')})"
-            else:
-                sql_query, params, title_prefix = "SELECT user_name, message FROM chats_guardados WHERE LOWER(message) LIKE %s ORDER BY timestamp DESC", (f"%{query.lower()}%",), f"Resumen sobre '{query}'"
+        user_timezone = get_user_timezone()
+        fecha = fecha_de_consulta(query, user_timezone)
+        if fecha:
+            search_date, etiqueta = fecha
+            inicio, fin = rango_dias(search_date, search_date, user_timezone)
+            sql_query, params, title_prefix = DAY_SUMMARY_QUERY, (inicio, fin, SUMMARY_SEARCH_LIMIT), f"Resumen {etiqueta}"
+        else:
+            tsquery = build_tsquery(query)
+            if not tsquery:
+                await ctx.send("❌ La búsqueda no contiene palabras que resumir."); return
+            # Los mensajes más relevantes se resumen en orden cronológico.
+            sql_query = f"SELECT user_name, message FROM ({SEARCH_QUERY}) AS relevantes ORDER BY timestamp ASC"
+            params, title_prefix = (tsquery, SUMMARY_SEARCH_LIMIT), f"Resumen sobre '{query}'"
 
         async with ctx.typing():
             rows = await db_execute(sql_query, params, fetch='all')
             if not rows:
                 await ctx.send(f"🤔 No encontré nada que resumir para: **{query}**."); return
             
-            chat_log = "\n".join([f"{row['user_name']}: {row['message']}" for row in rows])
-            if len(chat_log) > 15000: chat_log = chat_log[:15000]
+            chat_lines = [f"{row['user_name']}: {row['message']}" for row in rows]
 
             try:
-                prompt_resumen = f"**TAREA:** Eres un asistente que resume conversaciones. Analiza el siguiente registro de chat y extrae los puntos, ideas o eventos más importantes. Presenta el resumen en una lista de viñetas (bullet points). Sé conciso y claro.\n\n**REGISTRO DE CHAT:**\n---\n{chat_log}\n---\n\n**RESUMEN:**"
-                response = await self.bot.gemini_model.generate_content_async(prompt_resumen)
-                embed = discord.Embed(title=f"🧠 {title_prefix}", color=discord.Color.blue())
-                embed.description = response.text
-                await ctx.send(embed=embed)
+                # Los registros largos se resumen por bloques y el resumen final se muestra en un embed
+                # que se va editando a medida que llega la respuesta.
+                stream = self.summarizer.stream(chat_lines, priority=PRIORIDAD_NORMAL)
+                await stream_to_discord(ctx, stream, embed_title=f"🧠 {title_prefix}", color=discord.Color.blue())
             except Exception as e:
-                await ctx.send("❌ Error al generar el resumen con la IA."); print(f"Error en !resumir: {e}")
+                await ctx.send("❌ Error al generar el resumen con la IA."); log.exception("Error en !resumir: %s", e)
 
     @commands.command(name='crearcomando', help='Crea un comando personalizado.')
     @commands.has_permissions(administrator=True)
     async def crear_comando(self, ctx, nombre: str, *, respuesta: str):
-        await db_execute("INSERT INTO comandos_dinamicos (nombre_comando, respuesta_comando, creador_id, creador_nombre) VALUES (%s, %s, %s, %s) ON CONFLICT (nombre_comando) DO UPDATE SET respuesta_comando = EXCLUDED.respuesta_comando, creador_id = EXCLUDED.creador_id, creador_nombre = EXCLUDED.creador_nombre", (nombre.lower(), respuesta, ctx.author.id, ctx.author.name))
-        self.bot.dynamic_commands[nombre.lower()] = respuesta 
-        await ctx.send(f"✅ ¡Comando `!{nombre.lower()}` creado/actualizado!")
+        nombre = nombre.lower()
+        registry = self.bot.command_registry
+        # Un comando fijo o un alias con ese nombre se ejecutarían antes que el comando personalizado.
+        if self.bot.get_command(nombre):
+            await ctx.send(f"❌ `!{nombre}` ya es un comando del bot; elige otro nombre."); return
+        if nombre in registry.alias:
+            await ctx.send(f"❌ `!{nombre}` ya es un alias de `!{registry.alias[nombre]}`; bórralo con `!borraralias` o elige otro nombre."); return
+        await db_execute("INSERT INTO comandos_dinamicos (nombre_comando, respuesta_comando, creador_id, creador_nombre) VALUES (%s, %s, %s, %s) ON CONFLICT (nombre_comando) DO UPDATE SET respuesta_comando = EXCLUDED.respuesta_comando, creador_id = EXCLUDED.creador_id, creador_nombre = EXCLUDED.creador_nombre", (nombre, respuesta, ctx.author.id, ctx.author.name))
+        registry.dinamico_guardado(nombre, respuesta, ctx.author.id, ctx.author.name)
+        await ctx.send(f"✅ ¡Comando `!{nombre}` creado/actualizado!")
 
     @commands.command(name='borrarcomando', help='Borra un comando personalizado.')
     @commands.has_permissions(administrator=True)
@@ -119,11 +156,36 @@ class UtilityCog(commands.Cog, name="Utilidad"):
         nombre = nombre.lower()
         rows = await db_execute("DELETE FROM comandos_dinamicos WHERE nombre_comando = %s", (nombre,))
         if rows > 0:
-            if nombre in self.bot.dynamic_commands: del self.bot.dynamic_commands[nombre]
+            self.bot.command_registry.dinamico_borrado(nombre)
             await ctx.send(f"✅ ¡Comando `!{nombre}` borrado!")
         else:
             await ctx.send(f"🤔 No encontré un comando personalizado llamado `{nombre}`.")
 
+    @commands.command(name='aliascomando', help='Crea un alias para un comando personalizado. Uso: !aliascomando <alias> <comando>')
+    @commands.has_permissions(administrator=True)
+    async def alias_comando(self, ctx, alias: str, nombre: str):
+        alias, nombre = alias.lower(), nombre.lower()
+        registry = self.bot.command_registry
+        destino = registry.resolve_dinamico(nombre)
+        if not destino:
+            await ctx.send(f"🤔 No encontré un comando personalizado llamado `{nombre}`."); return
+        if self.bot.get_command(alias) or alias in registry.dinamicos:
+            await ctx.send(f"❌ `!{alias}` ya es un comando; elige otro alias."); return
+        await db_execute("INSERT INTO alias_comandos_dinamicos (alias, nombre_comando) VALUES (%s, %s) ON CONFLICT (alias) DO UPDATE SET nombre_comando = EXCLUDED.nombre_comando", (alias, destino))
+        registry.alias_guardado(alias, destino)
+        await ctx.send(f"✅ `!{alias}` ahora responde como `!{destino}`.")
+
+    @commands.command(name='borraralias', help='Borra un alias de un comando personalizado.')
+    @commands.has_permissions(administrator=True)
+    async def borrar_alias(self, ctx, alias: str):
+        alias = alias.lower()
+        rows = await db_execute("DELETE FROM alias_comandos_dinamicos WHERE alias = %s", (alias,))
+        if rows > 0:
+            self.bot.command_registry.alias_borrado(alias)
+            await ctx.send(f"✅ ¡Alias `!{alias}` borrado!")
+        else:
+            await ctx.send(f"🤔 No encontré un alias llamado `{alias}`.")
+
     @commands.command(name='saludar', help='Un simple saludo.')
     async def saludar(self, ctx):
         await ctx.send(f'¡Hola, {ctx.author.name}! Estoy listo para tus órdenes.')
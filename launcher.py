@@ -0,0 +1,165 @@
+# =================================================================================
+# ||   LANZADOR DE PROCESOS CON SHARDS                                           ||
+# =================================================================================
+"""
+Lanza varios procesos de bot.py, cada uno con un rango de shards de Discord:
+- LAUNCHER_WORKERS: número de procesos (por defecto, uno por CPU).
+- SHARD_COUNT: número total de shards (por defecto, igual al número de procesos).
+- PORT: puerto base; el proceso i usa PORT + i para su servidor web y sus métricas.
+Cada proceso recibe SHARD_COUNT, SHARD_IDS, INSTANCE_ID y PORT en su entorno. El estado compartido
+(tareas, configuración, perfiles) vive en PostgreSQL y las cachés se sincronizan con LISTEN/NOTIFY.
+
+Señales:
+- SIGHUP: reinicio escalonado, un proceso cada vez (esperando a que su /readyz responda), para no dejar
+  todos los shards sin conexión a la vez.
+- SIGTERM / SIGINT: detiene todos los procesos de forma ordenada.
+Si un proceso termina inesperadamente, se vuelve a lanzar con una espera creciente.
+"""
+import logging
+import os
+import sys
+import signal
+import asyncio
+import aiohttp
+from dotenv import load_dotenv
+
+# Antes de importar `utils.*`, que leen su configuración (LOG_*, ...) al importarse.
+load_dotenv()
+
+from utils.sharding import split_shards
+from utils.logging_setup import setup_logging
+
+log = logging.getLogger('launcher')
+
+WORKERS = int(os.getenv('LAUNCHER_WORKERS', str(os.cpu_count() or 1)))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', str(WORKERS)))
+BASE_PORT = int(os.getenv('PORT', '8080'))
+# Segundos que se espera a que un proceso salga tras SIGTERM antes de forzarlo.
+STOP_TIMEOUT = float(os.getenv('LAUNCHER_STOP_TIMEOUT', '30'))
+# Segundos mínimos entre el arranque de un proceso y el reinicio del siguiente en un reinicio escalonado
+# (Discord limita los IDENTIFY, así que tampoco conviene arrancar todos a la vez).
+RESTART_INTERVAL = float(os.getenv('LAUNCHER_RESTART_INTERVAL', '15'))
+# Segundos máximos esperando a que /readyz del proceso reiniciado responda 200 antes de seguir.
+READY_TIMEOUT = float(os.getenv('LAUNCHER_READY_TIMEOUT', '120'))
+RESPAWN_DELAY_MAX = 60.0
+
+class Worker:
+    """Un proceso de bot.py con su rango de shards."""
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.port = BASE_PORT + index
+        self.process = None
+        self.stopping = False
+        self.failures = 0
+
+    def env(self):
+        env = dict(os.environ)
+        env.update({
+            'SHARD_COUNT': str(SHARD_COUNT),
+            'SHARD_IDS': ",".join(map(str, self.shard_ids)),
+            'INSTANCE_ID': f"worker-{self.index}",
+            'PORT': str(self.port),
+        })
+        return env
+
+    async def start(self):
+        self.stopping = False
+        self.process = await asyncio.create_subprocess_exec(sys.executable, 'bot.py', env=self.env())
+        log.info("Proceso %s (pid %s) iniciado con shards %s en el puerto %s", self.index, self.process.pid, self.shard_ids, self.port)
+
+    async def stop(self):
+        """Envía SIGTERM y espera a que salga; si no lo hace en STOP_TIMEOUT, lo mata."""
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("El proceso %s no terminó a tiempo; se fuerza su cierre.", self.index)
+            self.process.kill()
+            await self.process.wait()
+
+    async def wait_ready(self, timeout=READY_TIMEOUT):
+        """Consulta /readyz del proceso hasta que responda 200. Devuelve False si se agota `timeout`."""
+        url = f"http://127.0.0.1:{self.port}/readyz"
+        deadline = asyncio.get_running_loop().time() + timeout
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            while asyncio.get_running_loop().time() < deadline:
+                if self.process.returncode is not None:
+                    return False
+                try:
+                    async with session.get(url) as resp:
+                        if resp.status == 200:
+                            return True
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                await asyncio.sleep(2)
+        return False
+
+class Launcher:
+    def __init__(self, workers, shard_count):
+        self.workers = [Worker(i, ids) for i, ids in enumerate(split_shards(shard_count, workers))]
+        self._shutdown = asyncio.Event()
+        self._restarting = False
+
+    async def supervise(self, worker):
+        """Vuelve a lanzar el proceso si termina sin que se le haya pedido."""
+        while not self._shutdown.is_set():
+            await worker.process.wait()
+            if worker.stopping or self._shutdown.is_set():
+                # Lo detuvo un reinicio escalonado o el apagado; quien lo detuvo se encarga de él.
+                await asyncio.sleep(1)
+                continue
+            worker.failures += 1
+            delay = min(RESPAWN_DELAY_MAX, 2 ** worker.failures)
+            log.warning("El proceso %s terminó con código %s; se relanza en %ss.", worker.index, worker.process.returncode, delay)
+            await asyncio.sleep(delay)
+            if not self._shutdown.is_set():
+                await worker.start()
+
+    async def rolling_restart(self):
+        if self._restarting:
+            return
+        self._restarting = True
+        log.info("Reinicio escalonado iniciado")
+        try:
+            for worker in self.workers:
+                if self._shutdown.is_set():
+                    return
+                await worker.stop()
+                await worker.start()
+                worker.failures = 0
+                # No se reinicia el siguiente hasta que este vuelva a estar listo.
+                listo, _ = await asyncio.gather(worker.wait_ready(), asyncio.sleep(RESTART_INTERVAL))
+                if not listo:
+                    log.warning("El proceso %s no respondió en /readyz a tiempo; se continúa.", worker.index)
+            log.info("Reinicio escalonado completado")
+        finally:
+            self._restarting = False
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.rolling_restart()))
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._shutdown.set)
+
+        for i, worker in enumerate(self.workers):
+            if i:
+                await asyncio.sleep(RESTART_INTERVAL)
+            await worker.start()
+        supervisors = [asyncio.create_task(self.supervise(worker)) for worker in self.workers]
+
+        await self._shutdown.wait()
+        log.info("Apagando todos los procesos...")
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        for task in supervisors:
+            task.cancel()
+
+if __name__ == "__main__":
+    setup_logging('launcher')
+    if SHARD_COUNT < WORKERS:
+        log.critical("SHARD_COUNT (%s) debe ser mayor o igual que LAUNCHER_WORKERS (%s).", SHARD_COUNT, WORKERS)
+        sys.exit(1)
+    asyncio.run(Launcher(WORKERS, SHARD_COUNT).run())
@@ -0,0 +1,136 @@
+"""
+Benchmark de los filtros por periodo de `!stats` y `!registrolm` sobre una tabla `lm_logs` grande.
+
+Compara, con `EXPLAIN (ANALYZE)`, los predicados antiguos de `parse_periodo` (`DATE(timestamp AT TIME ZONE ...)`,
+`to_char(...)`) con los límites semiabiertos `timestamp >= %s AND timestamp < %s` que calcula ahora
+`periodo_bounds`, primero sin índices y después con los índices de `lm_logs` de las migraciones 2 y 5.
+
+Uso (contra una base de datos de pruebas; todo se crea en el esquema `bench_periodo` y se borra al final):
+
+    BENCH_DATABASE_URL=postgresql://... python -m tests.bench_periodo [--filas 2000000] [--keep]
+
+No forma parte de la suite de pytest (el nombre no empieza por `test_`).
+"""
+import os
+import time
+import argparse
+from datetime import datetime
+import psycopg2
+import pytz
+from utils.helpers import periodo_bounds
+from utils.db_manager import MIGRATIONS
+
+ESQUEMA = 'bench_periodo'
+PERIODOS = ('hoy', 'semana', 'mes')
+OPERADORES = 50
+USUARIO_FILTRO = 1007
+COLUMNAS_REGISTRO = "user_id, perfil_usado, message_content, timestamp, turno"
+
+def predicados_antiguos(periodo, tz_str):
+    """Cláusulas y parámetros que generaba `parse_periodo` antes de calcular los límites en Python."""
+    date_clause = f"DATE(timestamp AT TIME ZONE '{tz_str}')"
+    if periodo == 'hoy':
+        hoy = datetime.now(pytz.timezone(tz_str)).date().isoformat()
+        return [f"{date_clause} = %s"], [hoy]
+    if periodo == 'semana':
+        return ["to_char(timestamp AT TIME ZONE %s, 'IYYY-IW') = to_char(now() AT TIME ZONE %s, 'IYYY-IW')"], [tz_str, tz_str]
+    return ["to_char(timestamp AT TIME ZONE %s, 'YYYY-MM') = to_char(now() AT TIME ZONE %s, 'YYYY-MM')"], [tz_str, tz_str]
+
+def predicados_nuevos(periodo, tz):
+    inicio, fin, _ = periodo_bounds(periodo, tz)
+    return ["timestamp >= %s AND timestamp < %s"], [inicio, fin]
+
+def consultas(clausulas, params):
+    """(nombre, query, params) de las consultas de `!registrolm` y de la parte sobre `lm_logs` de `!stats`."""
+    casos = []
+    for filtro, extra, extra_params in (("todos", [], []), ("operador", ["user_id = %s"], [USUARIO_FILTRO])):
+        where = " AND ".join(clausulas + extra)
+        p = params + extra_params
+        casos += [
+            (f"registrolm página ({filtro})",
+             f"SELECT {COLUMNAS_REGISTRO}, id FROM lm_logs WHERE {where} ORDER BY timestamp DESC, id DESC LIMIT %s", p + [10]),
+            (f"registrolm total ({filtro})", f"SELECT COUNT(*) FROM lm_logs WHERE {where}", p),
+            (f"stats lm_logs ({filtro})", f"SELECT user_id, turno, COUNT(*) FROM lm_logs WHERE {where} GROUP BY user_id, turno", p),
+        ]
+    return casos
+
+def nodos_de_lectura(plan):
+    """Nodos que leen `lm_logs` (tipo e índice) de un plan en JSON."""
+    nodos = []
+    if plan.get('Relation Name') == 'lm_logs' or 'Index Name' in plan:
+        tipo = plan['Node Type'] + (" Backward" if plan.get('Scan Direction') == 'Backward' else "")
+        nodos.append(f"{tipo} ({plan['Index Name']})" if 'Index Name' in plan else tipo)
+    for hijo in plan.get('Plans', []):
+        nodos += nodos_de_lectura(hijo)
+    return nodos
+
+def explicar(cur, query, params):
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+    resultado = cur.fetchone()[0][0]
+    return ", ".join(nodos_de_lectura(resultado['Plan'])), resultado['Execution Time']
+
+def sembrar(cur, filas):
+    """Crea `lm_logs` con la definición de la migración 1 y la llena con `filas` registros de los últimos 400 días."""
+    crear = next(sql for sql in MIGRATIONS[0][2] if 'TABLE IF NOT EXISTS lm_logs' in sql)
+    cur.execute(crear)
+    cur.execute(
+        """INSERT INTO lm_logs (user_id, perfil_usado, message_content, timestamp, turno)
+        SELECT 1000 + (i %% %s), 'perfil_' || (i %% 7), md5(i::text), ts,
+               CASE WHEN extract(hour FROM ts) BETWEEN 7 AND 14 THEN 'dia'
+                    WHEN extract(hour FROM ts) BETWEEN 15 AND 22 THEN 'tarde' ELSE 'noche' END
+        FROM (SELECT i, now() - random() * interval '400 days' AS ts FROM generate_series(1, %s) AS i) AS s""",
+        (OPERADORES, filas)
+    )
+    cur.execute("ANALYZE lm_logs")
+
+def crear_indices(cur):
+    """Aplica las sentencias de las migraciones 2 y 5 que afectan a `lm_logs`."""
+    for version, _, sentencias in MIGRATIONS:
+        if version in (2, 5):
+            for sql in sentencias:
+                if 'lm_logs' in sql:
+                    cur.execute(sql)
+    cur.execute("ANALYZE lm_logs")
+
+def medir(cur, tz, tz_str, fase):
+    print(f"\n== {fase} ==")
+    print(f"{'periodo':<8} {'consulta':<28} {'antes (DATE/to_char)':<66} {'ms':>9}   {'ahora (rango timestamp)':<66} {'ms':>9}")
+    for periodo in PERIODOS:
+        antiguos = consultas(*predicados_antiguos(periodo, tz_str))
+        nuevos = consultas(*predicados_nuevos(periodo, tz))
+        for (nombre, q_antes, p_antes), (_, q_ahora, p_ahora) in zip(antiguos, nuevos):
+            plan_antes, ms_antes = explicar(cur, q_antes, p_antes)
+            plan_ahora, ms_ahora = explicar(cur, q_ahora, p_ahora)
+            print(f"{periodo:<8} {nombre:<28} {plan_antes[:66]:<66} {ms_antes:>9.1f}   {plan_ahora[:66]:<66} {ms_ahora:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--filas', type=int, default=2_000_000)
+    parser.add_argument('--keep', action='store_true', help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    url = os.getenv('BENCH_DATABASE_URL')
+    if not url:
+        parser.error("Define BENCH_DATABASE_URL (una base de datos de pruebas, no la del bot).")
+    tz_str = os.getenv('TIMEZONE', 'America/Santiago')
+    tz = pytz.timezone(tz_str)
+
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE; CREATE SCHEMA {ESQUEMA}; SET search_path TO {ESQUEMA}")
+            inicio = time.perf_counter()
+            sembrar(cur, args.filas)
+            print(f"lm_logs: {args.filas} filas sembradas en {time.perf_counter() - inicio:.1f}s (zona horaria {tz_str})")
+            medir(cur, tz, tz_str, "Sin índices")
+            crear_indices(cur)
+            medir(cur, tz, tz_str, "Con los índices de las migraciones 2 y 5")
+    finally:
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        conn.close()
+
+if __name__ == '__main__':
+    main()
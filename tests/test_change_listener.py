@@ -0,0 +1,157 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from utils.change_listener import LocalChangeBus, PostgresChangeListener
+from utils.command_registry import CommandRegistry
+from utils.db_manager import APPLICATION_NAME
+from utils.ia_cache import IAContextCache
+
+
+@pytest.fixture
+def bot():
+    bot = SimpleNamespace(all_commands={})
+    bot.command_registry = CommandRegistry(bot)
+    bot.ia_cache = IAContextCache()
+    bot.ia_cache._set_reglas([(1, "Sé amable")])
+    bot.ia_cache.perfil_creado('ana', 10)
+    return bot
+
+
+def publicar(bot, *cambios):
+    bus = LocalChangeBus(bot)
+
+    async def main():
+        for tabla, op, fila in cambios:
+            await bus.publish({'tabla': tabla, 'op': op, 'fila': fila})
+    asyncio.run(main())
+    return bus
+
+
+def test_comandos_dinamicos(bot):
+    registry = bot.command_registry
+    fila = {'nombre_comando': 'hola', 'respuesta_comando': 'hola!', 'creador_id': 1, 'creador_nombre': 'ana'}
+    publicar(bot, ('comandos_dinamicos', 'INSERT', fila),
+             ('alias_comandos_dinamicos', 'INSERT', {'alias': 'hi', 'nombre_comando': 'hola'}))
+    assert registry.get_dinamico('hi')['respuesta'] == 'hola!'
+
+    publicar(bot, ('comandos_dinamicos', 'UPDATE', dict(fila, respuesta_comando='buenas')))
+    assert registry.get_dinamico('hola')['respuesta'] == 'buenas'
+
+    # Borrar el comando se lleva sus alias, como el ON DELETE CASCADE de la base de datos.
+    publicar(bot, ('comandos_dinamicos', 'DELETE', fila))
+    assert registry.get_dinamico('hola') is None
+    assert 'hi' not in registry.alias
+
+
+def test_alias_borrado(bot):
+    registry = bot.command_registry
+    registry.dinamico_guardado('hola', 'hola!', 1, 'ana')
+    publicar(bot, ('alias_comandos_dinamicos', 'INSERT', {'alias': 'hi', 'nombre_comando': 'hola'}),
+             ('alias_comandos_dinamicos', 'DELETE', {'alias': 'hi', 'nombre_comando': 'hola'}))
+    assert registry.resolve_dinamico('hi') is None
+    assert registry.resolve_dinamico('hola') == 'hola'
+
+
+def test_comandos_config_and_permisos(bot):
+    registry = bot.command_registry
+    publicar(bot, ('comandos_config', 'INSERT', {'nombre_comando': 'reply', 'estado': 'privado'}),
+             ('permisos_comandos', 'INSERT', {'user_id': 5, 'nombre_comando': 'reply'}))
+    assert registry.estado('reply') == 'privado'
+    assert registry.puede_ver(5, False, 'reply')
+    assert not registry.puede_ver(6, False, 'reply')
+
+    publicar(bot, ('permisos_comandos', 'DELETE', {'user_id': 5, 'nombre_comando': 'reply'}))
+    assert not registry.puede_ver(5, False, 'reply')
+
+    # Sin fila en comandos_config el comando vuelve a ser público.
+    publicar(bot, ('comandos_config', 'DELETE', {'nombre_comando': 'reply', 'estado': 'privado'}))
+    assert registry.estado('reply') == 'publico'
+
+
+def test_reglas_ia(bot):
+    ia_cache = bot.ia_cache
+    version = ia_cache.reglas_version
+    publicar(bot, ('reglas_ia', 'INSERT', {'id': 2, 'regla_texto': "No uses emojis"}))
+    assert ia_cache._reglas == [(1, "Sé amable"), (2, "No uses emojis")]
+    assert ia_cache.reglas_version > version
+
+    publicar(bot, ('reglas_ia', 'DELETE', {'id': 1, 'regla_texto': "Sé amable"}))
+    assert ia_cache._reglas == [(2, "No uses emojis")]
+
+    # Una edición no trae el orden completo: se invalida y se recarga en el próximo uso.
+    publicar(bot, ('reglas_ia', 'UPDATE', {'id': 2, 'regla_texto': "Usa emojis"}))
+    assert ia_cache._reglas is None
+
+
+def test_personas(bot):
+    ia_cache = bot.ia_cache
+    publicar(bot, ('personas', 'INSERT', {'id': 11, 'nombre': 'luis'}))
+    assert ia_cache.nombre_por_id(11) == 'luis'
+
+    # Un cambio de nombre quita la entrada antigua; la nueva se cargará al usarla.
+    publicar(bot, ('personas', 'UPDATE', {'id': 10, 'nombre': 'anabel'}))
+    assert ia_cache.nombre_por_id(10) is None
+    assert 'ana' not in ia_cache._perfiles
+
+    publicar(bot, ('personas', 'DELETE', {'id': 11, 'nombre': 'luis'}))
+    assert ia_cache.nombre_por_id(11) is None
+
+
+def test_datos_persona(bot):
+    ia_cache = bot.ia_cache
+    publicar(bot, ('datos_persona', 'INSERT', {'id': 1, 'persona_id': 10, 'dato_texto': "Le gusta el té"}))
+    assert ia_cache._perfiles['ana']['datos'] == ["Le gusta el té"]
+    assert "Le gusta el té" in ia_cache._perfiles['ana']['hoja']
+
+    # Datos de un perfil que no está en caché: no hay nada que actualizar.
+    publicar(bot, ('datos_persona', 'INSERT', {'id': 2, 'persona_id': 99, 'dato_texto': "x"}))
+    assert ia_cache.nombre_por_id(99) is None
+
+    publicar(bot, ('datos_persona', 'UPDATE', {'id': 1, 'persona_id': 10, 'dato_texto': "Le gusta el café"}))
+    assert 'ana' not in ia_cache._perfiles
+
+
+def test_change_without_row_reloads_that_cache(bot, monkeypatch):
+    recargas = []
+
+    async def cargar_registro():
+        recargas.append('registro')
+
+    async def cargar_ia():
+        recargas.append('ia')
+
+    monkeypatch.setattr(bot.command_registry, 'load', cargar_registro)
+    monkeypatch.setattr(bot.ia_cache, 'load', cargar_ia)
+    bus = publicar(bot, ('comandos_dinamicos', 'TRUNCATE', None), ('datos_persona', 'UPDATE', None))
+    assert recargas == ['registro', 'ia']
+    assert bus.stats() == {'connected': True, 'received': 2, 'applied': 2}
+
+
+class FakeConnection:
+    def __init__(self, payloads):
+        self.notifies = [SimpleNamespace(payload=payload) for payload in payloads]
+
+    def poll(self):
+        pass
+
+
+def test_listener_skips_own_changes_and_invalid_payloads(bot):
+    fila = {'nombre_comando': 'hola', 'respuesta_comando': 'hola!', 'creador_id': 1, 'creador_nombre': 'ana'}
+    propio = json.dumps({'tabla': 'comandos_dinamicos', 'op': 'INSERT', 'fila': fila, 'origen': APPLICATION_NAME})
+    ajeno = json.dumps({'tabla': 'comandos_dinamicos', 'op': 'INSERT', 'fila': dict(fila, nombre_comando='adios'), 'origen': 'mibot-otro'})
+
+    async def main():
+        listener = PostgresChangeListener(bot)
+        listener._conn = FakeConnection([propio, "no es json", ajeno])
+        listener._on_readable()
+        await asyncio.gather(*listener._apply_tasks)
+        return listener
+
+    listener = asyncio.run(main())
+    assert listener.received == 3
+    assert listener.applied == 1
+    assert bot.command_registry.get_dinamico('hola') is None
+    assert bot.command_registry.get_dinamico('adios') is not None
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import threading
+
+from utils.content_cache import ContentCache, TMP_PREFIX
+
+
+def test_spilled_entries_are_read_back_from_disk(tmp_path):
+    async def main():
+        cache = ContentCache(10, spill_dir=str(tmp_path))
+        await cache.put('a', b'0123456789')
+        await cache.put('b', b'abcdefghij')
+        assert 'a' not in cache._entries
+        assert sorted(os.listdir(tmp_path)) == ['a']
+        assert await cache.get('a') == b'0123456789'
+    asyncio.run(main())
+
+
+def test_get_during_spill_never_reads_a_partial_file(tmp_path, monkeypatch):
+    empezado, seguir = threading.Event(), threading.Event()
+    original = ContentCache._write_spilled
+
+    def write_lento(self, evicted):
+        if empezado.is_set():
+            return original(self, evicted)
+        # Deja el archivo truncado en disco, como `open(..., 'wb')` a mitad de una escritura.
+        for key, _ in evicted:
+            open(self._disk_path(key), 'wb').close()
+        empezado.set()
+        seguir.wait(5)
+        original(self, evicted)
+
+    monkeypatch.setattr(ContentCache, '_write_spilled', write_lento)
+
+    async def main():
+        cache = ContentCache(10, spill_dir=str(tmp_path))
+        await cache.put('a', b'0123456789')
+        volcado = asyncio.create_task(cache.put('b', b'abcdefghij'))
+        await asyncio.to_thread(empezado.wait, 5)
+        assert 'a' not in cache._disk_index
+        assert await cache.get('a') == b'0123456789'
+        seguir.set()
+        await volcado
+    asyncio.run(main())
+
+
+def test_leftover_temp_files_are_removed_on_start(tmp_path):
+    (tmp_path / f'{TMP_PREFIX}abc').write_bytes(b'medio')
+    (tmp_path / 'completa').write_bytes(b'123')
+    cache = ContentCache(10, spill_dir=str(tmp_path))
+    assert list(cache._disk_index) == ['completa']
+    assert os.listdir(tmp_path) == ['completa']
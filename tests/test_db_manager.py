@@ -0,0 +1,76 @@
+import threading
+
+import psycopg2
+import psycopg2.pool
+import pytest
+
+from utils import db_manager
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool:
+    """Pool mínimo que, como el de psycopg2, rechaza devolver una conexión que no tiene prestada."""
+    def __init__(self, conexiones):
+        self.maxconn = 1
+        self._conexiones = list(conexiones)
+        self._prestadas = set()
+        self.devueltas = []
+
+    def getconn(self):
+        siguiente = self._conexiones.pop(0)
+        if isinstance(siguiente, Exception):
+            raise siguiente
+        self._prestadas.add(id(siguiente))
+        return siguiente
+
+    def putconn(self, conn, close=False):
+        if id(conn) not in self._prestadas:
+            raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+        self._prestadas.remove(id(conn))
+        self.devueltas.append((conn, close))
+        if close:
+            conn.close()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    def instalar(conexiones, healthy):
+        fake = FakePool(conexiones)
+        monkeypatch.setattr(db_manager, '_pool', fake)
+        monkeypatch.setattr(db_manager, '_pool_slots', threading.BoundedSemaphore(1))
+        monkeypatch.setattr(db_manager, '_is_healthy', healthy)
+        monkeypatch.setattr(db_manager, '_pool_stats', {**db_manager._pool_stats, 'discarded': 0, 'in_use': 0})
+        return fake
+    return instalar
+
+
+def test_getconn_failure_after_discard_keeps_original_error(pool):
+    rota = FakeConnection()
+    fake = pool([rota, psycopg2.OperationalError("servidor caído")], healthy=lambda conn: False)
+
+    with pytest.raises(psycopg2.OperationalError, match="servidor caído"):
+        with db_manager.pooled_connection():
+            pass
+
+    assert fake.devueltas == [(rota, True)]
+    assert db_manager.get_pool_stats()['discarded'] == 1
+    # El semáforo se liberó: se puede volver a pedir una conexión.
+    assert db_manager._pool_slots.acquire(blocking=False)
+
+
+def test_broken_connection_is_discarded_once(pool):
+    rota, sana = FakeConnection(), FakeConnection()
+    fake = pool([rota, sana], healthy=lambda conn: conn is sana)
+
+    with db_manager.pooled_connection() as conn:
+        assert conn is sana
+
+    assert fake.devueltas == [(rota, True), (sana, False)]
+    assert db_manager.get_pool_stats()['discarded'] == 1
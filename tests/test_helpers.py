@@ -0,0 +1,120 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+import pytz
+
+from utils.helpers import inicio_del_dia, periodo_bounds, parse_periodo, rango_dias
+
+SANTIAGO = pytz.timezone('America/Santiago')
+NEW_YORK = pytz.timezone('America/New_York')
+HORA = timedelta(hours=1)
+
+
+@pytest.mark.parametrize("tz, dia, horas", [
+    (SANTIAGO, date(2024, 9, 8), 23),   # adelanto: 00:00 -> 01:00
+    (SANTIAGO, date(2024, 4, 6), 25),   # atraso: 24:00 -> 23:00
+    (NEW_YORK, date(2024, 3, 10), 23),  # adelanto: 02:00 -> 03:00
+    (NEW_YORK, date(2024, 11, 3), 25),  # atraso: 02:00 -> 01:00
+    (NEW_YORK, date(2024, 7, 1), 24),
+])
+def test_rango_dias_length_on_dst_days(tz, dia, horas):
+    inicio, fin = rango_dias(dia, dia, tz)
+    assert fin - inicio == horas * HORA
+
+
+def test_nonexistent_midnight_starts_at_first_valid_instant():
+    # En Santiago el 2024-09-08 no existe la medianoche: el día empieza a las 01:00 (-03).
+    inicio = inicio_del_dia(date(2024, 9, 8), SANTIAGO)
+    assert (inicio.hour, inicio.minute) == (1, 0)
+    assert inicio.utcoffset() == -3 * HORA
+    assert inicio.astimezone(pytz.utc) == pytz.utc.localize(datetime(2024, 9, 8, 4, 0))
+
+
+def test_day_after_fall_back_starts_in_standard_time():
+    # En Santiago se repite la hora 23 del 2024-04-06; el 7 empieza una sola vez, a las 00:00 (-04).
+    inicio = inicio_del_dia(date(2024, 4, 7), SANTIAGO)
+    assert inicio.utcoffset() == -4 * HORA
+    assert inicio.astimezone(pytz.utc) == pytz.utc.localize(datetime(2024, 4, 7, 4, 0))
+
+
+@pytest.mark.parametrize("tz", [SANTIAGO, NEW_YORK])
+def test_consecutive_days_are_half_open_and_contiguous(tz):
+    dia = date(2024, 1, 1)
+    fin_anterior = None
+    for _ in range(366):
+        inicio, fin = rango_dias(dia, dia, tz)
+        assert inicio < fin
+        if fin_anterior is not None:
+            assert inicio == fin_anterior
+        fin_anterior = fin
+        dia += timedelta(days=1)
+
+
+def test_hoy_and_ayer():
+    hoy = date(2024, 11, 3)
+    inicio, fin, titulo = periodo_bounds('hoy', NEW_YORK, hoy)
+    assert (inicio, fin) == rango_dias(hoy, hoy, NEW_YORK)
+    assert titulo == "de Hoy"
+    inicio_ayer, fin_ayer, _ = periodo_bounds('ayer', NEW_YORK, hoy)
+    assert fin_ayer == inicio
+
+
+@pytest.mark.parametrize("hoy, lunes", [
+    (date(2024, 3, 10), date(2024, 3, 4)),    # domingo: pertenece a la semana que empezó el lunes anterior
+    (date(2024, 3, 11), date(2024, 3, 11)),   # lunes
+    (date(2024, 12, 31), date(2024, 12, 30)), # semana ISO que cruza el año
+])
+def test_semana_is_iso_monday_to_sunday(hoy, lunes):
+    inicio, fin, _ = periodo_bounds('semana', NEW_YORK, hoy)
+    assert inicio == inicio_del_dia(lunes, NEW_YORK)
+    assert fin == inicio_del_dia(lunes + timedelta(days=7), NEW_YORK)
+
+
+def test_semana_with_dst_change_is_not_168_hours():
+    inicio, fin, _ = periodo_bounds('semana', NEW_YORK, date(2024, 3, 10))
+    assert fin - inicio == 167 * HORA
+
+
+@pytest.mark.parametrize("hoy, primero, siguiente", [
+    (date(2024, 2, 29), date(2024, 2, 1), date(2024, 3, 1)),
+    (date(2023, 2, 1), date(2023, 2, 1), date(2023, 3, 1)),
+    (date(2024, 12, 31), date(2024, 12, 1), date(2025, 1, 1)),
+    (date(2024, 1, 31), date(2024, 1, 1), date(2024, 2, 1)),
+])
+def test_mes_edges(hoy, primero, siguiente):
+    inicio, fin, _ = periodo_bounds('mes', SANTIAGO, hoy)
+    assert inicio == inicio_del_dia(primero, SANTIAGO)
+    assert fin == inicio_del_dia(siguiente, SANTIAGO)
+
+
+def test_explicit_date_and_range():
+    inicio, fin, _ = periodo_bounds('2024-09-08', SANTIAGO)
+    assert fin - inicio == 23 * HORA
+    inicio, fin, titulo = periodo_bounds('2024-04-06 a 2024-04-07', SANTIAGO)
+    assert fin - inicio == 49 * HORA
+    assert titulo == "de 06/04/2024 a 07/04/2024"
+
+
+@pytest.mark.parametrize("periodo", ['2024-13-01', 'mañana', '2024-04-07 a 2024-04-06', '2024-04-06 a nunca'])
+def test_invalid_periodo(periodo):
+    inicio, fin, error = periodo_bounds(periodo, SANTIAGO)
+    assert inicio is None and fin is None
+    assert error
+
+
+def test_parse_periodo_uses_half_open_bounds_without_timezone_in_sql(monkeypatch):
+    monkeypatch.setenv('TIMEZONE', 'America/Santiago')
+    clauses, params, _ = parse_periodo('2024-09-08')
+    assert clauses == ["timestamp >= %s AND timestamp < %s"]
+    sql = " ".join(clauses).lower()
+    assert 'time zone' not in sql and 'santiago' not in sql and '::date' not in sql
+    inicio, fin = params
+    assert inicio.tzinfo is not None and fin.tzinfo is not None
+    assert (inicio, fin) == rango_dias(date(2024, 9, 8), date(2024, 9, 8), SANTIAGO)
+
+
+def test_parse_periodo_invalid(monkeypatch):
+    monkeypatch.setenv('TIMEZONE', 'America/Santiago')
+    clauses, params, error = parse_periodo('no-es-fecha')
+    assert clauses is None and params is None
+    assert error
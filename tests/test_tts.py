@@ -0,0 +1,51 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+
+import utils.tts as tts
+from utils.tts import AudioTooLarge, synthesize
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def cliente(stream):
+    return SimpleNamespace(text_to_speech=SimpleNamespace(convert=lambda **kwargs: stream))
+
+
+@pytest.mark.parametrize('max_memory', [1024, 4])
+def test_synthesize_returns_a_file_discord_accepts(monkeypatch, max_memory):
+    monkeypatch.setattr(tts, 'TTS_SPOOL_MAX_MEMORY', max_memory)
+    stream = FakeStream([b'abc', b'def', b'gh'])
+    audio, size = asyncio.run(synthesize(cliente(stream), 'voz', 'hola', 'mp3_44100_128', 100))
+    with audio:
+        # `discord.File` solo acepta objetos io.IOBase; si no, lo trata como una ruta.
+        assert isinstance(audio, io.IOBase)
+        assert audio.read() == b'abcdefgh'
+    assert size == 8
+    assert stream.closed
+
+
+def test_synthesize_stops_when_audio_is_too_large(monkeypatch):
+    monkeypatch.setattr(tts, 'TTS_SPOOL_MAX_MEMORY', 4)
+    stream = FakeStream([b'abc', b'def', b'ghi'])
+    with pytest.raises(AudioTooLarge):
+        asyncio.run(synthesize(cliente(stream), 'voz', 'hola', 'mp3_44100_128', 8))
+    assert stream.closed
+    assert stream.chunks == []
@@ -0,0 +1,198 @@
+import logging
+import json
+import asyncio
+import psycopg2
+import psycopg2.extensions
+from utils.db_manager import get_db_connection, APPLICATION_NAME
+
+log = logging.getLogger(__name__)
+
+# Canal de NOTIFY usado por el trigger `notificar_cambio()` (migración 8).
+CANAL_CAMBIOS = 'mibot_cambios'
+RECONNECT_DELAY_MAX = 30.0
+
+async def recargar_caches(bot, tabla=None):
+    """Recarga por completo la caché afectada por `tabla` (o todas si es None)."""
+    if tabla in (None, 'comandos_dinamicos', 'alias_comandos_dinamicos', 'comandos_config', 'permisos_comandos'):
+        await bot.command_registry.load()
+    if tabla in (None, 'reglas_ia', 'personas', 'datos_persona'):
+        await bot.ia_cache.load()
+
+async def apply_change(bot, cambio):
+    """
+    Aplica a las cachés locales un cambio `{'tabla', 'op', 'fila'}` hecho por otro proceso.
+    Si el aviso no trae la fila (TRUNCATE o fila demasiado grande) se recarga la caché de esa tabla.
+    """
+    tabla, op, fila = cambio['tabla'], cambio['op'], cambio.get('fila')
+    if fila is None:
+        await recargar_caches(bot, tabla)
+        return
+
+    registry, ia_cache = bot.command_registry, bot.ia_cache
+    borrado = op == 'DELETE'
+    if tabla == 'comandos_dinamicos':
+        if borrado:
+            registry.dinamico_borrado(fila['nombre_comando'])
+        else:
+            registry.dinamico_guardado(fila['nombre_comando'], fila['respuesta_comando'], fila['creador_id'], fila['creador_nombre'])
+    elif tabla == 'alias_comandos_dinamicos':
+        if borrado:
+            registry.alias_borrado(fila['alias'])
+        else:
+            registry.alias_guardado(fila['alias'], fila['nombre_comando'])
+    elif tabla == 'comandos_config':
+        registry.set_estado(fila['nombre_comando'], 'publico' if borrado else fila['estado'])
+    elif tabla == 'permisos_comandos':
+        if borrado:
+            registry.permiso_revocado(fila['user_id'], fila['nombre_comando'])
+        else:
+            registry.permiso_concedido(fila['user_id'], fila['nombre_comando'])
+    elif tabla == 'reglas_ia':
+        if op == 'INSERT':
+            ia_cache.regla_agregada(fila['id'], fila['regla_texto'])
+        elif borrado:
+            ia_cache.regla_borrada(fila['id'])
+        else:
+            ia_cache.invalidar_reglas()
+    elif tabla == 'personas':
+        anterior = ia_cache.nombre_por_id(fila['id'])
+        if anterior:
+            ia_cache.perfil_borrado(anterior)
+        if op == 'INSERT':
+            ia_cache.perfil_creado(fila['nombre'], fila['id'])
+    elif tabla == 'datos_persona':
+        nombre = ia_cache.nombre_por_id(fila['persona_id'])
+        if not nombre:
+            return
+        if op == 'INSERT':
+            ia_cache.dato_agregado(nombre, fila['dato_texto'])
+        else:
+            # Se recargará solo ese perfil la próxima vez que se use.
+            ia_cache.invalidar_perfil(nombre)
+
+class PostgresChangeListener:
+    """
+    Escucha `LISTEN mibot_cambios` en una conexión propia (fuera del pool) registrada en el bucle
+    de eventos con `add_reader`, sin hilos ni sondeo. Cada aviso de otro proceso se aplica como un
+    cambio puntual a las cachés. Si la conexión se pierde, se reconecta con espera creciente y,
+    como pudo perder avisos mientras tanto, recarga las cachés completas.
+    """
+    def __init__(self, bot, channel=CANAL_CAMBIOS):
+        self.bot = bot
+        self.channel = channel
+        self._conn = None
+        self._loop = None
+        self._reconnect_task = None
+        # Referencias a las tareas de `_apply` en curso para que no se recolecten a medias.
+        self._apply_tasks = set()
+        self._closing = False
+        self.received = 0
+        self.applied = 0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._closing = False
+        await self._connect()
+
+    async def _connect(self):
+        def connect():
+            conn = get_db_connection()
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {self.channel};")
+            return conn
+
+        self._conn = await asyncio.to_thread(connect)
+        self._loop.add_reader(self._conn.fileno(), self._on_readable)
+        log.info("Escuchando el canal '%s'", self.channel)
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            log.warning("Se perdió la conexión de LISTEN: %s", e)
+            self._drop_connection()
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+            return
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            self.received += 1
+            try:
+                cambio = json.loads(notify.payload)
+            except ValueError:
+                continue
+            # Los cambios de este mismo proceso ya se aplicaron al escribir.
+            if cambio.get('origen') == APPLICATION_NAME:
+                continue
+            task = asyncio.create_task(self._apply(cambio))
+            self._apply_tasks.add(task)
+            task.add_done_callback(self._apply_tasks.discard)
+
+    async def _apply(self, cambio):
+        try:
+            await apply_change(self.bot, cambio)
+            self.applied += 1
+        except Exception as e:
+            log.exception("Error al aplicar un cambio de '%s': %s", cambio.get('tabla'), e)
+
+    def _drop_connection(self):
+        if self._conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+        except (ValueError, OSError):
+            pass
+        try:
+            self._conn.close()
+        except psycopg2.Error:
+            pass
+        self._conn = None
+
+    async def _reconnect(self):
+        delay = 1.0
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                await recargar_caches(self.bot)
+                return
+            except Exception as e:
+                # Si falló la recarga, la conexión nueva ya escucha: se cierra antes de reintentar.
+                self._drop_connection()
+                log.warning("No se pudo reconectar (%s); reintento en %.0fs.", e, delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+    async def stop(self):
+        self._closing = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        for task in list(self._apply_tasks):
+            task.cancel()
+        self._drop_connection()
+
+    def stats(self):
+        return {'connected': self._conn is not None, 'received': self.received, 'applied': self.applied}
+
+class LocalChangeBus:
+    """
+    Sustituto en memoria de PostgresChangeListener para pruebas o un solo proceso sin base de datos
+    compartida: `publish(cambio)` aplica el cambio directamente con la misma lógica.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.received = 0
+        self.applied = 0
+
+    async def start(self):
+        pass
+
+    async def publish(self, cambio):
+        self.received += 1
+        await apply_change(self.bot, cambio)
+        self.applied += 1
+
+    async def stop(self):
+        pass
+
+    def stats(self):
+        return {'connected': True, 'received': self.received, 'applied': self.applied}
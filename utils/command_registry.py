@@ -0,0 +1,241 @@
+import logging
+import os
+import time
+import asyncio
+import difflib
+from utils.db_manager import db_batch
+
+log = logging.getLogger(__name__)
+
+# Segundos tras los que el registro se recarga en segundo plano por si otra instancia cambió las tablas.
+COMMAND_REGISTRY_TTL = float(os.getenv('COMMAND_REGISTRY_TTL', '300'))
+
+# Categorías del menú de ayuda y los comandos que muestra cada una.
+CATEGORIAS = {
+    "Gestión de Operadores": ['apodo', 'verapodo', 'quitarapodo', 'listaapodos', 'asignar', 'desasignar', 'misperfiles', 'sincronizar-perfiles', 'desincronizar-perfiles'],
+    "Registro de Actividad": ['lm', 'exito'],
+    "Estadísticas": ['estadisticas', 'registrolm', 'verexitos'],
+    "Gestión de Perfiles (IA)": ['crearperfil', 'borrarperfil', 'listaperfiles', 'agghistorial', 'verinfo'],
+    "Análisis con IA": ['reply', 'consejo', 'preguntar'],
+    "Audio (ElevenLabs)": ['sync_elevenlabs', 'audio', 'audiolab'],
+    "Memoria del Bot": ['guardar', 'buscar', 'resumir'],
+    "Tareas Programadas": ['programar', 'programar-ia', 'programar-serie', 'tareas', 'borrartarea'],
+    "Administración General": ['backup', 'privatizar', 'publicar', 'permitir', 'denegar', 'estado_comandos', 'anuncio', 'aggregla', 'listareglas', 'borrarregla', 'exportar-config', 'importar-config', 'status', 'perf'],
+}
+CATEGORIA_PERSONALIZADOS = "Comandos Personalizados"
+# Máximo de sugerencias de "¿quisiste decir...?" y prefijo mínimo en común para ofrecerlas.
+MAX_SUGERENCIAS = 3
+PREFIJO_MINIMO = 2
+
+class PrefixTrie:
+    """Árbol de prefijos de nombres de comando para sugerir nombres parecidos sin recorrer la lista entera."""
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, word):
+        node = self._root
+        for char in word:
+            node = node.setdefault(char, {})
+        node['$'] = True
+
+    def remove(self, word):
+        path = [self._root]
+        for char in word:
+            if char not in path[-1]:
+                return
+            path.append(path[-1][char])
+        path[-1].pop('$', None)
+        # Se podan las ramas que quedan vacías.
+        for depth in range(len(word), 0, -1):
+            if path[depth]:
+                break
+            path[depth - 1].pop(word[depth - 1])
+
+    def _collect(self, node, prefix, out):
+        if node.get('$'):
+            out.append(prefix)
+        for char, child in node.items():
+            if char != '$':
+                self._collect(child, prefix + char, out)
+
+    def closest(self, word, minimum=PREFIJO_MINIMO):
+        """Devuelve (prefijo común más largo, palabras que comparten ese prefijo con `word`)."""
+        node, depth = self._root, 0
+        for char in word:
+            if char not in node:
+                break
+            node, depth = node[char], depth + 1
+        if depth < minimum:
+            return word[:depth], []
+        out = []
+        self._collect(node, word[:depth], out)
+        return word[:depth], out
+
+class CommandRegistry:
+    """
+    Índice en memoria de los comandos: estado público/privado de cada uno (`comandos_config`),
+    permisos concedidos por usuario (`permisos_comandos`), comandos dinámicos con sus datos
+    (`comandos_dinamicos`) y el mapa categoría -> comandos ya resuelto. Se carga en `setup_hook`
+    y los comandos que modifican esas tablas lo actualizan al escribir, así `!help` no consulta
+    la base de datos. También respalda el check global de permisos: pasado COMMAND_REGISTRY_TTL
+    se recarga en segundo plano mientras se siguen usando los datos actuales.
+    """
+    def __init__(self, bot, ttl=COMMAND_REGISTRY_TTL):
+        self.bot = bot
+        self.ttl = ttl
+        self._expira = 0.0
+        self._refresh_task = None
+        self.estados = {}
+        self.permisos = {}
+        self.dinamicos = {}
+        self.alias = {}
+        self._dinamicos_ordenados = []
+        self._categorias = {}
+        self._trie = PrefixTrie()
+
+    async def load(self):
+        """Carga las tres tablas en una sola transacción y recalcula el mapa de categorías."""
+        configs_rows, perms_rows, dinamicos_rows, alias_rows = await db_batch([
+            ("SELECT nombre_comando, estado FROM comandos_config", (), 'all'),
+            ("SELECT user_id, nombre_comando FROM permisos_comandos", (), 'all'),
+            ("SELECT nombre_comando, respuesta_comando, creador_id, creador_nombre FROM comandos_dinamicos", (), 'all'),
+            ("SELECT alias, nombre_comando FROM alias_comandos_dinamicos", (), 'all'),
+        ])
+        self.estados = {row['nombre_comando']: row['estado'] for row in configs_rows}
+        self.permisos = {}
+        for row in perms_rows:
+            self.permisos.setdefault(row['user_id'], set()).add(row['nombre_comando'])
+        self.dinamicos = {
+            row['nombre_comando']: {'respuesta': row['respuesta_comando'], 'creador_id': row['creador_id'], 'creador_nombre': row['creador_nombre']}
+            for row in dinamicos_rows
+        }
+        self.alias = {row['alias']: row['nombre_comando'] for row in alias_rows}
+        self._dinamicos_ordenados = sorted(self.dinamicos)
+        self.build_categories()
+        self._build_trie()
+        self._expira = time.monotonic() + self.ttl
+        return len(self.dinamicos)
+
+    def refresh_if_stale(self):
+        """Si el registro caducó, lanza una recarga en segundo plano (sin esperar) y devuelve enseguida."""
+        if time.monotonic() < self._expira or (self._refresh_task and not self._refresh_task.done()):
+            return
+        self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            await self.load()
+        except Exception as e:
+            # Se reintenta en el siguiente TTL; mientras tanto se usan los datos que ya había.
+            self._expira = time.monotonic() + self.ttl
+            log.warning("Error al recargar el registro de comandos: %s", e)
+
+    def build_categories(self):
+        """Resuelve una sola vez los nombres de CATEGORIAS a objetos Command (tras cargar los cogs)."""
+        self._categorias = {}
+        for cat_name, cmd_names in CATEGORIAS.items():
+            resueltos = [self.bot.get_command(name) for name in cmd_names]
+            self._categorias[cat_name] = [cmd for cmd in resueltos if cmd and not cmd.hidden]
+
+    def _build_trie(self):
+        """Indexa los nombres y alias de los comandos fijos y dinámicos para las sugerencias."""
+        self._trie = PrefixTrie()
+        for name in [*self.bot.all_commands, *self.dinamicos, *self.alias]:
+            self._trie.insert(name)
+
+    # --- Consultas ---
+    def estado(self, nombre_comando):
+        return self.estados.get(nombre_comando, 'publico')
+
+    def tiene_permiso(self, user_id, nombre_comando):
+        return nombre_comando in self.permisos.get(user_id, ())
+
+    def puede_ver(self, user_id, es_admin, nombre_comando):
+        return es_admin or self.estado(nombre_comando) == 'publico' or self.tiene_permiso(user_id, nombre_comando)
+
+    def puede_usar(self, ctx):
+        """Indica si el autor de `ctx` puede ejecutar su comando según `comandos_config` y `permisos_comandos`."""
+        nombre = ctx.command.root_parent.name if ctx.command.root_parent else ctx.command.name
+        if self.estado(nombre) == 'publico':
+            return True
+        permisos = getattr(ctx.author, 'guild_permissions', None)
+        es_admin = bool(permisos and permisos.administrator)
+        return es_admin or ctx.author.id == self.bot.owner_id or ctx.author.id in (self.bot.owner_ids or ()) or self.tiene_permiso(ctx.author.id, nombre)
+
+    def resolve_dinamico(self, nombre):
+        """Devuelve el nombre real del comando dinámico `nombre` (que puede ser un alias) o None."""
+        if nombre in self.dinamicos:
+            return nombre
+        destino = self.alias.get(nombre)
+        return destino if destino in self.dinamicos else None
+
+    def get_dinamico(self, nombre):
+        """Devuelve {'respuesta', 'creador_id', 'creador_nombre'} del comando dinámico (o de su alias) o None."""
+        nombre = self.resolve_dinamico(nombre)
+        return self.dinamicos[nombre] if nombre else None
+
+    def _sugerible(self, candidato, user_id, es_admin):
+        """Indica si `candidato` se puede sugerir al usuario: los comandos fijos solo si `!help` se los mostraría."""
+        cmd = self.bot.all_commands.get(candidato)
+        if cmd is None:
+            # Comando dinámico o alias: se listan para todos en `!help`.
+            return True
+        return not cmd.hidden and self.puede_ver(user_id, es_admin, cmd.name)
+
+    def sugerir(self, nombre, user_id, es_admin, limite=MAX_SUGERENCIAS):
+        """
+        Devuelve hasta `limite` nombres de comando parecidos a `nombre`, los más similares primero,
+        sin los ocultos ni los privados que el usuario no puede ver.
+        """
+        nombre = nombre.lower()
+        _, candidatos = self._trie.closest(nombre)
+        candidatos = [c for c in candidatos if self._sugerible(c, user_id, es_admin)]
+        candidatos.sort(key=lambda c: difflib.SequenceMatcher(None, nombre, c).ratio(), reverse=True)
+        return candidatos[:limite]
+
+    def visible_categories(self, user_id, es_admin):
+        """Devuelve {categoría: [Command o nombre de comando dinámico]} con lo que el usuario puede ver."""
+        visibles = {}
+        for cat_name, cmds in self._categorias.items():
+            visible_cmds = [cmd for cmd in cmds if self.puede_ver(user_id, es_admin, cmd.name)]
+            if visible_cmds:
+                visibles[cat_name] = visible_cmds
+        if self._dinamicos_ordenados:
+            visibles[CATEGORIA_PERSONALIZADOS] = list(self._dinamicos_ordenados)
+        return visibles
+
+    # --- Actualización al escribir ---
+    def set_estado(self, nombre_comando, estado):
+        self.estados[nombre_comando] = estado
+
+    def permiso_concedido(self, user_id, nombre_comando):
+        self.permisos.setdefault(user_id, set()).add(nombre_comando)
+
+    def permiso_revocado(self, user_id, nombre_comando):
+        self.permisos.get(user_id, set()).discard(nombre_comando)
+
+    def dinamico_guardado(self, nombre, respuesta, creador_id, creador_nombre):
+        self.dinamicos[nombre] = {'respuesta': respuesta, 'creador_id': creador_id, 'creador_nombre': creador_nombre}
+        self._dinamicos_ordenados = sorted(self.dinamicos)
+        self._trie.insert(nombre)
+
+    def dinamico_borrado(self, nombre):
+        self.dinamicos.pop(nombre, None)
+        self._dinamicos_ordenados = sorted(self.dinamicos)
+        self._quitar_del_trie(nombre)
+        # Los alias se borran en cascada en la base de datos.
+        for alias in [a for a, destino in self.alias.items() if destino == nombre]:
+            self.alias_borrado(alias)
+
+    def alias_guardado(self, alias, nombre):
+        self.alias[alias] = nombre
+        self._trie.insert(alias)
+
+    def alias_borrado(self, alias):
+        if self.alias.pop(alias, None) is not None:
+            self._quitar_del_trie(alias)
+
+    def _quitar_del_trie(self, nombre):
+        """Quita `nombre` de las sugerencias salvo que siga siendo un comando fijo, dinámico o alias."""
+        if nombre not in self.bot.all_commands and nombre not in self.dinamicos and nombre not in self.alias:
+            self._trie.remove(nombre)
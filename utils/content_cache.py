@@ -0,0 +1,150 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+# --- Límites de las Cachés por Contenido ---
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+REPLY_CACHE_MAX_BYTES = int(os.getenv('REPLY_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+# Si se define, las respuestas expulsadas de memoria se guardan en este directorio.
+REPLY_CACHE_DIR = os.getenv('REPLY_CACHE_DIR')
+REPLY_CACHE_DISK_MAX_BYTES = int(os.getenv('REPLY_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
+# Prefijo de los archivos a medio escribir; se ignoran (y se borran) al indexar el directorio.
+TMP_PREFIX = '.tmp-'
+
+def content_hash(data):
+    """Devuelve el hash SHA-256 (hex) de unos bytes o de un texto."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+class ContentCache:
+    """
+    Caché LRU en memoria acotada por tamaño total en bytes, con claves derivadas del contenido.
+    Opcionalmente, las entradas expulsadas se vuelcan a disco (`spill_dir`) y se recuperan de ahí.
+    Mientras se escriben siguen disponibles en `_pending`, y solo entran en el índice de disco cuando
+    el archivo está completo (se escribe en uno temporal y se renombra), así `get` nunca lee uno a medias.
+    """
+    def __init__(self, max_bytes, spill_dir=None, disk_max_bytes=REPLY_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk_index = OrderedDict()
+        self._disk_size = 0
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Se indexan los archivos existentes del más antiguo al más reciente.
+            paths = sorted((os.path.join(spill_dir, name) for name in os.listdir(spill_dir)), key=os.path.getmtime)
+            for path in paths:
+                if os.path.basename(path).startswith(TMP_PREFIX):
+                    os.remove(path)
+                    continue
+                size = os.path.getsize(path)
+                self._disk_index[os.path.basename(path)] = size
+                self._disk_size += size
+
+    def _disk_path(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def _index_spilled(self, evicted):
+        """Registra en el índice de disco las entradas expulsadas y devuelve las claves antiguas a podar."""
+        for key, value in evicted:
+            self._disk_size += len(value) - self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(value)
+        pruned = []
+        while self._disk_size > self.disk_max_bytes and self._disk_index:
+            old_key, old_size = self._disk_index.popitem(last=False)
+            self._disk_size -= old_size
+            pruned.append(old_key)
+        return pruned
+
+    def _write_spilled(self, evicted):
+        """Escribe las entradas expulsadas a disco de forma atómica (se ejecuta en un hilo)."""
+        for key, value in evicted:
+            fd, tmp_path = tempfile.mkstemp(prefix=TMP_PREFIX, dir=self.spill_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(value)
+                os.replace(tmp_path, self._disk_path(key))
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    def _remove_spilled(self, pruned):
+        """Borra de disco las entradas podadas (se ejecuta en un hilo)."""
+        for key in pruned:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _read_spilled(self, key):
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    async def get(self, key):
+        """Devuelve los bytes guardados para `key` o None."""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+        value = self._pending.get(key)
+        if value is not None:
+            self.hits += 1
+            await self.put(key, value)
+            return value
+        if self.spill_dir and key in self._disk_index:
+            value = await asyncio.to_thread(self._read_spilled, key)
+            if value is not None:
+                self.hits += 1
+                await self.put(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def put(self, key, value):
+        """Guarda `value` (bytes) y expulsa las entradas menos usadas si se supera el límite."""
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = value
+        self._size += len(value)
+        evicted = []
+        while self._size > self.max_bytes:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._size -= len(old_value)
+            evicted.append((old_key, old_value))
+        if self.spill_dir and evicted:
+            await self._spill(evicted)
+
+    async def _spill(self, evicted):
+        """Vuelca a disco las entradas expulsadas; hasta que terminan de escribirse se sirven desde `_pending`."""
+        for key, value in evicted:
+            self._pending[key] = value
+        try:
+            await asyncio.to_thread(self._write_spilled, evicted)
+            pruned = self._index_spilled(evicted)
+        finally:
+            for key, value in evicted:
+                if self._pending.get(key) is value:
+                    del self._pending[key]
+        if pruned:
+            await asyncio.to_thread(self._remove_spilled, pruned)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._size, 'disk_entries': len(self._disk_index), 'hits': self.hits, 'misses': self.misses}
@@ -1,22 +1,165 @@
+import logging
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import os
+import time
+import socket
 import asyncio
+import threading
+from contextlib import contextmanager
+from utils.helpers import get_user_timezone
+from utils.metrics import metrics, fingerprint, TIPO_SQL
+
+log = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# --- Configuración del Pool de Conexiones ---
+# Tamaños y tiempos configurables por variables de entorno.
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Segundos que una conexión puede estar inactiva antes de verificarla con un `SELECT 1` al reutilizarla.
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', '30'))
+
+# Identifica las conexiones de este proceso (`application_name`) para que ignore sus propias notificaciones de cambios.
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+APPLICATION_NAME = f"mibot-{INSTANCE_ID}"[:63]
+CONNECTION_OPTIONS = dict(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3, application_name=APPLICATION_NAME)
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+_pool_stats = {
+    'checkouts': 0,
+    'in_use': 0,
+    'wait_time_total': 0.0,
+    'wait_time_max': 0.0,
+    'timeouts': 0,
+    'discarded': 0,
+}
+
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    """Se lanza cuando no se consigue una conexión del pool dentro de DB_POOL_TIMEOUT."""
+
 def get_db_connection():
-    """Crea y devuelve una conexión a la base de datos PostgreSQL."""
+    """Crea y devuelve una conexión nueva (sin pool) a la base de datos PostgreSQL."""
     if not DATABASE_URL:
         raise ValueError("La variable de entorno DATABASE_URL no está definida.")
-    return psycopg2.connect(DATABASE_URL)
+    return psycopg2.connect(DATABASE_URL, **CONNECTION_OPTIONS)
 
-def setup_database():
-    """Configura las tablas en la base de datos PostgreSQL si no existen."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    commands = [
+def init_db_pool(minconn=None, maxconn=None):
+    """Inicializa el pool de conexiones si aún no existe. Es seguro llamarla varias veces."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        if not DATABASE_URL:
+            raise ValueError("La variable de entorno DATABASE_URL no está definida.")
+        minconn = DB_POOL_MIN if minconn is None else minconn
+        maxconn = DB_POOL_MAX if maxconn is None else maxconn
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, DATABASE_URL, **CONNECTION_OPTIONS
+        )
+        # El pool de psycopg2 lanza un error al agotarse; el semáforo hace que los hilos esperen su turno.
+        _pool_slots = threading.BoundedSemaphore(maxconn)
+        log.info("Pool de conexiones iniciado (min=%s, max=%s)", minconn, maxconn)
+        return _pool
+
+def close_db_pool():
+    """Cierra todas las conexiones del pool. Se llama al apagar el bot."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            return
+        _pool.closeall()
+        _pool = None
+        _pool_slots = None
+        _last_used.clear()
+        log.info("Pool de conexiones cerrado")
+
+def get_pool_stats():
+    """Devuelve una copia de los contadores del pool (checkouts, tiempos de espera, etc.)."""
+    with _pool_lock:
+        stats = dict(_pool_stats)
+        stats['max_size'] = _pool.maxconn if _pool else 0
+    stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+    return stats
+
+def _is_healthy(conn):
+    """Comprueba que una conexión reutilizada siga viva. Solo hace ping si llevaba tiempo inactiva."""
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_HEALTHCHECK_IDLE:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def pooled_connection():
+    """
+    Toma una conexión del pool y la devuelve al terminar (función bloqueante, usar desde un hilo).
+    Las conexiones rotas se descartan en lugar de volver al pool.
+    """
+    pool = init_db_pool()
+    slots = _pool_slots
+    start = time.perf_counter()
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _pool_lock:
+            _pool_stats['timeouts'] += 1
+        raise PoolTimeoutError(f"No se obtuvo conexión del pool en {DB_POOL_TIMEOUT}s.")
+
+    conn = None
+    broken = False
+    try:
+        conn = pool.getconn()
+        while not _is_healthy(conn):
+            pool.putconn(conn, close=True)
+            # Ya no es nuestra: si el siguiente getconn falla, el finally no debe devolverla otra vez.
+            conn = None
+            with _pool_lock:
+                _pool_stats['discarded'] += 1
+            conn = pool.getconn()
+        waited = time.perf_counter() - start
+        with _pool_lock:
+            _pool_stats['checkouts'] += 1
+            _pool_stats['in_use'] += 1
+            _pool_stats['wait_time_total'] += waited
+            _pool_stats['wait_time_max'] = max(_pool_stats['wait_time_max'], waited)
+        metrics.observe(TIPO_SQL, '(espera del pool)', waited)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            with _pool_lock:
+                _pool_stats['in_use'] -= 1
+    finally:
+        if conn is not None:
+            broken = broken or bool(conn.closed)
+            if broken:
+                _last_used.pop(id(conn), None)
+                with _pool_lock:
+                    _pool_stats['discarded'] += 1
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=broken)
+        slots.release()
+
+# --- Migraciones del Esquema ---
+# Lista ordenada de (versión, descripción, sentencias). Cada migración se aplica una sola vez,
+# en su propia transacción, y queda registrada en `schema_version`. Nunca se edita una
+# migración ya publicada: los cambios se añaden como una versión nueva al final.
+MIGRATIONS = [
+    (1, "Tablas base", [
         "CREATE TABLE IF NOT EXISTS personas (id SERIAL PRIMARY KEY, nombre TEXT UNIQUE NOT NULL);",
         "CREATE TABLE IF NOT EXISTS datos_persona (id SERIAL PRIMARY KEY, persona_id INTEGER REFERENCES personas(id) ON DELETE CASCADE, dato_texto TEXT);",
         "CREATE TABLE IF NOT EXISTS reglas_ia (id SERIAL PRIMARY KEY, regla_texto TEXT);",
@@ -28,35 +171,258 @@ def setup_database():
         "CREATE TABLE IF NOT EXISTS exitos_logs (id SERIAL PRIMARY KEY, author_id BIGINT NOT NULL, log_message TEXT NOT NULL, timestamp TIMESTAMPTZ NOT NULL);",
         "CREATE TABLE IF NOT EXISTS chats_guardados (id SERIAL PRIMARY KEY, user_id BIGINT, user_name TEXT, message TEXT, timestamp TIMESTAMPTZ, turno TEXT);",
         "CREATE TABLE IF NOT EXISTS comandos_dinamicos (nombre_comando TEXT PRIMARY KEY, respuesta_comando TEXT, creador_id BIGINT, creador_nombre TEXT);",
-        "CREATE TABLE IF NOT EXISTS tareas_programadas (id SERIAL PRIMARY KEY, guild_id BIGINT NOT NULL, channel_id BIGINT NOT NULL, author_id BIGINT NOT NULL, message_content TEXT NOT NULL, send_at TIMESTAMPTZ NOT NULL, sent INTEGER DEFAULT 0);"
-    ]
-    
-    for command in commands:
-        cur.execute(command)
-        
-    conn.commit()
-    cur.close()
-    conn.close()
+        "CREATE TABLE IF NOT EXISTS tareas_programadas (id SERIAL PRIMARY KEY, guild_id BIGINT NOT NULL, channel_id BIGINT NOT NULL, author_id BIGINT NOT NULL, message_content TEXT NOT NULL, send_at TIMESTAMPTZ NOT NULL, sent INTEGER DEFAULT 0);",
+    ]),
+    (2, "Índices para estadísticas, tareas y perfiles", [
+        # `!stats` / `!registrolm` filtran por operador o turno y un rango de fechas, y ordenan por fecha.
+        "CREATE INDEX IF NOT EXISTS idx_lm_logs_timestamp ON lm_logs (timestamp);",
+        "CREATE INDEX IF NOT EXISTS idx_lm_logs_user_timestamp ON lm_logs (user_id, timestamp);",
+        "CREATE INDEX IF NOT EXISTS idx_lm_logs_turno_timestamp ON lm_logs (turno, timestamp);",
+        "CREATE INDEX IF NOT EXISTS idx_exitos_logs_timestamp ON exitos_logs (timestamp);",
+        # Índice parcial: solo contiene las tareas pendientes, que son las que lee el planificador.
+        "CREATE INDEX IF NOT EXISTS idx_tareas_pendientes_send_at ON tareas_programadas (send_at) WHERE sent = 0;",
+        "CREATE INDEX IF NOT EXISTS idx_datos_persona_persona_id ON datos_persona (persona_id);",
+        "CREATE INDEX IF NOT EXISTS idx_chats_guardados_timestamp ON chats_guardados (timestamp);",
+    ]),
+    (3, "Índices de trigramas para búsquedas de texto con LIKE", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+        "CREATE INDEX IF NOT EXISTS idx_chats_guardados_message_trgm ON chats_guardados USING gin (LOWER(message) gin_trgm_ops);",
+        "CREATE INDEX IF NOT EXISTS idx_exitos_logs_log_message_trgm ON exitos_logs USING gin (log_message gin_trgm_ops);",
+    ]),
+    (4, "Resumen diario de lm_logs mantenido por triggers", [
+        "CREATE TABLE IF NOT EXISTS ajustes_bot (clave TEXT PRIMARY KEY, valor TEXT NOT NULL);",
+        # `day` es la fecha local en la zona horaria guardada en ajustes_bot ('timezone').
+        "CREATE TABLE IF NOT EXISTS lm_stats_daily (day DATE NOT NULL, user_id BIGINT NOT NULL, turno TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (day, user_id, turno));",
+        """CREATE OR REPLACE FUNCTION lm_stats_daily_actualizar() RETURNS trigger AS $$
+        DECLARE
+            zona TEXT := COALESCE((SELECT valor FROM ajustes_bot WHERE clave = 'timezone'), 'UTC');
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                UPDATE lm_stats_daily SET count = count - 1
+                WHERE day = (OLD.timestamp AT TIME ZONE zona)::date AND user_id = OLD.user_id AND turno = OLD.turno;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO lm_stats_daily (day, user_id, turno, count)
+                VALUES ((NEW.timestamp AT TIME ZONE zona)::date, NEW.user_id, NEW.turno, 1)
+                ON CONFLICT (day, user_id, turno) DO UPDATE SET count = lm_stats_daily.count + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;""",
+        """CREATE OR REPLACE FUNCTION lm_stats_daily_vaciar() RETURNS trigger AS $$
+        BEGIN
+            TRUNCATE lm_stats_daily;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;""",
+        "DROP TRIGGER IF EXISTS trg_lm_stats_daily ON lm_logs;",
+        "CREATE TRIGGER trg_lm_stats_daily AFTER INSERT OR DELETE OR UPDATE OF timestamp, user_id, turno ON lm_logs FOR EACH ROW EXECUTE FUNCTION lm_stats_daily_actualizar();",
+        "DROP TRIGGER IF EXISTS trg_lm_stats_daily_truncate ON lm_logs;",
+        "CREATE TRIGGER trg_lm_stats_daily_truncate AFTER TRUNCATE ON lm_logs FOR EACH STATEMENT EXECUTE FUNCTION lm_stats_daily_vaciar();",
+    ]),
+    (5, "Índices (timestamp, id) para la paginación por clave de los registros", [
+        "CREATE INDEX IF NOT EXISTS idx_lm_logs_timestamp_id ON lm_logs (timestamp, id);",
+        "CREATE INDEX IF NOT EXISTS idx_exitos_logs_timestamp_id ON exitos_logs (timestamp, id);",
+        # Los índices solo por fecha quedan cubiertos por los nuevos.
+        "DROP INDEX IF EXISTS idx_lm_logs_timestamp;",
+        "DROP INDEX IF EXISTS idx_exitos_logs_timestamp;",
+    ]),
+    (6, "Búsqueda de texto completo en chats_guardados", [
+        "CREATE EXTENSION IF NOT EXISTS unaccent;",
+        # Copia de la configuración 'spanish' que además quita las tildes (canción = cancion).
+        """DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+                CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+                ALTER TEXT SEARCH CONFIGURATION es_unaccent ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+            END IF;
+        END;
+        $$;""",
+        "ALTER TABLE chats_guardados ADD COLUMN IF NOT EXISTS message_tsv tsvector GENERATED ALWAYS AS (to_tsvector('es_unaccent'::regconfig, COALESCE(message, ''))) STORED;",
+        "CREATE INDEX IF NOT EXISTS idx_chats_guardados_message_tsv ON chats_guardados USING gin (message_tsv);",
+        # `!buscar` ya no usa LIKE sobre los mensajes guardados.
+        "DROP INDEX IF EXISTS idx_chats_guardados_message_trgm;",
+    ]),
+    (7, "Alias de comandos dinámicos", [
+        "CREATE TABLE IF NOT EXISTS alias_comandos_dinamicos (alias TEXT PRIMARY KEY, nombre_comando TEXT NOT NULL REFERENCES comandos_dinamicos(nombre_comando) ON DELETE CASCADE);",
+    ]),
+    (8, "Notificaciones de cambios (LISTEN/NOTIFY) para sincronizar las cachés entre procesos", [
+        # El aviso incluye la fila completa para aplicar el cambio sin consultar la base de datos.
+        # NOTIFY admite ~8000 bytes: si la fila no cabe se envía sin ella y quien escucha recarga esa caché.
+        """CREATE OR REPLACE FUNCTION notificar_cambio() RETURNS trigger AS $$
+        DECLARE
+            fila JSON;
+            payload TEXT;
+        BEGIN
+            IF TG_LEVEL = 'ROW' THEN
+                fila := CASE WHEN TG_OP = 'DELETE' THEN row_to_json(OLD) ELSE row_to_json(NEW) END;
+            END IF;
+            payload := json_build_object('tabla', TG_TABLE_NAME, 'op', TG_OP, 'origen', current_setting('application_name'), 'fila', fila)::text;
+            IF octet_length(payload) > 7900 THEN
+                payload := json_build_object('tabla', TG_TABLE_NAME, 'op', TG_OP, 'origen', current_setting('application_name'), 'fila', NULL)::text;
+            END IF;
+            PERFORM pg_notify('mibot_cambios', payload);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;""",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON comandos_dinamicos;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON comandos_dinamicos FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON comandos_dinamicos;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON comandos_dinamicos FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON alias_comandos_dinamicos;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON alias_comandos_dinamicos FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON alias_comandos_dinamicos;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON alias_comandos_dinamicos FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON comandos_config;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON comandos_config FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON comandos_config;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON comandos_config FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON permisos_comandos;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON permisos_comandos FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON permisos_comandos;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON permisos_comandos FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON reglas_ia;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON reglas_ia FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON reglas_ia;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON reglas_ia FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON personas;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON personas FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON personas;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON personas FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio ON datos_persona;",
+        "CREATE TRIGGER trg_notificar_cambio AFTER INSERT OR UPDATE OR DELETE ON datos_persona FOR EACH ROW EXECUTE FUNCTION notificar_cambio();",
+        "DROP TRIGGER IF EXISTS trg_notificar_cambio_truncate ON datos_persona;",
+        "CREATE TRIGGER trg_notificar_cambio_truncate AFTER TRUNCATE ON datos_persona FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();",
+    ]),
+]
 
-async def db_execute(query, params=(), fetch=None):
-    """Ejecuta una consulta en la base de datos de forma asíncrona."""
-    def blocking_db_call():
-        conn = None
+def rebuild_lm_stats_daily(cur, zona=None):
+    """
+    Recalcula por completo `lm_stats_daily` a partir de `lm_logs` en la zona horaria `zona`
+    (por defecto la del bot) y la guarda como zona del resumen. Bloquea las inserciones en
+    `lm_logs` mientras dura para que ningún registro se cuente dos veces. Devuelve las filas generadas.
+    """
+    zona = zona or get_user_timezone().zone
+    cur.execute("LOCK TABLE lm_logs IN SHARE MODE;")
+    cur.execute("INSERT INTO ajustes_bot (clave, valor) VALUES ('timezone', %s) ON CONFLICT (clave) DO UPDATE SET valor = EXCLUDED.valor;", (zona,))
+    cur.execute("DELETE FROM lm_stats_daily;")
+    cur.execute(
+        "INSERT INTO lm_stats_daily (day, user_id, turno, count) "
+        "SELECT (timestamp AT TIME ZONE %s)::date, user_id, turno, COUNT(*) FROM lm_logs GROUP BY 1, 2, 3;",
+        (zona,)
+    )
+    return cur.rowcount
+
+def get_schema_version(cur):
+    """Devuelve la versión de esquema aplicada (0 si la base de datos es nueva)."""
+    cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, descripcion TEXT NOT NULL, aplicada_en TIMESTAMPTZ NOT NULL DEFAULT now());")
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cur.fetchone()[0]
+
+def setup_database():
+    """
+    Aplica en orden las migraciones pendientes de MIGRATIONS y registra cada versión en `schema_version`.
+    Un bloqueo consultivo evita que dos procesos migren a la vez.
+    """
+    with pooled_connection() as conn:
         try:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute(query, params)
-            
-            if fetch == 'one':
-                return cur.fetchone()
-            if fetch == 'all':
-                return cur.fetchall()
-            
-            conn.commit()
-            return cur.rowcount
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(hashtext('mibot_schema_migrations'));")
+                conn.commit()
+                current = get_schema_version(cur)
+                conn.commit()
+                for version, descripcion, statements in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_version (version, descripcion) VALUES (%s, %s);", (version, descripcion))
+                    conn.commit()
+                    log.info("Migración %s aplicada: %s", version, descripcion)
+                # El resumen diario agrupa por fecha local: si la zona horaria del bot cambió (o es la
+                # primera vez), se recalcula con la nueva zona.
+                zona = get_user_timezone().zone
+                cur.execute("SELECT valor FROM ajustes_bot WHERE clave = 'timezone';")
+                row = cur.fetchone()
+                if row is None or row[0] != zona:
+                    filas = rebuild_lm_stats_daily(cur, zona)
+                    conn.commit()
+                    log.info("Resumen diario de LMs recalculado en la zona '%s' (%s filas).", zona, filas)
+        except Exception:
+            conn.rollback()
+            raise
         finally:
-            if conn:
-                cur.close()
-                conn.close()
-                
-    return await asyncio.to_thread(blocking_db_call)
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtext('mibot_schema_migrations'));")
+            conn.commit()
+
+def _run_statement(cur, query, params=(), fetch=None):
+    """
+    Ejecuta una sentencia sobre un cursor ya abierto. Modos de `fetch`:
+    - None: devuelve el número de filas afectadas.
+    - 'one' / 'all': devuelve una fila o todas las filas.
+    - 'many': `executemany` con una lista de tuplas de parámetros.
+    - 'values': `execute_values` con una lista de tuplas; la consulta usa `VALUES %s`.
+      Si lleva `RETURNING`, devuelve las filas generadas; si no, las filas afectadas.
+    Cada ejecución se mide en `metrics` bajo la huella de la consulta.
+    """
+    with metrics.timer(TIPO_SQL, fingerprint(query)):
+        return _execute_statement(cur, query, params, fetch)
+
+def _execute_statement(cur, query, params, fetch):
+    if fetch == 'many':
+        cur.executemany(query, params)
+        return cur.rowcount
+    if fetch == 'values':
+        returning = 'RETURNING' in query.upper()
+        rows = psycopg2.extras.execute_values(cur, query, params, page_size=max(len(params), 1), fetch=returning)
+        return rows if returning else cur.rowcount
+    cur.execute(query, params)
+    if fetch == 'one':
+        return cur.fetchone()
+    if fetch == 'all':
+        return cur.fetchall()
+    return cur.rowcount
+
+def _run_in_transaction(func, *args):
+    """Ejecuta func(cur, *args) con una conexión del pool y hace commit, o rollback si falla."""
+    with pooled_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                result = func(cur, *args)
+            conn.commit()
+            return result
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+async def db_execute(query, params=(), fetch=None):
+    """
+    Ejecuta una consulta en la base de datos de forma asíncrona usando una conexión del pool.
+    `fetch` acepta los modos de `_run_statement`. Siempre se hace commit,
+    así que `INSERT ... RETURNING` funciona con fetch='one'.
+    """
+    return await asyncio.to_thread(_run_in_transaction, _run_statement, query, params, fetch)
+
+async def db_batch(statements):
+    """
+    Ejecuta varias sentencias `(query, params, fetch)` en una sola conexión y una sola transacción.
+    Devuelve la lista de resultados en el mismo orden. Si una falla, no se aplica ninguna.
+    """
+    def run_all(cur):
+        return [_run_statement(cur, *statement) for statement in statements]
+
+    return await asyncio.to_thread(_run_in_transaction, run_all)
+
+async def db_transaction(func, *args):
+    """
+    Ejecuta `func(cur, *args)` en un hilo dentro de una única transacción.
+    Útil cuando una sentencia depende del resultado de otra. `func` debe ser síncrona.
+    Se mide como una sola serie `transacción <nombre de func>`.
+    """
+    def run_timed(cur, *args):
+        with metrics.timer(TIPO_SQL, f"transacción {func.__name__}"):
+            return func(cur, *args)
+
+    return await asyncio.to_thread(_run_in_transaction, run_timed, *args)
@@ -0,0 +1,218 @@
+import logging
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from utils.metrics import metrics, TIPO_API
+
+log = logging.getLogger(__name__)
+
+# --- Configuración del Planificador de Gemini ---
+# Peticiones por minuto permitidas por la cuota de Gemini y ráfaga máxima del token bucket.
+GEMINI_RPM = float(os.getenv('GEMINI_RPM', '15'))
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', '5'))
+GEMINI_MAX_IN_FLIGHT = int(os.getenv('GEMINI_MAX_IN_FLIGHT', '4'))
+# Tiempo máximo total de una petición (espera en cola + reintentos), en segundos.
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '90'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '4'))
+GEMINI_BACKOFF_BASE = 1.0
+GEMINI_BACKOFF_MAX = 30.0
+
+# Prioridades: un número menor se atiende antes.
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_NORMAL = 1
+PRIORIDAD_FONDO = 2
+
+# Códigos HTTP de google.api_core que merecen reintento (límite de cuota y fallos transitorios).
+RETRYABLE_CODES = (429, 500, 503, 504)
+
+class GeminiTimeout(Exception):
+    """Se lanza cuando una petición a Gemini no termina antes de su fecha límite."""
+
+def is_retryable(error):
+    """Indica si un error de la API de Gemini es transitorio."""
+    return isinstance(error, asyncio.TimeoutError) or getattr(error, 'code', None) in RETRYABLE_CODES
+
+async def _next_chunk(iterator):
+    """Devuelve el siguiente fragmento de un stream de Gemini, o None al terminar."""
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+class TokenBucket:
+    """Limitador de tasa: `rate` fichas por segundo con una capacidad máxima de `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Espera hasta que haya una ficha disponible y la consume."""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class PriorityGate:
+    """Semáforo con `slots` plazas que despierta a los que esperan por orden de prioridad y llegada."""
+    def __init__(self, slots):
+        self._free = slots
+        self._waiters = []
+        self._counter = itertools.count()
+
+    @property
+    def waiting(self):
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority):
+        if self._free > 0 and not self.waiting:
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Si la plaza se concedió justo antes de cancelar, se devuelve para no perderla.
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+class GeminiScheduler:
+    """
+    Punto único de acceso a Gemini para todo el bot. Limita la tasa con un token bucket,
+    acota las peticiones simultáneas, aplica una fecha límite por petición, reintenta
+    los errores 429/5xx con backoff exponencial con jitter y atiende primero las
+    peticiones interactivas (`!reply`) frente a las de fondo (series programadas).
+    """
+    def __init__(self, bot, rpm=GEMINI_RPM, burst=GEMINI_BURST, max_in_flight=GEMINI_MAX_IN_FLIGHT,
+                 timeout=GEMINI_TIMEOUT, max_retries=GEMINI_MAX_RETRIES):
+        self.bot = bot
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rpm / 60.0, burst)
+        self._gate = PriorityGate(max_in_flight)
+        self.in_flight = 0
+        self.stats_counters = {'requests': 0, 'retries': 0, 'failures': 0, 'timeouts': 0}
+
+    async def _acquire(self, priority, deadline):
+        """Reserva una plaza y una ficha antes de la fecha límite; devuelve False si no lo consigue."""
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self._gate.acquire(priority), deadline - loop.time())
+        except asyncio.TimeoutError:
+            return False
+        try:
+            await asyncio.wait_for(self._bucket.acquire(), deadline - loop.time())
+        except asyncio.TimeoutError:
+            self._gate.release()
+            return False
+        self.in_flight += 1
+        return True
+
+    def _release(self):
+        self.in_flight -= 1
+        self._gate.release()
+
+    def _backoff(self, attempt):
+        """Backoff exponencial con 'full jitter'."""
+        return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+
+    async def _run(self, call, priority, timeout, keep_slot=False):
+        """
+        Ejecuta `call()` (una corrutina nueva en cada intento) respetando límites, fecha límite y reintentos.
+        Con `keep_slot=True` la plaza no se libera al terminar: el llamador debe hacerlo con `_release()`.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        self.stats_counters['requests'] += 1
+        attempt = 0
+        while True:
+            if not await self._acquire(priority, deadline):
+                self.stats_counters['timeouts'] += 1
+                raise GeminiTimeout("La IA está saturada y no respondió a tiempo. Inténtalo de nuevo en un momento.")
+            try:
+                result = await asyncio.wait_for(call(), deadline - loop.time())
+            except Exception as e:
+                self._release()
+                error = e
+            except BaseException:
+                self._release()
+                raise
+            else:
+                if not keep_slot:
+                    self._release()
+                return result
+
+            delay = self._backoff(attempt)
+            if not is_retryable(error) or attempt >= self.max_retries or loop.time() + delay >= deadline:
+                if isinstance(error, asyncio.TimeoutError):
+                    self.stats_counters['timeouts'] += 1
+                    raise GeminiTimeout("La IA tardó demasiado en responder. Inténtalo de nuevo en un momento.") from error
+                self.stats_counters['failures'] += 1
+                raise error
+            attempt += 1
+            self.stats_counters['retries'] += 1
+            log.warning("Error transitorio (%s), reintento %s/%s en %.1fs.", type(error).__name__, attempt, self.max_retries, delay)
+            await asyncio.sleep(delay)
+
+    async def generate(self, contents, priority=PRIORIDAD_NORMAL, timeout=None, **kwargs):
+        """Equivalente planificado de `gemini_model.generate_content_async(contents, **kwargs)`."""
+        model = await self.bot.get_gemini_model()
+        # Se mide cada intento (sin la espera en cola), así los reintentos fallidos cuentan como errores.
+        return await self._run(lambda: metrics.timed(TIPO_API, 'gemini generate', model.generate_content_async(contents, **kwargs)), priority, timeout)
+
+    async def count_tokens(self, contents, priority=PRIORIDAD_INTERACTIVA, timeout=None):
+        """Equivalente planificado de `gemini_model.count_tokens_async(contents)`; devuelve `total_tokens`."""
+        model = await self.bot.get_gemini_model()
+        result = await self._run(lambda: metrics.timed(TIPO_API, 'gemini count_tokens', model.count_tokens_async(contents)), priority, timeout)
+        return result.total_tokens
+
+    async def stream(self, contents, priority=PRIORIDAD_NORMAL, timeout=None, **kwargs):
+        """
+        Generador asíncrono que devuelve el texto de la respuesta por fragmentos (`stream=True`).
+        Se reintenta hasta recibir el primer fragmento; después, la plaza se mantiene ocupada
+        hasta que termina el stream y cada fragmento tiene `timeout` segundos para llegar.
+        """
+        model = await self.bot.get_gemini_model()
+
+        async def open_stream():
+            with metrics.timer(TIPO_API, 'gemini stream (primer fragmento)'):
+                response = await model.generate_content_async(contents, stream=True, **kwargs)
+                iterator = response.__aiter__()
+                return iterator, await _next_chunk(iterator)
+
+        iterator, chunk = await self._run(open_stream, priority, timeout, keep_slot=True)
+        try:
+            while chunk is not None:
+                yield chunk.text
+                try:
+                    chunk = await asyncio.wait_for(_next_chunk(iterator), timeout or self.timeout)
+                except asyncio.TimeoutError as e:
+                    self.stats_counters['timeouts'] += 1
+                    raise GeminiTimeout("La IA dejó de responder a mitad de la respuesta.") from e
+        finally:
+            self._release()
+
+    def stats(self):
+        return dict(self.stats_counters, in_flight=self.in_flight, waiting=self._gate.waiting, tokens=round(self._bucket.tokens, 2))
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, time
 import os
 import pytz
 
@@ -8,70 +8,77 @@ TURNOS_DISPLAY = {
     "noche": "Noche 🌑"
 }
 
-def get_turno_key():
-    """Devuelve la clave del turno actual ('dia', 'tarde', 'noche') usando la zona horaria configurada."""
+def get_user_timezone():
+    """Devuelve la zona horaria configurada en TIMEZONE (UTC si no existe o no es válida)."""
     try:
-        tz_str = os.getenv('TIMEZONE', 'UTC')
-        user_timezone = pytz.timezone(tz_str)
+        return pytz.timezone(os.getenv('TIMEZONE', 'UTC'))
     except pytz.UnknownTimeZoneError:
-        user_timezone = pytz.timezone('UTC')
-        
-    hour = datetime.now(user_timezone).hour
+        return pytz.timezone('UTC')
+
+def get_turno_key():
+    """Devuelve la clave del turno actual ('dia', 'tarde', 'noche') usando la zona horaria configurada."""
+    hour = datetime.now(get_user_timezone()).hour
     if 7 <= hour < 15: return "dia"
     elif 15 <= hour < 23: return "tarde"
     else: return "noche"
 
-def parse_periodo(periodo: str):
-    """Parsea un string de periodo y devuelve cláusulas SQL, parámetros y un título para PostgreSQL."""
-    where_clauses = []
-    params = []
-    title = ""
-    
-    tz_str = os.getenv('TIMEZONE', 'UTC')
-    try:
-        user_timezone = pytz.timezone(tz_str)
-    except pytz.UnknownTimeZoneError:
-        user_timezone = pytz.timezone('UTC')
-        
-    today = datetime.now(user_timezone).date()
-    periodo = periodo.lower()
+def inicio_del_dia(dia: date, tz):
+    """
+    Devuelve el primer instante de `dia` en la zona `tz` como datetime con zona.
+    Si la medianoche no existe por un cambio de horario, `normalize` lo lleva al primer instante válido.
+    """
+    return tz.normalize(tz.localize(datetime.combine(dia, time.min)))
+
+def rango_dias(primer_dia: date, ultimo_dia: date, tz):
+    """Devuelve el intervalo semiabierto [inicio, fin) que cubre de `primer_dia` a `ultimo_dia` (ambos incluidos)."""
+    return inicio_del_dia(primer_dia, tz), inicio_del_dia(ultimo_dia + timedelta(days=1), tz)
 
-    date_clause = f"DATE(timestamp AT TIME ZONE '{tz_str}')"
+def periodo_bounds(periodo: str, tz=None, today: date = None):
+    """
+    Traduce un periodo (`hoy`, `ayer`, `semana`, `mes`, `AAAA-MM-DD` o `AAAA-MM-DD a AAAA-MM-DD`)
+    a una tupla (inicio, fin, título) con límites TIMESTAMPTZ semiabiertos calculados en la zona horaria del bot.
+    Si el periodo no es válido devuelve (None, None, mensaje de error).
+    """
+    tz = tz or get_user_timezone()
+    today = today or datetime.now(tz).date()
+    periodo = periodo.lower()
 
     if periodo == 'hoy':
-        where_clauses.append(f"{date_clause} = %s")
-        params.append(today.isoformat())
-        title = "de Hoy"
+        return (*rango_dias(today, today, tz), "de Hoy")
     elif periodo == 'ayer':
         ayer = today - timedelta(days=1)
-        where_clauses.append(f"{date_clause} = %s")
-        params.append(ayer.isoformat())
-        title = f"de Ayer ({ayer.strftime('%d-%m-%Y')})"
+        return (*rango_dias(ayer, ayer, tz), f"de Ayer ({ayer.strftime('%d-%m-%Y')})")
     elif periodo == 'semana':
-        where_clauses.append("to_char(timestamp AT TIME ZONE %s, 'IYYY-IW') = to_char(now() AT TIME ZONE %s, 'IYYY-IW')")
-        params.extend([tz_str, tz_str])
-        title = "de esta Semana"
+        # Semana ISO: de lunes a domingo.
+        lunes = today - timedelta(days=today.weekday())
+        return (*rango_dias(lunes, lunes + timedelta(days=6), tz), "de esta Semana")
     elif periodo == 'mes':
-        where_clauses.append("to_char(timestamp AT TIME ZONE %s, 'YYYY-MM') = to_char(now() AT TIME ZONE %s, 'YYYY-MM')")
-        params.extend([tz_str, tz_str])
-        title = "de este Mes"
+        primero = today.replace(day=1)
+        siguiente = (primero + timedelta(days=32)).replace(day=1)
+        return (*rango_dias(primero, siguiente - timedelta(days=1), tz), "de este Mes")
     elif ' a ' in periodo:
         try:
             start_date_str, end_date_str = [p.strip() for p in periodo.split(' a ')]
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            where_clauses.append(f"{date_clause} BETWEEN %s AND %s")
-            params.extend([start_date.isoformat(), end_date.isoformat()])
-            title = f"de {start_date.strftime('%d/%m/%Y')} a {end_date.strftime('%d/%m/%Y')}"
-        except (ValueError, IndexError):
+        except ValueError:
             return None, None, "Formato de rango de fechas incorrecto. Usa `AAAA-MM-DD a AAAA-MM-DD`."
+        if end_date < start_date:
+            return None, None, "La fecha final del rango es anterior a la inicial."
+        return (*rango_dias(start_date, end_date, tz), f"de {start_date.strftime('%d/%m/%Y')} a {end_date.strftime('%d/%m/%Y')}")
     else:
         try:
             fecha_obj = datetime.strptime(periodo, '%Y-%m-%d').date()
-            where_clauses.append(f"{date_clause} = %s")
-            params.append(fecha_obj.isoformat())
-            title = f"del {fecha_obj.strftime('%d-%m-%Y')}"
         except ValueError:
             return None, None, "Periodo no válido. Usa `hoy`, `ayer`, `semana`, `mes`, una fecha `AAAA-MM-DD` o un rango."
+        return (*rango_dias(fecha_obj, fecha_obj, tz), f"del {fecha_obj.strftime('%d-%m-%Y')}")
 
-    return where_clauses, params, title
+def parse_periodo(periodo: str):
+    """
+    Parsea un string de periodo y devuelve cláusulas SQL, parámetros y un título para PostgreSQL.
+    El filtro es un rango `timestamp >= %s AND timestamp < %s` para que PostgreSQL pueda usar los índices sobre `timestamp`.
+    """
+    start, end, title = periodo_bounds(periodo)
+    if start is None:
+        return None, None, title
+    return ["timestamp >= %s AND timestamp < %s"], [start, end], title
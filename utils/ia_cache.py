@@ -0,0 +1,162 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from utils.db_manager import db_execute, db_batch
+
+# Tiempo de vida de cada entrada y número máximo de perfiles en memoria.
+IA_CACHE_TTL = float(os.getenv('IA_CACHE_TTL', '900'))
+IA_CACHE_MAX_PERFILES = int(os.getenv('IA_CACHE_MAX_PERFILES', '256'))
+
+def render_hoja_personaje(nombre_perfil, datos):
+    """Construye el texto 'hoja_personaje' que se añade al prompt a partir de los datos del perfil."""
+    return f"**TU PERSONAJE:**\nTú eres '{nombre_perfil}'.\n" + "\n".join(f"- {dato}" for dato in datos)
+
+def render_reglas(reglas):
+    """Construye el bloque de reglas globales a partir de una lista de (id, texto)."""
+    return "\n".join(f"- {texto}" for _, texto in reglas)
+
+class IAContextCache:
+    """
+    Caché en memoria del contexto de la IA: la hoja de personaje ya renderizada de cada perfil
+    y el bloque de reglas globales. Se carga en `setup_hook` y los comandos de administración
+    la actualizan al escribir, así `!reply` no necesita consultar la base de datos.
+    Las entradas caducan tras IA_CACHE_TTL segundos como red de seguridad.
+    """
+    def __init__(self, ttl=IA_CACHE_TTL, max_perfiles=IA_CACHE_MAX_PERFILES):
+        self.ttl = ttl
+        self.max_perfiles = max_perfiles
+        self._perfiles = OrderedDict()
+        self._reglas = None
+        self._reglas_block = ""
+        self._reglas_expira = 0.0
+        self._lock = asyncio.Lock()
+        # Versiones que cambian con cada modificación; sirven como clave para otras cachés.
+        self.reglas_version = 0
+        self._perfil_version = 0
+        self.hits = 0
+        self.misses = 0
+
+    # --- Carga desde la base de datos ---
+    async def load(self):
+        """Carga todas las reglas y perfiles (hasta el límite) en dos consultas dentro de una transacción."""
+        reglas_rows, perfiles_rows = await db_batch([
+            ("SELECT id, regla_texto FROM reglas_ia ORDER BY id ASC", (), 'all'),
+            ("SELECT p.id, p.nombre, d.dato_texto FROM personas p LEFT JOIN datos_persona d ON d.persona_id = p.id ORDER BY p.id ASC, d.id ASC", (), 'all'),
+        ])
+        self._set_reglas([(row['id'], row['regla_texto']) for row in reglas_rows])
+        perfiles = OrderedDict()
+        for row in perfiles_rows:
+            persona = perfiles.setdefault(row['nombre'], {'id': row['id'], 'datos': []})
+            if row['dato_texto'] is not None:
+                persona['datos'].append(row['dato_texto'])
+        self._perfiles.clear()
+        for nombre, persona in perfiles.items():
+            self._set_perfil(nombre, persona['id'], persona['datos'])
+        return len(self._perfiles)
+
+    async def _load_reglas(self):
+        rows = await db_execute("SELECT id, regla_texto FROM reglas_ia ORDER BY id ASC", fetch='all')
+        self._set_reglas([(row['id'], row['regla_texto']) for row in rows])
+
+    async def _load_perfil(self, nombre):
+        rows = await db_execute("SELECT p.id, d.dato_texto FROM personas p LEFT JOIN datos_persona d ON d.persona_id = p.id WHERE p.nombre = %s ORDER BY d.id ASC", (nombre,), fetch='all')
+        if not rows:
+            return None
+        return self._set_perfil(nombre, rows[0]['id'], [row['dato_texto'] for row in rows if row['dato_texto'] is not None])
+
+    # --- Almacenamiento interno ---
+    def _set_reglas(self, reglas):
+        self._reglas = list(reglas)
+        self._reglas_block = render_reglas(self._reglas)
+        self._reglas_expira = time.monotonic() + self.ttl
+        self.reglas_version += 1
+
+    def _set_perfil(self, nombre, persona_id, datos):
+        self._perfil_version += 1
+        entry = {
+            'id': persona_id,
+            'datos': list(datos),
+            'hoja': render_hoja_personaje(nombre, datos),
+            'expira': time.monotonic() + self.ttl,
+            'version': self._perfil_version,
+        }
+        self._perfiles[nombre] = entry
+        self._perfiles.move_to_end(nombre)
+        while len(self._perfiles) > self.max_perfiles:
+            self._perfiles.popitem(last=False)
+        return entry
+
+    # --- Lectura ---
+    async def get_reglas(self):
+        """Devuelve el bloque de reglas renderizado (cadena vacía si no hay reglas)."""
+        if self._reglas is None or time.monotonic() >= self._reglas_expira:
+            async with self._lock:
+                if self._reglas is None or time.monotonic() >= self._reglas_expira:
+                    await self._load_reglas()
+        return self._reglas_block
+
+    async def get_perfil(self, nombre_perfil):
+        """Devuelve la entrada del perfil (id, datos, hoja, version) o lanza ValueError si no existe."""
+        nombre = nombre_perfil.lower()
+        entry = self._perfiles.get(nombre)
+        if entry and time.monotonic() < entry['expira']:
+            self.hits += 1
+            self._perfiles.move_to_end(nombre)
+            return entry
+        self.misses += 1
+        async with self._lock:
+            entry = await self._load_perfil(nombre)
+        if not entry:
+            raise ValueError(f"No encontré el perfil `{nombre}`.")
+        return entry
+
+    async def get_context(self, nombre_perfil):
+        """
+        Devuelve una tupla (hoja_personaje, reglas_block) lista para el prompt.
+        Si no se indica perfil, la hoja de personaje es una cadena vacía.
+        """
+        hoja_personaje = ""
+        if nombre_perfil:
+            hoja_personaje = (await self.get_perfil(nombre_perfil))['hoja']
+        return hoja_personaje, await self.get_reglas()
+
+    def nombre_por_id(self, persona_id):
+        """Busca el nombre de un perfil en caché por su id (None si no está cargado)."""
+        for nombre, entry in self._perfiles.items():
+            if entry['id'] == persona_id:
+                return nombre
+        return None
+
+    # --- Escritura (write-through desde los comandos de administración) ---
+    def perfil_creado(self, nombre, persona_id):
+        self._set_perfil(nombre.lower(), persona_id, [])
+
+    def perfil_borrado(self, nombre):
+        self._perfiles.pop(nombre.lower(), None)
+        self._perfil_version += 1
+
+    def dato_agregado(self, nombre, dato):
+        nombre = nombre.lower()
+        entry = self._perfiles.get(nombre)
+        if entry:
+            self._set_perfil(nombre, entry['id'], entry['datos'] + [dato])
+
+    def invalidar_perfil(self, nombre):
+        self.perfil_borrado(nombre)
+
+    def regla_agregada(self, regla_id, texto):
+        if self._reglas is not None:
+            self._set_reglas(self._reglas + [(regla_id, texto)])
+
+    def regla_borrada(self, regla_id):
+        if self._reglas is not None:
+            self._set_reglas([(rid, texto) for rid, texto in self._reglas if rid != regla_id])
+
+    def invalidar_reglas(self):
+        self._reglas = None
+        self.reglas_version += 1
+
+    def stats(self):
+        """Devuelve contadores de uso de la caché."""
+        return {'perfiles': len(self._perfiles), 'hits': self.hits, 'misses': self.misses, 'reglas_cargadas': self._reglas is not None}
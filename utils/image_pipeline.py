@@ -0,0 +1,90 @@
+import io
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Configuración del Procesamiento de Imágenes ---
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+# Máximo de imágenes en proceso o en espera; por encima se rechaza el trabajo en lugar de acumularlo.
+IMAGE_QUEUE_LIMIT = int(os.getenv('IMAGE_QUEUE_LIMIT', '8'))
+# Protección contra 'decompression bombs': imágenes con más píxeles que esto se rechazan sin decodificar.
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', '40000000'))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(20 * 1024 * 1024)))
+IMAGE_MAX_SIDE = 1024
+
+class ImagePipelineBusy(Exception):
+    """Se lanza cuando la cola de procesamiento de imágenes está llena."""
+
+class ImageTooLarge(ValueError):
+    """Se lanza cuando la imagen supera el límite de píxeles o de tamaño."""
+
+def preprocess_image(attachment_bytes, max_side=IMAGE_MAX_SIDE, max_pixels=IMAGE_MAX_PIXELS):
+    """
+    Convierte la imagen a RGB, la redimensiona y la comprime como JPEG para la IA.
+    Se ejecuta en un proceso del pool: no debe tocar el estado del bot.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(attachment_bytes)) as img:
+        # `Image.open` solo lee la cabecera, así que el tamaño se comprueba antes de decodificar.
+        width, height = img.size
+        if width * height > max_pixels:
+            raise ImageTooLarge(f"La imagen es demasiado grande ({width}x{height} píxeles).")
+        # En JPEG, draft() decodifica directamente a una escala reducida (1/2, 1/4, 1/8), mucho más rápido.
+        img.draft('RGB', (max_side, max_side))
+        rgb_img = img.convert('RGB')
+        rgb_img.thumbnail((max_side, max_side))
+        buffer = io.BytesIO()
+        rgb_img.save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+def _warmup():
+    """Importa Pillow en el proceso hijo para que la primera imagen no pague ese coste."""
+    from PIL import Image
+    return Image.__name__
+
+class ImagePipeline:
+    """
+    Procesa imágenes en un ProcessPoolExecutor acotado para no bloquear el bucle de eventos.
+    Lleva la cuenta de trabajos pendientes y rechaza los nuevos con ImagePipelineBusy si se supera el límite.
+    """
+    def __init__(self, workers=IMAGE_WORKERS, queue_limit=IMAGE_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def start(self):
+        """Arranca los procesos del pool por adelantado, antes de que el bot tenga mucha actividad."""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _warmup) for _ in range(self.workers)))
+
+    async def process(self, attachment_bytes):
+        """Devuelve los bytes JPEG procesados de la imagen."""
+        if len(attachment_bytes) > IMAGE_MAX_BYTES:
+            raise ImageTooLarge(f"El archivo pesa más de {IMAGE_MAX_BYTES // (1024 * 1024)} MB.")
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise ImagePipelineBusy("Hay demasiadas imágenes en proceso. Inténtalo en unos segundos.")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), preprocess_image, attachment_bytes)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        """Detiene el pool de procesos sin esperar a los trabajos pendientes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {'workers': self.workers, 'pending': self.pending, 'queue_limit': self.queue_limit, 'rejected': self.rejected}
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import copy
+import queue
+import atexit
+import threading
+import logging
+import logging.handlers
+import contextvars
+from datetime import datetime, timezone
+
+# --- Configuración del Registro (logging) ---
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'json' (una línea JSON por registro, para enviarlos a otro sistema) o 'texto' (legible en consola).
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+# Carpeta de los ficheros rotados (uno por proceso, `<INSTANCE_ID>.log`). Sin definir = solo consola.
+LOG_DIR = os.getenv('LOG_DIR', '')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+# Registros en espera de escribirse; si la cola se llena se descartan en lugar de bloquear el bucle de eventos.
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Segundos durante los que un aviso o error repetido (mismo logger, nivel y mensaje) se escribe una sola vez.
+LOG_DEDUP_WINDOW = float(os.getenv('LOG_DEDUP_WINDOW', '60'))
+LOG_DEDUP_MAX_KEYS = 1000
+
+# Campos de contexto que se añaden a cada registro (guild, usuario, comando) y que se pueden pasar en `extra`.
+CAMPOS_CONTEXTO = ('guild_id', 'user_id', 'command')
+CAMPOS_EXTRA = CAMPOS_CONTEXTO + ('latency_ms', 'suppressed')
+
+_contexto = contextvars.ContextVar('mibot_log_contexto', default={})
+_listener = None
+_queue_handler = None
+
+def bind_context(**campos):
+    """Añade campos al contexto de registro de la tarea actual (y de las tareas que cree después)."""
+    _contexto.set({**_contexto.get(), **campos})
+
+def bind_command_context(ctx):
+    """Asocia los registros de la tarea actual al servidor, usuario y comando de `ctx`."""
+    bind_context(
+        guild_id=ctx.guild.id if ctx.guild else None,
+        user_id=ctx.author.id,
+        command=ctx.command.qualified_name if ctx.command else ctx.invoked_with,
+    )
+
+class ContextFilter(logging.Filter):
+    """Copia el contexto de la tarea al registro. Corre en el hilo que registra, antes de pasar a la cola."""
+    def filter(self, record):
+        for campo, valor in _contexto.get().items():
+            if not hasattr(record, campo):
+                setattr(record, campo, valor)
+        return True
+
+class DuplicateFilter(logging.Filter):
+    """
+    Limita las tormentas de errores (p. ej. Gemini fallando en cada `!reply`): a partir de WARNING,
+    cada mensaje repetido se deja pasar una vez por ventana de `window` segundos. La siguiente vez que
+    pasa lleva `suppressed` con el número de repeticiones omitidas entre medias.
+    """
+    def __init__(self, window=LOG_DEDUP_WINDOW, min_level=logging.WARNING):
+        super().__init__()
+        self.window = window
+        self.min_level = min_level
+        self._vistos = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.min_level or self.window <= 0:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        with self._lock:
+            return self._primera_en_ventana(key, record)
+
+    def _primera_en_ventana(self, key, record):
+        now = time.monotonic()
+        visto = self._vistos.get(key)
+        if visto and now - visto[0] < self.window:
+            visto[1] += 1
+            return False
+        if visto and visto[1]:
+            record.suppressed = visto[1]
+        if len(self._vistos) >= LOG_DEDUP_MAX_KEYS:
+            self._vistos = {k: v for k, v in self._vistos.items() if now - v[0] < self.window}
+        self._vistos[key] = [now, 0]
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea ni escribe en stderr: si la cola está llena, descarta y cuenta."""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # El mensaje y la traza se resuelven aquí (los argumentos podrían cambiar antes de que escriba
+        # el hilo), pero se guardan por separado para que el JSON lleve la traza en su propio campo.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro con la hora en UTC, nivel, logger, mensaje, proceso y contexto."""
+    def __init__(self, instance):
+        super().__init__()
+        self.instance = instance
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'instance': self.instance,
+        }
+        for campo in CAMPOS_EXTRA:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                data[campo] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para la consola; añade los campos de contexto al final si los hay."""
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        texto = super().format(record)
+        extras = [f"{campo}={getattr(record, campo)}" for campo in CAMPOS_EXTRA if getattr(record, campo, None) is not None]
+        if extras:
+            first, sep, rest = texto.partition("\n")
+            texto = f"{first} [{' '.join(extras)}]{sep}{rest}"
+        return texto
+
+def setup_logging(instance=None):
+    """
+    Configura el logger raíz una sola vez: los registros pasan por los filtros de contexto y de duplicados
+    y entran en una cola sin bloquear; un QueueListener en su propio hilo los escribe en la consola y, si hay
+    LOG_DIR, en un fichero rotado por tamaño. Devuelve el QueueListener.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+    instance = instance or os.getenv('INSTANCE_ID', 'main')
+
+    handlers = []
+    consola = logging.StreamHandler(sys.stdout)
+    consola.setFormatter(TextFormatter() if LOG_FORMAT == 'texto' else JsonFormatter(instance))
+    handlers.append(consola)
+    if LOG_DIR:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        fichero = logging.handlers.RotatingFileHandler(
+            os.path.join(LOG_DIR, f"{instance}.log"), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+        fichero.setFormatter(JsonFormatter(instance))
+        handlers.append(fichero)
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(ContextFilter())
+    _queue_handler.addFilter(DuplicateFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [_queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Vacía la cola y detiene el hilo escritor (al apagar el proceso)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def dropped_records():
+    """Registros descartados porque la cola estaba llena."""
+    return _queue_handler.dropped if _queue_handler else 0
@@ -0,0 +1,198 @@
+import os
+import re
+import math
+import time
+import random
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+# --- Configuración de las Métricas ---
+# Muestras que guarda cada serie para calcular percentiles (muestreo de reservorio, memoria acotada).
+METRICS_RESERVOIR_SIZE = int(os.getenv('METRICS_RESERVOIR_SIZE', '1024'))
+# Máximo de series distintas por tipo; las que sobran se agrupan en OTRAS (p. ej. SQL generado al vuelo).
+METRICS_MAX_SERIES = int(os.getenv('METRICS_MAX_SERIES', '300'))
+OTRAS = '(otras)'
+# Límites superiores (en segundos) de los buckets que se exportan en /metrics.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# Tipos de serie: comandos del bot, sentencias SQL (por huella) y APIs externas.
+TIPO_COMANDO = 'comando'
+TIPO_SQL = 'sql'
+TIPO_API = 'api'
+TIPOS = (TIPO_COMANDO, TIPO_SQL, TIPO_API)
+
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+_SQL_SPACES = re.compile(r"\s+")
+FINGERPRINT_MAX = 160
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query):
+    """
+    Huella de una sentencia SQL: sin literales (cadenas y números pasan a `?`), con las listas
+    de parámetros colapsadas y los espacios normalizados, para agrupar las ejecuciones de la misma consulta.
+    """
+    huella = _SQL_STRING.sub('?', query)
+    huella = _SQL_NUMBER.sub('?', huella)
+    huella = _SQL_LIST.sub('(...)', huella)
+    huella = _SQL_SPACES.sub(' ', huella).strip().rstrip(';').rstrip()
+    return huella[:FINGERPRINT_MAX]
+
+class Histogram:
+    """
+    Latencias de una serie: contadores, buckets fijos para Prometheus y un reservorio de
+    `reservoir_size` muestras (algoritmo R) del que se sacan p50/p95/p99 sin guardar cada observación.
+    """
+    def __init__(self, reservoir_size=METRICS_RESERVOIR_SIZE):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self._reservoir_size = reservoir_size
+        self._reservoir = []
+
+    def observe(self, seconds, error=False):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+        if len(self._reservoir) < self._reservoir_size:
+            self._reservoir.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self._reservoir_size:
+                self._reservoir[slot] = seconds
+
+    def percentiles(self, qs=PERCENTILES):
+        """Devuelve {q: segundos} por rango más cercano sobre el reservorio (0.0 si no hay muestras)."""
+        muestras = sorted(self._reservoir)
+        if not muestras:
+            return {q: 0.0 for q in qs}
+        return {q: muestras[min(len(muestras) - 1, max(0, math.ceil(q * len(muestras)) - 1))] for q in qs}
+
+    def cumulative_buckets(self):
+        """Pares (límite, observaciones <= límite) para exportar; el último límite es +Inf."""
+        acumulado, pares = 0, []
+        for limite, n in zip(BUCKETS, self.buckets):
+            acumulado += n
+            pares.append((limite, acumulado))
+        pares.append((math.inf, self.count))
+        return pares
+
+class Metrics:
+    """
+    Registro de histogramas por (tipo, nombre) de este proceso. Es seguro usarlo desde los hilos
+    de `asyncio.to_thread` (las sentencias SQL se miden dentro del hilo que las ejecuta).
+    """
+    def __init__(self):
+        self._series = {}
+        self._por_tipo = {}
+        self._lock = threading.Lock()
+        self.since = time.time()
+
+    def _histogram(self, tipo, nombre):
+        key = (tipo, nombre)
+        hist = self._series.get(key)
+        if hist is None:
+            if self._por_tipo.get(tipo, 0) >= METRICS_MAX_SERIES:
+                key = (tipo, OTRAS)
+                hist = self._series.get(key)
+            if hist is None:
+                hist = self._series[key] = Histogram()
+                self._por_tipo[tipo] = self._por_tipo.get(tipo, 0) + 1
+        return hist
+
+    def observe(self, tipo, nombre, seconds, error=False):
+        with self._lock:
+            self._histogram(tipo, nombre).observe(seconds, error)
+
+    def record_error(self, tipo, nombre):
+        """Cuenta un error sin duración (p. ej. un comando rechazado antes de ejecutarse)."""
+        with self._lock:
+            self._histogram(tipo, nombre).errors += 1
+
+    @contextmanager
+    def timer(self, tipo, nombre):
+        """Mide el bloque `with` (también con `await` dentro) y lo cuenta como error si lanza una excepción."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(tipo, nombre, time.perf_counter() - start, error=True)
+            raise
+        self.observe(tipo, nombre, time.perf_counter() - start)
+
+    async def timed(self, tipo, nombre, awaitable):
+        """Espera `awaitable` midiendo su duración."""
+        with self.timer(tipo, nombre):
+            return await awaitable
+
+    def series(self, tipo=None):
+        """Copia de [(tipo, nombre, Histogram)] para leerla sin bloquear a quien mide."""
+        with self._lock:
+            items = list(self._series.items())
+        return [(t, n, h) for (t, n), h in items if tipo is None or t == tipo]
+
+    def summary(self, tipo, limite=None):
+        """
+        Filas {'nombre', 'count', 'errors', 'total', 'max', 'p50', 'p95', 'p99'} de un tipo,
+        ordenadas por tiempo total (las que más tiempo consumen primero).
+        """
+        filas = []
+        for _, nombre, hist in self.series(tipo):
+            with self._lock:
+                p = hist.percentiles()
+                filas.append({'nombre': nombre, 'count': hist.count, 'errors': hist.errors, 'total': hist.total,
+                              'max': hist.max, 'p50': p[0.5], 'p95': p[0.95], 'p99': p[0.99]})
+        filas.sort(key=lambda fila: fila['total'], reverse=True)
+        return filas[:limite] if limite else filas
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._por_tipo.clear()
+            self.since = time.time()
+
+# Registro único del proceso: lo usan db_manager, el planificador de Gemini, los hooks de comandos y /metrics.
+metrics = Metrics()
+
+class StartupTimer:
+    """Duración de cada fase del arranque, medidas una tras otra desde `start` (`lap` cierra la fase actual)."""
+    def __init__(self, start=None):
+        self.start = self._last = start if start is not None else time.perf_counter()
+        self.phases = []
+        self.done = False
+
+    def lap(self, nombre):
+        now = time.perf_counter()
+        self.phases.append((nombre, now - self._last))
+        self._last = now
+
+    def report(self):
+        """Texto con cada fase y el total, p. ej. 'cogs: 0.84s | ... | total: 3.10s'."""
+        partes = [f"{nombre}: {segundos:.2f}s" for nombre, segundos in self.phases]
+        partes.append(f"total: {self._last - self.start:.2f}s")
+        return " | ".join(partes)
+
+def instrument_discord_http(bot):
+    """
+    Envuelve `bot.http.request`, por donde pasan todas las llamadas REST a Discord (envíos,
+    reacciones, borrados...), para medirlas por ruta (`POST /channels/{channel_id}/messages`).
+    Incluye la espera por los límites de tasa de Discord, que también es tiempo del usuario.
+    """
+    original = bot.http.request
+
+    async def request(route, **kwargs):
+        with metrics.timer(TIPO_API, f"discord {route.method} {route.path}"):
+            return await original(route, **kwargs)
+
+    bot.http.request = request
@@ -0,0 +1,120 @@
+import logging
+import math
+import asyncio
+from utils.db_manager import db_batch, db_execute
+
+log = logging.getLogger(__name__)
+
+# Filas por página y páginas que se piden por adelantado al navegar.
+PAGE_SIZE = 5
+PREFETCH_PAGES = 1
+
+class ListPageSource:
+    """Fuente de páginas ya renderizadas en memoria (el comportamiento clásico de PaginationView)."""
+    def __init__(self, pages):
+        self.pages = pages
+        self.total_pages = len(pages)
+
+    async def prepare(self):
+        return self.total_pages
+
+    async def get_page(self, index):
+        return self.pages[index]
+
+class KeysetPageSource:
+    """
+    Fuente de páginas que lee de la base de datos solo la página que se muestra, usando
+    paginación por clave (`timestamp`, `id`) en orden descendente en lugar de OFFSET.
+    Guarda el cursor de cada página visitada para poder volver atrás, mantiene en memoria
+    unas pocas páginas renderizadas y pide la siguiente en segundo plano.
+
+    `columns` y `table` forman el SELECT; `where_clauses`/`params` son los filtros;
+    `format_row(row)` devuelve el texto de una fila.
+    """
+    def __init__(self, table, columns, where_clauses, params, format_row, per_page=PAGE_SIZE, prefetch=PREFETCH_PAGES):
+        self.table = table
+        self.columns = columns
+        self.where_clauses = list(where_clauses)
+        self.params = list(params)
+        self.format_row = format_row
+        self.per_page = per_page
+        self.prefetch = prefetch
+        self.total_rows = 0
+        self.total_pages = 0
+        # _cursors[i] es la clave (timestamp, id) de la última fila de la página i - 1 (None para la primera).
+        self._cursors = [None]
+        self._pages = {}
+        self._pending = {}
+
+    def _page_query(self, cursor):
+        clauses = list(self.where_clauses)
+        params = list(self.params)
+        if cursor is not None:
+            clauses.append("(timestamp, id) < (%s, %s)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"SELECT {self.columns}, id FROM {self.table} {where} ORDER BY timestamp DESC, id DESC LIMIT %s"
+        return query, tuple(params + [self.per_page])
+
+    def _store(self, index, rows):
+        """Renderiza la página y registra el cursor de la siguiente."""
+        if rows and len(self._cursors) == index + 1:
+            last = rows[-1]
+            self._cursors.append((last['timestamp'], last['id']))
+        self._pages[index] = "".join(self.format_row(row) for row in rows)
+        # Solo se conservan las páginas cercanas a la actual; el resto se vuelve a pedir si hace falta.
+        for old in [i for i in self._pages if abs(i - index) > self.prefetch + 1]:
+            del self._pages[old]
+        return self._pages[index]
+
+    async def prepare(self):
+        """Obtiene el total de filas y la primera página en una sola ida y vuelta a la base de datos."""
+        where = f"WHERE {' AND '.join(self.where_clauses)}" if self.where_clauses else ""
+        count_row, rows = await db_batch([
+            (f"SELECT COUNT(*) FROM {self.table} {where}", tuple(self.params), 'one'),
+            (*self._page_query(None), 'all'),
+        ])
+        self.total_rows = count_row[0]
+        self.total_pages = math.ceil(self.total_rows / self.per_page)
+        if rows:
+            self._store(0, rows)
+            self._schedule_prefetch(0)
+        return self.total_pages
+
+    async def _fetch(self, index):
+        # Las páginas se recorren de una en una, así que el cursor de la anterior ya es conocido.
+        while len(self._cursors) <= index:
+            known = len(self._cursors)
+            await self._fetch(known - 1)
+            if len(self._cursors) == known:
+                # Se borraron filas desde el conteo inicial y la página ya no existe.
+                return ""
+        rows = await db_execute(*self._page_query(self._cursors[index]), fetch='all')
+        return self._store(index, rows)
+
+    def _schedule_prefetch(self, index):
+        for ahead in range(index + 1, min(index + 1 + self.prefetch, self.total_pages)):
+            if ahead not in self._pages and ahead not in self._pending and ahead < len(self._cursors):
+                task = asyncio.create_task(self._fetch(ahead))
+                self._pending[ahead] = task
+                task.add_done_callback(lambda t, ahead=ahead: self._prefetch_done(ahead, t))
+
+    def _prefetch_done(self, index, task):
+        self._pending.pop(index, None)
+        # Un fallo en la precarga no es grave: la página se volverá a pedir al mostrarla.
+        if not task.cancelled() and task.exception():
+            log.warning("Error al precargar la página %s: %s", index + 1, task.exception())
+
+    async def get_page(self, index):
+        """Devuelve el texto de la página `index` (empezando en 0)."""
+        if index in self._pages:
+            page = self._pages[index]
+        elif index in self._pending:
+            try:
+                page = await asyncio.shield(self._pending[index])
+            except Exception:
+                page = await self._fetch(index)
+        else:
+            page = await self._fetch(index)
+        self._schedule_prefetch(index)
+        return page
@@ -0,0 +1,120 @@
+import logging
+import os
+from collections import OrderedDict
+from utils.ia_cache import render_hoja_personaje
+from utils.gemini_scheduler import PRIORIDAD_INTERACTIVA
+
+log = logging.getLogger(__name__)
+
+# Presupuesto de tokens para el prompt de texto de `!reply` (sin contar la imagen).
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '6000'))
+PROMPT_CACHE_SIZE = int(os.getenv('PROMPT_CACHE_SIZE', '128'))
+# Se incrementa cada vez que cambia el texto de WINGMAN_PROMPT; forma parte de la clave de otras cachés.
+PROMPT_VERSION = 1
+
+# Este es el cerebro del comando `!reply`. Define el rol, las reglas y el formato de salida de la IA.
+WINGMAN_PROMPT = """**ROL Y OBJETIVO (Wingman Digital):** Tu rol es ser un 'Wingman Digital'. Debes ser ingenioso, observador y seguro, pero nunca arrogante. Tu objetivo es mezclar humor sutil con curiosidad genuina para crear openers de conversación únicos y listos para copiar y pegar.
+
+**REGLAS CRÍTICAS DE COMPORTAMIENTO:**
+- **Humor Inteligente:** Prohibido usar expresiones genéricas como 'jajaja' o 'jejeje'. En su lugar, genera humor a través de auto-humor ligero, observaciones ingeniosas o preguntas con un toque de humor.
+- **Uso Estratégico de Emojis:** Incluye emojis en un máximo de 2 de las 5 frases de cada opción. Pueden ir al principio, en medio o al final para reforzar el tono. Usa 🤔/👀 para curiosidad, 😉/😏/😂 para complicidad/humor, y 🔥/🙌/🤯 para admiración.
+- **Banco de Expresiones Variadas:** Evita repetir "Wow". Usa alternativas como: 'Me quito el sombrero', 'Ojo con eso...', 'Ok, eso es impresionante', 'Uff, qué interesante', 'Vaya, eso sí que no me lo esperaba'.
+- **Basado en Evidencia:** Cada opener debe originarse en un detalle VISUAL de la foto o una frase EXACTA de la biografía.
+- **Sin Saludos ni Placeholders:** No uses "Hola" ni texto genérico como `[tu hobby]`.
+
+**ESTRUCTURA DE RESPUESTA OBLIGATORIA:**
+- Genera dos opciones separadas por `---`.
+- La primera debe titularse `**Opción 1:**` y la segunda `**Opción 2:**`.
+- Cada opción debe ser una secuencia de 5 frases enumeradas (1., 2., etc.).
+- **SALIDA LIMPIA:** No incluyas los nombres de los pasos (como 'El Gancho') en tu respuesta. Solo el texto de la conversación. No uses comillas (`""`).
+
+---
+**GUÍA DE ESTILO PARA CADA PASO (Debes seguir esta estructura)**
+
+**Formato A (Secuencia 5 Pasos):**
+1.  Empieza con una observación única y detallada. Usa expresiones como "Me quito el sombrero con..." o "Vaya, no esperaba ver...". Ideal para un emoji de admiración (🔥, 👀, 🤯).
+2.  Continúa relacionando lo que viste con una experiencia propia de forma graciosa. Ejemplo: "Yo intenté escalar una vez y creo que la pared se rio de mí 😂".
+3.  Sigue con una pregunta cerrada, casual y juguetona. Ejemplo: "Así que eres del equipo 'aventura' y no del equipo 'sofá y peli', ¿no? 😉".
+4.  Añade una frase que sirva de transición o una suposición juguetona sobre el tema.
+5.  Termina con una pregunta abierta y genuina. Puede ser sobre experiencias, gustos, o de forma más directa, sobre lo que buscas en una app de citas. Ejemplos: "Fuera de eso, ¿cuál es tu placer culposo más simple y divertido?" o "Hablando de aventuras, ¿cuál es la cualidad más importante que buscas en un compañero de viaje... o de vida? 😉".
+
+**Formato B (Secuencia Alternativa):**
+1.  Empieza con una observación original.
+2.  Sigue con una pregunta cerrada y directa sobre la observación.
+3.  Añade un comentario ingenioso que aporte valor o contexto.
+4.  Continúa relacionando el tema con una experiencia propia de forma graciosa.
+5.  Termina con una pregunta abierta que invite a compartir una anécdota o una reflexión ligera sobre citas. Ejemplo: "¿Cuál es la aventura más loca que te gustaría tener con alguien que conozcas aquí?"
+---"""
+
+SECCION_PERSONAJE = "\n\n**CONTEXTO ADICIONAL (TU PERSONAJE):**\n"
+SECCION_REGLAS = "\n\n**REGLAS ADICIONALES OBLIGATORIAS:**\n"
+
+def compose_reply_prompt(hoja_personaje, reglas_block):
+    """Une el prompt base con las secciones opcionales de personaje y reglas."""
+    partes = [WINGMAN_PROMPT]
+    if hoja_personaje: partes += [SECCION_PERSONAJE, hoja_personaje]
+    if reglas_block: partes += [SECCION_REGLAS, reglas_block]
+    return "".join(partes)
+
+class PromptBuilder:
+    """
+    Ensambla el prompt de `!reply` a partir de la plantilla fija y los fragmentos cacheados
+    de perfil y reglas. Cada combinación distinta (perfil, versión del perfil, versión de reglas)
+    se compone y se cuenta con `count_tokens` una sola vez. Si el historial del perfil hace
+    que el prompt supere el presupuesto, se descartan los datos más antiguos.
+    """
+    def __init__(self, bot, budget=PROMPT_TOKEN_BUDGET, max_entries=PROMPT_CACHE_SIZE):
+        self.bot = bot
+        self.budget = budget
+        self.max_entries = max_entries
+        self._prompts = OrderedDict()
+
+    async def _count_tokens(self, text):
+        """Cuenta tokens con la API de Gemini (por el planificador); si falla, usa una estimación de ~4 caracteres por token."""
+        try:
+            return await self.bot.gemini.count_tokens(text, priority=PRIORIDAD_INTERACTIVA)
+        except Exception as e:
+            log.warning("No se pudieron contar los tokens con Gemini, se usa una estimación: %s", e)
+            return len(text) // 4
+
+    def _recortar_datos(self, datos, reglas_block, tokens, prompt_len):
+        """Conserva los datos más recientes que caben en el presupuesto, estimando la proporción de tokens por carácter."""
+        tokens_por_caracter = tokens / max(prompt_len, 1)
+        disponibles = self.budget - tokens_por_caracter * len(compose_reply_prompt("", reglas_block))
+        conservados = []
+        for dato in reversed(datos):
+            coste = tokens_por_caracter * (len(dato) + 3)
+            if coste > disponibles:
+                break
+            conservados.append(dato)
+            disponibles -= coste
+        return list(reversed(conservados))
+
+    async def reply_prompt(self, nombre_perfil, perfil, reglas_block, reglas_version):
+        """
+        Devuelve una tupla (prompt, tokens) para `!reply`.
+        `perfil` es la entrada de IAContextCache (o None si no se usa perfil).
+        """
+        key = (nombre_perfil.lower() if perfil else None, perfil['version'] if perfil else 0, reglas_version)
+        cached = self._prompts.get(key)
+        if cached:
+            self._prompts.move_to_end(key)
+            return cached
+
+        hoja_personaje = perfil['hoja'] if perfil else ""
+        prompt = compose_reply_prompt(hoja_personaje, reglas_block)
+        tokens = await self._count_tokens(prompt)
+
+        if tokens > self.budget and perfil and perfil['datos']:
+            datos = self._recortar_datos(perfil['datos'], reglas_block, tokens, len(prompt))
+            log.warning("El prompt del perfil '%s' ocupa %s tokens (presupuesto %s). Se usan los %s datos más recientes de %s.",
+                        key[0], tokens, self.budget, len(datos), len(perfil['datos']))
+            prompt = compose_reply_prompt(render_hoja_personaje(key[0], datos), reglas_block)
+            tokens = await self._count_tokens(prompt)
+        elif tokens > self.budget:
+            log.warning("El prompt de !reply ocupa %s tokens y supera el presupuesto de %s.", tokens, self.budget)
+
+        self._prompts[key] = (prompt, tokens)
+        while len(self._prompts) > self.max_entries:
+            self._prompts.popitem(last=False)
+        return prompt, tokens
@@ -0,0 +1,58 @@
+import re
+
+# Configuración de búsqueda de texto creada por la migración 6 (español + unaccent).
+TS_CONFIG = 'es_unaccent'
+
+_TOKEN_RE = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+_WORD_RE = re.compile(r'\w+')
+
+def _lexemas(texto):
+    """Extrae las palabras de un texto sin signos de puntuación (no pueden llegar crudos a to_tsquery)."""
+    return _WORD_RE.findall(texto)
+
+def build_tsquery(consulta):
+    """
+    Traduce la sintaxis de búsqueda de `!buscar` a una expresión para `to_tsquery`:
+    - `palabra otra`: deben aparecer todas (AND).
+    - `"frase exacta"`: las palabras seguidas y en orden.
+    - `pref*`: palabras que empiezan por `pref`.
+    - `-palabra` o `-"frase"`: excluye los mensajes que la contienen.
+    - `OR` entre dos términos: basta con uno de ellos.
+    Devuelve None si la consulta no contiene ninguna palabra buscable.
+    """
+    grupos = [[]]
+    for match in _TOKEN_RE.finditer(consulta):
+        negado, frase, palabra = match.group(1), match.group(2), match.group(3)
+        if palabra is not None and palabra.upper() in ('OR', '|'):
+            if grupos[-1]:
+                grupos.append([])
+            continue
+
+        if frase is not None:
+            palabras = _lexemas(frase)
+            termino = " <-> ".join(palabras)
+            if len(palabras) > 1:
+                termino = f"({termino})"
+        else:
+            if palabra.startswith('-') and len(palabra) > 1:
+                negado, palabra = '-', palabra[1:]
+            prefijo = palabra.endswith('*')
+            palabras = _lexemas(palabra)
+            if prefijo and palabras:
+                palabras[-1] += ':*'
+            termino = " <-> ".join(palabras)
+            if len(palabras) > 1:
+                termino = f"({termino})"
+
+        if not palabras:
+            continue
+        grupos[-1].append(f"!{termino}" if negado else termino)
+
+    # Un grupo formado solo por exclusiones no puede buscarse por sí solo en el índice.
+    grupos = [g for g in grupos if any(not t.startswith('!') for t in g)]
+    if not grupos:
+        return None
+    partes = [" & ".join(g) for g in grupos]
+    if len(partes) == 1:
+        return partes[0]
+    return " | ".join(f"({p})" for p in partes)
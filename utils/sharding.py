@@ -0,0 +1,45 @@
+import os
+
+def parse_shard_ids(value):
+    """Convierte '0,1,4-7' en [0, 1, 4, 5, 6, 7]. Devuelve None si el valor está vacío."""
+    if not value:
+        return None
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            ids.append(int(part))
+    return sorted(set(ids))
+
+def shard_config_from_env():
+    """
+    Lee la configuración de shards del entorno:
+    - SHARD_COUNT: número total de shards. Si no se define (ni AUTO_SHARD), se usa un bot sin shards.
+    - SHARD_IDS: shards que gestiona este proceso (por defecto, todos).
+    - AUTO_SHARD=1 sin SHARD_COUNT: un solo proceso con el número de shards que recomienda Discord.
+    Devuelve None para el modo clásico o un dict con `shard_count` y `shard_ids` para AutoShardedBot.
+    """
+    shard_count = os.getenv('SHARD_COUNT')
+    if shard_count:
+        shard_count = int(shard_count)
+        shard_ids = parse_shard_ids(os.getenv('SHARD_IDS')) or list(range(shard_count))
+        invalidos = [i for i in shard_ids if not 0 <= i < shard_count]
+        if invalidos:
+            raise ValueError(f"SHARD_IDS contiene shards fuera de rango para SHARD_COUNT={shard_count}: {invalidos}")
+        return {'shard_count': shard_count, 'shard_ids': shard_ids}
+    if os.getenv('AUTO_SHARD', '0') == '1':
+        return {'shard_count': None, 'shard_ids': None}
+    return None
+
+def split_shards(shard_count, workers):
+    """Reparte los shards 0..shard_count-1 en `workers` rangos contiguos lo más iguales posible."""
+    base, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for worker in range(workers):
+        size = base + (1 if worker < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return [r for r in ranges if r]
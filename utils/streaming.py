@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+import discord
+
+log = logging.getLogger(__name__)
+
+# Segundos mínimos entre ediciones del mismo mensaje (Discord limita ~5 ediciones cada 5 s por canal).
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))
+MESSAGE_LIMIT = 2000
+EMBED_DESCRIPTION_LIMIT = 4096
+CURSOR = " ▌"
+
+def _split_point(text, limit):
+    """Busca el mejor punto de corte antes de `limit`: salto de línea, luego espacio, si no, corte duro."""
+    for separator in ("\n", " "):
+        index = text.rfind(separator, 0, limit)
+        if index > limit // 2:
+            return index + 1
+    return limit
+
+class StreamingMessage:
+    """
+    Muestra en Discord un texto que llega por fragmentos. Publica un mensaje con el primer fragmento
+    y lo edita como mucho cada STREAM_EDIT_INTERVAL segundos. Al superar el límite de 2000 caracteres
+    (o 4096 en la descripción de un embed) continúa en un mensaje nuevo.
+    """
+    def __init__(self, destination, embed_title=None, color=None, interval=STREAM_EDIT_INTERVAL):
+        self.destination = destination
+        self.embed_title = embed_title
+        self.color = color or discord.Color.blue()
+        self.interval = interval
+        self.limit = (EMBED_DESCRIPTION_LIMIT if embed_title else MESSAGE_LIMIT) - len(CURSOR)
+        self.text = ""
+        self.messages = []
+        self._current = ""
+        self._message = None
+        self._shown = None
+        self._last_edit = 0.0
+
+    def _payload(self, text):
+        if not self.embed_title:
+            return {'content': text}
+        title = self.embed_title if not self.messages or self._message is self.messages[0] else f"{self.embed_title} (cont.)"
+        return {'embed': discord.Embed(title=title, description=text, color=self.color)}
+
+    async def _render(self, text):
+        """Envía o edita el mensaje actual con `text`, si cambió."""
+        if text == self._shown:
+            return
+        if self._message is None:
+            self._message = await self.destination.send(**self._payload(text))
+            self.messages.append(self._message)
+        else:
+            await self._message.edit(**self._payload(text))
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+    async def feed(self, fragment):
+        """Añade un fragmento de texto y actualiza Discord si toca según la cadencia."""
+        if not fragment:
+            return
+        self.text += fragment
+        self._current += fragment
+        while len(self._current) > self.limit:
+            cut = _split_point(self._current, self.limit)
+            head, self._current = self._current[:cut], self._current[cut:]
+            await self._render(head)
+            self._message, self._shown = None, None
+        if self._message is None or time.monotonic() - self._last_edit >= self.interval:
+            await self._render(self._current + CURSOR)
+
+    async def close(self):
+        """Muestra el texto final sin el cursor."""
+        if self._current.strip():
+            await self._render(self._current)
+        return self.text
+
+async def send_chunked(destination, text, embed_title=None, color=None):
+    """Envía un texto ya completo repartiéndolo en varios mensajes si supera el límite de Discord."""
+    streaming = StreamingMessage(destination, embed_title=embed_title, color=color)
+    remaining = text
+    while len(remaining) > streaming.limit:
+        cut = _split_point(remaining, streaming.limit)
+        await streaming._render(remaining[:cut])
+        streaming._message, streaming._shown = None, None
+        remaining = remaining[cut:]
+    await streaming._render(remaining)
+    return streaming.messages
+
+async def _aclose(fragments):
+    """Cierra el generador (si lo es) para liberar su plaza en el planificador."""
+    if hasattr(fragments, 'aclose'):
+        await fragments.aclose()
+
+async def stream_to_discord(destination, fragments, embed_title=None, color=None):
+    """Consume un iterador asíncrono de texto mostrándolo en Discord y devuelve el texto completo."""
+    streaming = StreamingMessage(destination, embed_title=embed_title, color=color)
+    try:
+        async for fragment in fragments:
+            await streaming.feed(fragment)
+    except BaseException:
+        # Si el stream se corta a la mitad, se libera la plaza del planificador y se deja el texto recibido
+        # sin el cursor. Un fallo de esa limpieza (p. ej. Discord vuelve a fallar al editar) se registra
+        # sin tapar el error original, que es el que tratan los comandos.
+        try:
+            await _aclose(fragments)
+        except Exception as e:
+            log.warning("Error al cerrar el stream tras un fallo: %s", e)
+        try:
+            await streaming.close()
+        except discord.HTTPException as e:
+            log.warning("No se pudo mostrar el texto parcial tras un fallo: %s", e)
+        raise
+    await _aclose(fragments)
+    await streaming.close()
+    return streaming.text
@@ -0,0 +1,102 @@
+import os
+import asyncio
+from utils.content_cache import ContentCache, content_hash
+from utils.gemini_scheduler import PRIORIDAD_NORMAL
+
+# --- Configuración del Resumen por Bloques ---
+# Tokens estimados por bloque del registro de chat y por entrada del paso final.
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '4000'))
+# Resúmenes de bloque que se piden a Gemini a la vez (además de los límites del planificador).
+SUMMARY_MAP_CONCURRENCY = int(os.getenv('SUMMARY_MAP_CONCURRENCY', '3'))
+# Cuántos resúmenes parciales se combinan en cada paso de reducción.
+SUMMARY_REDUCE_FANIN = int(os.getenv('SUMMARY_REDUCE_FANIN', '6'))
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv('SUMMARY_CACHE_MAX_BYTES', str(2 * 1024 * 1024)))
+# Se incrementa al cambiar los prompts de este módulo para no reutilizar resúmenes antiguos.
+SUMMARY_PROMPT_VERSION = 1
+
+RESUMEN_PROMPT = "**TAREA:** Eres un asistente que resume conversaciones. Analiza el siguiente registro de chat y extrae los puntos, ideas o eventos más importantes. Presenta el resumen en una lista de viñetas (bullet points). Sé conciso y claro.\n\n**REGISTRO DE CHAT:**\n---\n{texto}\n---\n\n**RESUMEN:**"
+BLOQUE_PROMPT = "**TAREA:** Eres un asistente que resume conversaciones. El siguiente texto es solo un fragmento de un registro de chat más largo. Extrae en viñetas los puntos, ideas, decisiones y eventos importantes, conservando quién dijo qué cuando sea relevante. No añadas introducción ni conclusión.\n\n**FRAGMENTO DEL CHAT:**\n---\n{texto}\n---\n\n**PUNTOS CLAVE:**"
+COMBINAR_PROMPT = "**TAREA:** Los siguientes son resúmenes parciales, en orden cronológico, de partes consecutivas de una misma conversación. Combínalos en una única lista de viñetas sin repetir información, manteniendo el orden de los eventos.\n\n**RESÚMENES PARCIALES:**\n---\n{texto}\n---\n\n**PUNTOS CLAVE COMBINADOS:**"
+FINAL_PROMPT = "**TAREA:** Eres un asistente que resume conversaciones. Los siguientes son resúmenes parciales, en orden cronológico, de un registro de chat largo. Redacta el resumen final con los puntos, ideas o eventos más importantes de toda la conversación. Presenta el resumen en una lista de viñetas (bullet points). Sé conciso y claro.\n\n**RESÚMENES PARCIALES:**\n---\n{texto}\n---\n\n**RESUMEN:**"
+
+def estimate_tokens(text):
+    """Estimación de ~4 caracteres por token, suficiente para repartir bloques."""
+    return len(text) // 4 + 1
+
+def chunk_lines(lines, budget=SUMMARY_CHUNK_TOKENS):
+    """
+    Agrupa las líneas en bloques de como mucho `budget` tokens estimados, en orden.
+    El reparto es voraz desde el principio: añadir líneas al final solo cambia el último bloque,
+    así que los anteriores conservan su hash y su resumen cacheado.
+    """
+    max_chars = budget * 4
+    chunks, current, size = [], [], 0
+    for line in lines:
+        # Una línea más larga que el bloque se corta en trozos.
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [""]
+        for piece in pieces:
+            if current and size + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+class Summarizer:
+    """
+    Resumen map-reduce para registros largos. El registro se divide en bloques por presupuesto de tokens,
+    los bloques se resumen en paralelo (acotado) a través de `bot.gemini`, los resúmenes parciales se
+    combinan por grupos hasta que caben en un solo prompt y el resumen final se devuelve en streaming.
+    Los resúmenes de bloque y de grupo se guardan por hash de su contenido.
+    """
+    def __init__(self, bot, chunk_tokens=SUMMARY_CHUNK_TOKENS, concurrency=SUMMARY_MAP_CONCURRENCY, fanin=SUMMARY_REDUCE_FANIN):
+        self.bot = bot
+        self.chunk_tokens = chunk_tokens
+        self.fanin = max(2, fanin)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.cache = ContentCache(SUMMARY_CACHE_MAX_BYTES)
+
+    async def _summarize(self, template, text, priority):
+        """Pide a Gemini el resumen de `text` con la plantilla dada, reutilizando el cacheado si existe."""
+        key = content_hash(f"{SUMMARY_PROMPT_VERSION}\0{template}\0{text}")
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached.decode('utf-8')
+        async with self._semaphore:
+            response = await self.bot.gemini.generate(template.format(texto=text), priority=priority)
+        summary = response.text.strip()
+        await self.cache.put(key, summary.encode('utf-8'))
+        return summary
+
+    async def _reduce(self, summaries, priority):
+        """Combina los resúmenes por grupos de `fanin` hasta que caben juntos en un bloque."""
+        while len(summaries) > 1 and estimate_tokens("\n\n".join(summaries)) > self.chunk_tokens:
+            groups = [summaries[i:i + self.fanin] for i in range(0, len(summaries), self.fanin)]
+            summaries = await asyncio.gather(*(
+                self._summarize(COMBINAR_PROMPT, "\n\n".join(group), priority) if len(group) > 1 else asyncio.sleep(0, group[0])
+                for group in groups
+            ))
+        return list(summaries)
+
+    async def stream(self, lines, priority=PRIORIDAD_NORMAL):
+        """Generador asíncrono con el texto del resumen final de `lines`."""
+        chunks = chunk_lines(lines, self.chunk_tokens)
+        if len(chunks) == 1:
+            # Registro corto: una sola llamada, como siempre.
+            prompt = RESUMEN_PROMPT.format(texto=chunks[0])
+        else:
+            partials = await asyncio.gather(*(self._summarize(BLOQUE_PROMPT, chunk, priority) for chunk in chunks))
+            partials = await self._reduce(list(partials), priority)
+            prompt = FINAL_PROMPT.format(texto="\n\n".join(partials))
+
+        stream = self.bot.gemini.stream(prompt, priority=priority)
+        try:
+            async for fragment in stream:
+                yield fragment
+        finally:
+            await stream.aclose()
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,94 @@
+import io
+import os
+import asyncio
+import tempfile
+from utils.metrics import metrics, TIPO_API
+
+# --- Configuración de la Síntesis de Voz (ElevenLabs) ---
+# Calidades que se pueden pedir en `!audiolab calidad=<nombre> ...` y su `output_format` (MP3, frecuencia_bitrate).
+TTS_CALIDADES = {
+    'alta': 'mp3_44100_192',
+    'normal': 'mp3_44100_128',
+    'media': 'mp3_44100_64',
+    'baja': 'mp3_22050_32',
+}
+TTS_CALIDAD_POR_DEFECTO = os.getenv('TTS_CALIDAD', 'normal')
+# Bytes de audio que se guardan en memoria; a partir de ahí el archivo temporal pasa a disco.
+TTS_SPOOL_MAX_MEMORY = int(os.getenv('TTS_SPOOL_MAX_MEMORY', str(1024 * 1024)))
+# Límite de subida cuando no hay servidor (mensajes directos).
+TTS_DM_FILESIZE_LIMIT = 10 * 1024 * 1024
+
+class AudioTooLarge(Exception):
+    """Se lanza cuando el audio generado supera el límite de subida de Discord."""
+    def __init__(self, limit):
+        super().__init__(f"El audio supera el límite de subida de {limit / (1024 * 1024):.0f} MB.")
+        self.limit = limit
+
+def parse_calidad(texto):
+    """
+    Separa una opción inicial `calidad=<nombre>` del texto. Devuelve (output_format, texto restante)
+    o (None, mensaje de error) si la calidad no existe.
+    """
+    primera, _, resto = texto.partition(' ')
+    if not primera.lower().startswith('calidad='):
+        return TTS_CALIDADES.get(TTS_CALIDAD_POR_DEFECTO, TTS_CALIDADES['normal']), texto
+    nombre = primera.split('=', 1)[1].lower()
+    if nombre not in TTS_CALIDADES:
+        return None, f"Calidad no válida. Usa una de: {', '.join(TTS_CALIDADES)}."
+    return TTS_CALIDADES[nombre], resto.strip()
+
+def upload_limit(guild):
+    """Tamaño máximo de archivo que se puede subir en `guild` (o en un mensaje directo)."""
+    return guild.filesize_limit if guild else TTS_DM_FILESIZE_LIMIT
+
+async def synthesize(client, voice_id, text, output_format, max_bytes):
+    """
+    Genera el audio con el cliente asíncrono de ElevenLabs y escribe los fragmentos según llegan en un
+    búfer en memoria hasta TTS_SPOOL_MAX_MEMORY y, a partir de ahí, en un archivo temporal en disco, así
+    cada petición ocupa una cantidad de memoria acotada. Si el audio pasa de `max_bytes` se corta la
+    descarga y se lanza AudioTooLarge. Devuelve el archivo (en la posición 0) y su tamaño; quien llama lo cierra.
+    """
+    # Se usa BytesIO/TemporaryFile en vez de SpooledTemporaryFile porque `discord.File` solo acepta objetos
+    # io.IOBase, y SpooledTemporaryFile no lo es hasta Python 3.11.
+    spool = io.BytesIO()
+    en_disco = False
+    size = 0
+    try:
+        with metrics.timer(TIPO_API, 'elevenlabs convert'):
+            stream = client.text_to_speech.convert(voice_id=voice_id, text=text, output_format=output_format)
+            try:
+                async for chunk in stream:
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise AudioTooLarge(max_bytes)
+                    if en_disco:
+                        # Las escrituras en disco se hacen en un hilo para no bloquear el event loop.
+                        await asyncio.to_thread(spool.write, chunk)
+                    elif size > TTS_SPOOL_MAX_MEMORY:
+                        spool = await asyncio.to_thread(_volcar_a_disco, spool, chunk)
+                        en_disco = True
+                    else:
+                        spool.write(chunk)
+            finally:
+                # Cierra la conexión HTTP también si se corta a mitad de la descarga.
+                aclose = getattr(stream, 'aclose', None)
+                if aclose:
+                    await aclose()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, size
+
+def _volcar_a_disco(buffer, chunk):
+    """Pasa lo acumulado en `buffer` (y `chunk`) a un archivo temporal en disco y cierra el búfer."""
+    archivo = tempfile.TemporaryFile()
+    try:
+        archivo.write(buffer.getvalue())
+        archivo.write(chunk)
+    except BaseException:
+        archivo.close()
+        raise
+    finally:
+        buffer.close()
+    return archivo
@@ -1,28 +1,42 @@
 import discord
+from utils.pagination import ListPageSource
 
 class PaginationView(discord.ui.View):
-    """Una vista para paginar embeds con botones de Anterior/Siguiente."""
+    """
+    Una vista para paginar embeds con botones de Anterior/Siguiente.
+    `pages` puede ser una lista de textos o una fuente con `prepare()` y `get_page(index)`
+    (por ejemplo, KeysetPageSource), que se consulta solo al mostrar cada página.
+    """
     def __init__(self, ctx, pages, title, color=discord.Color.blue()):
         super().__init__(timeout=180.0)
         self.ctx = ctx
-        self.pages = pages
+        self.source = ListPageSource(pages) if isinstance(pages, list) else pages
         self.title = title
         self.color = color
         self.current_page = 0
-        self.total_pages = len(self.pages)
+        self.current_text = ""
         self.message = None
-        self.update_buttons()
+
+    @property
+    def total_pages(self):
+        return self.source.total_pages
 
     def update_buttons(self):
         """Habilita o deshabilita los botones según la página actual."""
         self.children[0].disabled = self.current_page == 0
         self.children[1].disabled = self.current_page >= self.total_pages - 1
 
+    async def load_page(self, index):
+        """Obtiene el texto de la página `index` desde la fuente y la marca como actual."""
+        self.current_text = await self.source.get_page(index)
+        self.current_page = index
+        self.update_buttons()
+
     def create_embed(self):
         """Crea el embed para la página actual."""
         embed = discord.Embed(
             title=self.title,
-            description=self.pages[self.current_page],
+            description=self.current_text,
             color=self.color
         )
         embed.set_footer(text=f"Página {self.current_page + 1} de {self.total_pages}")
@@ -30,6 +44,9 @@ class PaginationView(discord.ui.View):
 
     async def start(self):
         """Envía el mensaje inicial con la primera página."""
+        if not self.total_pages:
+            await self.source.prepare()
+        await self.load_page(0)
         self.message = await self.ctx.send(embed=self.create_embed(), view=self)
 
     async def on_timeout(self):
@@ -46,8 +63,7 @@ class PaginationView(discord.ui.View):
             await interaction.response.send_message("No puedes usar estos botones.", ephemeral=True)
             return
         
-        self.current_page -= 1
-        self.update_buttons()
+        await self.load_page(self.current_page - 1)
         await interaction.response.edit_message(embed=self.create_embed(), view=self)
 
     @discord.ui.button(label="Siguiente", style=discord.ButtonStyle.primary)
@@ -56,6 +72,5 @@ class PaginationView(discord.ui.View):
             await interaction.response.send_message("No puedes usar estos botones.", ephemeral=True)
             return
 
-        self.current_page += 1
-        self.update_buttons()
+        await self.load_page(self.current_page + 1)
         await interaction.response.edit_message(embed=self.create_embed(), view=self)
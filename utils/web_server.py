@@ -0,0 +1,161 @@
+import logging
+import os
+import math
+import asyncio
+from aiohttp import web
+from utils.db_manager import db_execute, get_pool_stats
+from utils.metrics import metrics, TIPO_COMANDO, TIPO_SQL, TIPO_API
+from utils.logging_setup import dropped_records
+
+log = logging.getLogger(__name__)
+
+WEB_PORT = int(os.getenv('PORT', '8080'))
+# Tiempo máximo de la consulta de comprobación de /readyz.
+READY_DB_TIMEOUT = float(os.getenv('READY_DB_TIMEOUT', '2'))
+# Familia de Prometheus y etiqueta de cada tipo de serie de `metrics`.
+HISTOGRAMAS = {
+    TIPO_COMANDO: ('mibot_command', 'command', 'comandos'),
+    TIPO_SQL: ('mibot_sql', 'statement', 'sentencias SQL (por huella)'),
+    TIPO_API: ('mibot_api', 'api', 'llamadas a APIs externas'),
+}
+
+def gateway_connected(bot):
+    """Indica si la conexión con el gateway de Discord está abierta (en todos los shards de este proceso)."""
+    if bot.is_closed() or not bot.is_ready():
+        return False
+    shards = getattr(bot, 'shards', None)
+    if shards:
+        return all(not shard.is_closed() for shard in shards.values())
+    return bot.ws is not None and not math.isnan(bot.latency)
+
+def _metric(lines, name, value, help_text, kind='gauge', labels=None):
+    """Añade una métrica en formato de texto de Prometheus (con HELP/TYPE la primera vez)."""
+    if not any(line.startswith(f"# TYPE {name} ") for line in lines):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+    lines.append(f"{name}{_labels(labels)} {float(value)}")
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+def _histograms(lines, instance):
+    """Añade los histogramas de `metrics` (duración y errores por comando, sentencia SQL y API)."""
+    for tipo, (family, label, desc) in HISTOGRAMAS.items():
+        series = metrics.series(tipo)
+        if not series:
+            continue
+        lines.append(f"# HELP {family}_duration_seconds Duración de {desc}.")
+        lines.append(f"# TYPE {family}_duration_seconds histogram")
+        errores = []
+        for _, nombre, hist in series:
+            labels = dict(instance, **{label: nombre})
+            for limite, acumulado in hist.cumulative_buckets():
+                le = "+Inf" if math.isinf(limite) else repr(limite)
+                lines.append(f"{family}_duration_seconds_bucket{_labels(dict(labels, le=le))} {acumulado}")
+            lines.append(f"{family}_duration_seconds_sum{_labels(labels)} {hist.total}")
+            lines.append(f"{family}_duration_seconds_count{_labels(labels)} {hist.count}")
+            errores.append(f"{family}_errors_total{_labels(labels)} {hist.errors}")
+        lines.append(f"# HELP {family}_errors_total Errores en {desc}.")
+        lines.append(f"# TYPE {family}_errors_total counter")
+        lines.extend(errores)
+
+def render_metrics(bot):
+    """Genera el texto de /metrics a partir de los contadores del bot, el pool y las cachés."""
+    lines = []
+    # `instance` lo reserva Prometheus para el destino del scrape (lo renombraría a `exported_instance`).
+    instance = {'bot_instance': os.getenv('INSTANCE_ID', 'main')}
+    _metric(lines, 'mibot_up', 1 if gateway_connected(bot) else 0, 'Conexión con el gateway de Discord abierta.', labels=instance)
+    _metric(lines, 'mibot_guilds', len(bot.guilds), 'Servidores visibles por este proceso.', labels=instance)
+    for shard_id, latency in getattr(bot, 'latencies', [(None, bot.latency)]):
+        if not math.isnan(latency) and not math.isinf(latency):
+            _metric(lines, 'mibot_gateway_latency_seconds', latency, 'Latencia del heartbeat del gateway.', labels=dict(instance, shard=shard_id if shard_id is not None else 0))
+
+    pool = get_pool_stats()
+    _metric(lines, 'mibot_db_pool_in_use', pool['in_use'], 'Conexiones del pool en uso.', labels=instance)
+    _metric(lines, 'mibot_db_pool_max', pool['max_size'], 'Tamaño máximo del pool.', labels=instance)
+    _metric(lines, 'mibot_db_pool_checkouts_total', pool['checkouts'], 'Conexiones obtenidas del pool.', 'counter', instance)
+    _metric(lines, 'mibot_db_pool_wait_seconds_total', pool['wait_time_total'], 'Tiempo total esperando una conexión.', 'counter', instance)
+    _metric(lines, 'mibot_db_pool_timeouts_total', pool['timeouts'], 'Esperas del pool que agotaron el tiempo.', 'counter', instance)
+    _metric(lines, 'mibot_db_pool_discarded_total', pool['discarded'], 'Conexiones descartadas por estar rotas.', 'counter', instance)
+
+    gemini = bot.gemini.stats()
+    _metric(lines, 'mibot_gemini_in_flight', gemini['in_flight'], 'Peticiones a Gemini en curso.', labels=instance)
+    _metric(lines, 'mibot_gemini_waiting', gemini['waiting'], 'Peticiones a Gemini en cola.', labels=instance)
+    for key in ('requests', 'retries', 'failures', 'timeouts'):
+        _metric(lines, f'mibot_gemini_{key}_total', gemini[key], f'Contador de Gemini: {key}.', 'counter', instance)
+
+    ia_cache = bot.ia_cache.stats()
+    for key in ('hits', 'misses'):
+        if key in ia_cache:
+            _metric(lines, f'mibot_ia_cache_{key}_total', ia_cache[key], f'Caché de perfiles de IA: {key}.', 'counter', instance)
+
+    cambios = bot.change_listener.stats()
+    _metric(lines, 'mibot_change_listener_connected', 1 if cambios['connected'] else 0, 'Escucha de LISTEN/NOTIFY activa.', labels=instance)
+    _metric(lines, 'mibot_change_notifications_total', cambios['received'], 'Avisos de cambios recibidos.', 'counter', instance)
+    _metric(lines, 'mibot_log_dropped_total', dropped_records(), 'Registros de log descartados por la cola llena.', 'counter', instance)
+
+    _histograms(lines, instance)
+    return "\n".join(lines) + "\n"
+
+class WebServer:
+    """
+    Servidor HTTP de aiohttp que corre en el mismo bucle de eventos que el bot (sin hilos extra):
+    - `/`: 200 mientras el proceso esté vivo.
+    - `/healthz`: 200 si la conexión con el gateway de Discord está abierta, 503 si no.
+    - `/readyz`: 200 cuando el pool de BD responde y las cachés están cargadas.
+    - `/metrics`: métricas en formato de texto de Prometheus.
+    """
+    def __init__(self, bot, port=WEB_PORT):
+        self.bot = bot
+        self.port = port
+        self._runner = None
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/', self.root),
+            web.get('/healthz', self.healthz),
+            web.get('/readyz', self.readyz),
+            web.get('/metrics', self.metrics),
+        ])
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '0.0.0.0', self.port).start()
+        log.info("Servidor web iniciado en el puerto %s", self.port)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def root(self, request):
+        # Responde siempre mientras el proceso esté vivo (comprobación básica de la plataforma de hosting).
+        return web.Response(text="El bot está vivo.")
+
+    async def healthz(self, request):
+        if gateway_connected(self.bot):
+            return web.Response(text="ok")
+        return web.Response(status=503, text="gateway desconectado")
+
+    async def readyz(self, request):
+        problemas = []
+        if not gateway_connected(self.bot):
+            problemas.append("gateway desconectado")
+        if not getattr(self.bot, 'caches_warm', False):
+            problemas.append("cachés sin cargar")
+        if not get_pool_stats()['max_size']:
+            problemas.append("pool de BD sin iniciar")
+        else:
+            try:
+                await asyncio.wait_for(db_execute("SELECT 1", fetch='one'), READY_DB_TIMEOUT)
+            except Exception as e:
+                problemas.append(f"BD no responde: {type(e).__name__}")
+        if problemas:
+            return web.Response(status=503, text="; ".join(problemas))
+        return web.Response(text="ready")
+
+    async def metrics(self, request):
+        return web.Response(text=render_metrics(self.bot), content_type='text/plain', charset='utf-8')